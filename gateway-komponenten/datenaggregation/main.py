@@ -4,11 +4,11 @@ import sys
 from pathlib import Path
 from multiprocessing import shared_memory
 import threading
-import posix_ipc
 
 # local imports
 from opcua_client import OpcUaClientManager
 from modbus_tcp_client import ModbusClientManager
+from shm_snapshot import FORMAT_BINARY, HistoryWriter, SnapshotPublisher, history_segment_size, snapshot_segment_size
 
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger(__name__)
@@ -23,24 +23,35 @@ async def opcua_service() -> None:
     xsd_file_opcua = Path(path_base / "config/opcua-endpoints.xsd")
 
     opcua_interval = 1 # Interval in seconds
+    opcua_connect_timeout = 10 # Seconds to wait for the first connection before the tag catalog is published
     opcua_shm_name = 'opcua_shm'
-    opcua_shm_size = 1024*10
-    opcua_semaphore_name = 'opcua_semaphore'
-
-    # Prepare lists for shm and semaphore
-    opcua_shm_psmo = shared_memory.SharedMemory(name=f"{opcua_shm_name}_psmo", create=True, size=opcua_shm_size)
-    opcua_shm_interface = shared_memory.SharedMemory(name=f"{opcua_shm_name}_interface", create=True, size=opcua_shm_size)
-    opcua_shm_list = [opcua_shm_psmo, opcua_shm_interface]
-    
-    opcua_semaphore_psmo = posix_ipc.Semaphore(f"{opcua_semaphore_name}_psmo", posix_ipc.O_CREX)
-    opcua_semaphore_interface = posix_ipc.Semaphore(f"{opcua_semaphore_name}_interface", posix_ipc.O_CREX)
-    opcua_sem_list = [opcua_semaphore_psmo, opcua_semaphore_interface]
+    opcua_snapshot_format = FORMAT_BINARY # FORMAT_JSON as fallback
+    opcua_history_name = 'opcua_history'
+    opcua_history_min_tags = 512
+    opcua_history_capacity = 600 # Samples per tag
 
     opcua_manager = OpcUaClientManager(xml_config_file_opcua, xsd_file_opcua)
-    if await opcua_manager.start_clients() == []:
+    opcua_tags = opcua_manager.tag_catalog()
+    opcua_history_max_tags = max(opcua_history_min_tags, 2 * len(opcua_tags))
+
+    opcua_history_shm = shared_memory.SharedMemory(name=opcua_history_name, create=True,
+                                                   size=history_segment_size(opcua_history_max_tags, opcua_history_capacity))
+    opcua_history = HistoryWriter(opcua_history_shm, opcua_history_max_tags, opcua_history_capacity)
+
+    # One published segment sized from the tag catalog, the consumer partitions attach to it without any semaphore.
+    # It grows when tags are added at runtime (see shm_snapshot)
+    opcua_publisher = SnapshotPublisher(opcua_shm_name, snapshot_segment_size(opcua_tags), opcua_snapshot_format,
+                                        history=opcua_history)
+    _logger.info(f"OPC UA shared memory sized for {len(opcua_tags)} tags: {opcua_publisher.size} bytes per buffer.")
+
+    start_results = await opcua_manager.start_clients(opcua_connect_timeout)
+    # Browse names are resolved when connecting, nodes of servers that are not reachable yet are added at runtime.
+    # The catalog is published in any case (empty without clients), the consumers wait for it
+    opcua_publisher.publish_tag_catalog(opcua_manager.tag_catalog(resolved_only=True))
+    if start_results == []:
         _logger.error(f"Start clients returned empty list.")
         return
-    await opcua_manager.periodic_read(opcua_interval, opcua_shm_list, opcua_sem_list)
+    await opcua_manager.periodic_read(opcua_interval, opcua_publisher)
 
 def opcua_service_thread() -> None:
     """
@@ -62,21 +73,29 @@ async def modbus_tcp_service() -> None:
 
     modbus_interval = 1
     modbus_shm_name = 'modbus_shm'
-    modbus_shm_size = 1024*12
-    modbus_semaphore_name = 'modbus_semaphore'
-
-    # Prepare lists for shm and semaphore
-    modbus_shm_psmo = shared_memory.SharedMemory(name=f"{modbus_shm_name}_psmo", create=True, size=modbus_shm_size)
-    modbus_shm_interface = shared_memory.SharedMemory(name=f"{modbus_shm_name}_interface", create=True, size=modbus_shm_size)
-    modbus_shm_list = [modbus_shm_psmo, modbus_shm_interface]
-    
-    modbus_semaphore_psmo = posix_ipc.Semaphore(f"{modbus_semaphore_name}_psmo", posix_ipc.O_CREX)
-    modbus_semaphore_interface = posix_ipc.Semaphore(f"{modbus_semaphore_name}_interface", posix_ipc.O_CREX)
-    modbus_sem_list = [modbus_semaphore_psmo, modbus_semaphore_interface]
+    modbus_snapshot_format = FORMAT_BINARY # FORMAT_JSON as fallback
+    modbus_history_name = 'modbus_history'
+    modbus_history_min_tags = 512
+    modbus_history_capacity = 600 # Samples per tag
 
     modbus_manager = ModbusClientManager(xml_config_file_modbustcp, xsd_file_modbustcp)
+    modbus_tags = modbus_manager.tag_catalog()
+    modbus_history_max_tags = max(modbus_history_min_tags, 2 * len(modbus_tags))
+
+    modbus_history_shm = shared_memory.SharedMemory(name=modbus_history_name, create=True,
+                                                    size=history_segment_size(modbus_history_max_tags, modbus_history_capacity))
+    modbus_history = HistoryWriter(modbus_history_shm, modbus_history_max_tags, modbus_history_capacity)
+
+    # One published segment sized from the tag catalog, the consumer partitions attach to it without any semaphore.
+    # It grows when tags are added at runtime (see shm_snapshot)
+    modbus_publisher = SnapshotPublisher(modbus_shm_name, snapshot_segment_size(modbus_tags), modbus_snapshot_format,
+                                         history=modbus_history)
+    _logger.info(f"Modbus shared memory sized for {len(modbus_tags)} tags: {modbus_publisher.size} bytes per buffer.")
+    # The consumers build their address space from the catalog before the first value has been read
+    modbus_publisher.publish_tag_catalog(modbus_tags)
+
     await modbus_manager.start_clients()
-    await modbus_manager.periodic_read(modbus_interval, modbus_shm_list, modbus_sem_list)
+    await modbus_manager.periodic_read(modbus_interval, modbus_publisher)
 
 def modbus_tcp_service_thread() -> None:
     """
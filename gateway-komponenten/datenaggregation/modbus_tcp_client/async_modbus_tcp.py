@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import struct
+
+_logger = logging.getLogger(__name__)
+
+# MBAP header: transaction id, protocol id, length, unit id
+MBAP_HEADER = struct.Struct(">HHHB")
+READ_REQUEST = struct.Struct(">BHH")
+
+MODBUS_EXCEPTIONS = {
+    1: "Illegal function",
+    2: "Illegal data address",
+    3: "Illegal data value",
+    4: "Slave device failure",
+    5: "Acknowledge",
+    6: "Slave device busy",
+    10: "Gateway path unavailable",
+    11: "Gateway target device failed to respond",
+}
+
+
+class ModbusExceptionResponse(Exception):
+    """
+    Raised when the server answers a request with a Modbus exception response.
+    """
+    def __init__(self, function_code: int, exception_code: int):
+        self.function_code = function_code
+        self.exception_code = exception_code
+        super().__init__(f"FC{function_code:02d}: {MODBUS_EXCEPTIONS.get(exception_code, 'Unknown exception')} ({exception_code})")
+
+
+class AsyncModbusTcpClient:
+    """
+    Minimal asyncio Modbus/TCP client.
+    Requests are pipelined on a single connection and responses are matched to their requests by transaction id,
+    so several reads can be in flight at the same time without blocking the event loop.
+    """
+    def __init__(self, host: str, port: int = 502, unit_id: int = 1, timeout: float = 1.0, max_in_flight: int = 8):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._receive_task: asyncio.Task | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._transaction_id = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open(self) -> bool:
+        """
+        Open the TCP connection to the Modbus server.
+        return: True if the connection is established.
+        """
+        if self.is_open:
+            return True
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            _logger.debug(f"Connection to {self.host}:{self.port} failed: {e}")
+            self._reader, self._writer = None, None
+            return False
+        self._receive_task = asyncio.create_task(self._receive_loop())
+        return True
+
+    async def close(self) -> None:
+        """
+        Close the connection and fail all pending requests.
+        """
+        writer, self._writer = self._writer, None
+        if self._receive_task is not None and self._receive_task is not asyncio.current_task():
+            self._receive_task.cancel()
+        self._receive_task = None
+        self._fail_pending(ConnectionError(f"Connection to {self.host}:{self.port} closed."))
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def read_coils(self, address: int, quantity: int) -> list[bool]:
+        """
+        FC01: Read coils.
+        """
+        return self._unpack_bits(await self._read(1, address, quantity), quantity)
+
+    async def read_discrete_inputs(self, address: int, quantity: int) -> list[bool]:
+        """
+        FC02: Read discrete inputs.
+        """
+        return self._unpack_bits(await self._read(2, address, quantity), quantity)
+
+    async def read_holding_registers(self, address: int, quantity: int) -> list[int]:
+        """
+        FC03: Read holding registers.
+        """
+        data = await self._read(3, address, quantity)
+        return list(struct.unpack(f">{quantity}H", data[:2 * quantity]))
+
+    async def _read(self, function_code: int, address: int, quantity: int) -> bytes:
+        """
+        Send a read request and wait for the matching response.
+        return: The data bytes of the response (without function code and byte count).
+        """
+        pdu = await self._request(READ_REQUEST.pack(function_code, address, quantity))
+        expected = (quantity + 7) // 8 if function_code in (1, 2) else 2 * quantity
+        byte_count = pdu[1] if len(pdu) > 1 else None
+        if byte_count != expected or len(pdu) < 2 + expected:
+            raise ValueError(f"Malformed response to FC{function_code:02d} for {quantity} items at address {address}: "
+                             f"byte count {byte_count}, {len(pdu) - 2} data bytes (expected {expected}).")
+        return pdu[2:2 + byte_count]
+
+    async def _request(self, request_pdu: bytes) -> bytes:
+        if not self.is_open:
+            raise ConnectionError(f"Not connected to {self.host}:{self.port}.")
+        async with self._in_flight:
+            self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+            transaction_id = self._transaction_id
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = future
+            try:
+                self._writer.write(MBAP_HEADER.pack(transaction_id, 0, len(request_pdu) + 1, self.unit_id) + request_pdu)
+                await self._writer.drain()
+                response_pdu = await asyncio.wait_for(future, self.timeout)
+            finally:
+                self._pending.pop(transaction_id, None)
+
+        function_code = request_pdu[0]
+        if response_pdu[0] == function_code | 0x80:
+            raise ModbusExceptionResponse(function_code, response_pdu[1])
+        if response_pdu[0] != function_code:
+            raise ValueError(f"Unexpected function code {response_pdu[0]} in response to FC{function_code:02d}.")
+        return response_pdu
+
+    async def _receive_loop(self) -> None:
+        """
+        Read responses from the connection and resolve the future of the matching transaction.
+        """
+        try:
+            while True:
+                header = await self._reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, _ = MBAP_HEADER.unpack(header)
+                if protocol_id != 0 or length < 3:
+                    raise ValueError(f"Malformed MBAP header (protocol id {protocol_id}, length {length}).")
+                pdu = await self._reader.readexactly(length - 1)
+                future = self._pending.get(transaction_id)
+                if future is not None and not future.done():
+                    future.set_result(pdu)  # Late responses of timed out requests are dropped
+        except asyncio.CancelledError:
+            raise
+        except (OSError, asyncio.IncompleteReadError) as e:
+            _logger.warning(f"Connection to {self.host}:{self.port} lost: {e}")
+            await self.close()
+        except Exception as e:
+            # The stream cannot be resynchronized, close it so pending requests fail and the client reconnects
+            _logger.error(f"Invalid data from {self.host}:{self.port}, closing the connection: {e!r}")
+            await self.close()
+
+    def _fail_pending(self, exception: Exception) -> None:
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exception)
+        self._pending.clear()
+
+    @staticmethod
+    def _unpack_bits(data: bytes, quantity: int) -> list[bool]:
+        return [bool(data[i // 8] >> (i % 8) & 1) for i in range(quantity)]
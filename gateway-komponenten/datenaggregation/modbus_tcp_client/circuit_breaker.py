@@ -0,0 +1,72 @@
+import logging
+import random
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker that takes a flapping or unresponsive server out of the polling hot path.
+    After `failure_threshold` consecutive failed cycles the breaker opens and no requests are sent until
+    the backoff has elapsed. The backoff doubles with every failed probe (with jitter) up to `max_backoff`.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold: int = 3, base_backoff: float = 2.0, max_backoff: float = 60.0,
+                 jitter: float = 0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_count = 0
+        self._open_until = 0.0
+
+    def allow_request(self) -> bool:
+        """
+        Check whether the server may be polled in this cycle.
+        return: False while the breaker is open and the backoff has not elapsed.
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() < self._open_until:
+                return False
+            self.state = self.HALF_OPEN  # Let one probe cycle through
+        return True
+
+    def record_success(self) -> None:
+        """
+        Record a successful cycle and close the breaker.
+        """
+        if self.state != self.CLOSED:
+            _logger.info(f"Circuit breaker of {self.name} closed.")
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_count = 0
+
+    def record_failure(self, trip: bool = False) -> None:
+        """
+        Record a failed cycle. Opens the breaker if the threshold is reached or a half-open probe failed.
+        trip: Open the breaker regardless of the threshold, e.g. after a failed connection attempt.
+        """
+        self._consecutive_failures += 1
+        if trip or self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            backoff = min(self.base_backoff * 2 ** self._open_count, self.max_backoff)
+            backoff *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._open_until = time.monotonic() + backoff
+            self._open_count += 1
+            self.state = self.OPEN
+            _logger.warning(f"Circuit breaker of {self.name} opened for {backoff:.1f} s after {self._consecutive_failures} failed cycles.")
+
+    @property
+    def retry_in(self) -> float:
+        """
+        Seconds until the next probe is allowed (0 if the breaker is not open).
+        """
+        if self.state != self.OPEN:
+            return 0.0
+        return max(self._open_until - time.monotonic(), 0.0)
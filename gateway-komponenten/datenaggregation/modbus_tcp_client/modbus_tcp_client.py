@@ -1,38 +1,47 @@
 import asyncio
 import xml.etree.ElementTree as ET
-from pyModbusTCP.client import ModbusClient
-from pyModbusTCP.utils import test_bit, set_bit
-from multiprocessing import shared_memory
 import json
 import xmlschema
 import logging
 import os
 import time
-import posix_ipc
+
+from report_filter import ReportFilter, parse_deadband
+from scan_scheduler import ScanScheduler
+from shm_snapshot import SnapshotPublisher, SnapshotOverflowError
+from .async_modbus_tcp import AsyncModbusTcpClient, ModbusExceptionResponse
+from .circuit_breaker import CircuitBreaker
+from .read_plan import (ReadBlock, compile_read_plan, count_naive_requests, published_datatype, split_block,
+                        DEFAULT_MAX_GAP, SPLIT_EXCEPTION_CODES)
 
 _logger = logging.getLogger(__name__)
 
 class ModbusTCPClient:
-    def __init__(self, ipaddr: str, port: int, serveralias: str, endpoints: dict[str, dict[str, str | int | bool]]):
+    def __init__(self, ipaddr: str, port: int, serveralias: str, endpoints: dict[str, dict[str, str | int | bool]],
+                 max_gap: int = DEFAULT_MAX_GAP):
         self.ipaddr = ipaddr
         self.endpoints = endpoints
         self.serveralias = serveralias
-        self.client = ModbusClient(host=ipaddr, port=port, unit_id=1, auto_open=True)
-        self.client.timeout = 1.0
+        # One read plan per scan class (scan rate in seconds, None for the default interval)
+        scan_classes: dict[float | None, dict[str, dict[str, str | int | bool]]] = {}
+        for name, endpoint in endpoints.items():
+            scan_classes.setdefault(endpoint.get('scanrate'), {})[name] = endpoint
+        self.read_plans = {scanrate: compile_read_plan(group, max_gap) for scanrate, group in scan_classes.items()}
+        self.read_plan = [block for plan in self.read_plans.values() for block in plan]
+        self.client = AsyncModbusTcpClient(host=ipaddr, port=port, unit_id=1, timeout=1.0)
         self.status = self.client.is_open
-        self._last_connection_attempt_time = 0
-        self._retry_interval = 5
-    
-    def retry_connection(self) -> None:
+        self.breaker = CircuitBreaker(serveralias)
+        self._last_values: dict[str, dict[str, str | int | bool]] = {}
+        self.report_filter = ReportFilter({f"{serveralias}: {name}": endpoint['deadband']
+                                           for name, endpoint in endpoints.items()
+                                           if endpoint.get('deadband') is not None})
+
+    async def retry_connection(self) -> None:
         """
         Retry to connect to the ModbusTCP server.
+        Reconnect attempts are paced by the circuit breaker of the client: poll opens it after every failed attempt.
         """
-        current_time = time.time()
-        if current_time - self._last_connection_attempt_time < self._retry_interval:
-            return  # Do not attempt to reconnect if the retry interval has not passed
-        self._last_connection_attempt_time = current_time # Update the last connection attempt time
-
-        connected = self.client.open()
+        connected = await self.client.open()
         if connected:
             self.status = True
             _logger.info(f"(Re)connection to {self.client.host} successful.")  
@@ -40,7 +49,7 @@ class ModbusTCPClient:
             self.status = False
             _logger.error(f"Reconnection to {self.client.host} failed.")  
 
-    def fc01_read_coil_status(self, name: str) -> bool | None:
+    async def fc01_read_coil_status(self, name: str) -> bool | None:
         """
         Read coil status from the ModbusTCP server.
         name: The name of the endpoint to read.
@@ -49,10 +58,10 @@ class ModbusTCPClient:
         endpoint = self.endpoints[name]
         address = endpoint['address']
         quantity = endpoint['quantity']
-        request = self.client.read_coils(address, quantity)
+        request = await self.client.read_coils(address, quantity)
         return request[0]
 
-    def fc02_read_discrete_inputs(self, name: str) -> bool | None:
+    async def fc02_read_discrete_inputs(self, name: str) -> bool | None:
         """
         Read discrete inputs from the ModbusTCP server.
         name: The name of the endpoint to read.
@@ -61,10 +70,10 @@ class ModbusTCPClient:
         endpoint = self.endpoints[name]
         address = endpoint['address']
         quantity = endpoint['quantity']
-        request = self.client.read_discrete_inputs(address, quantity)
+        request = await self.client.read_discrete_inputs(address, quantity)
         return request[0]
 
-    def fc03_read_holding_registers(self, name: str) -> tuple[int | bool | None, str | None]:
+    async def fc03_read_holding_registers(self, name: str) -> tuple[int | bool | None, str | None]:
         """
         Read holding registers from the ModbusTCP server.
         name: The name of the endpoint to read.
@@ -76,9 +85,9 @@ class ModbusTCPClient:
         bit_offset = endpoint['offset']
 
         # Create a read registers request
-        request = self.client.read_holding_registers(address, quantity)
+        request = await self.client.read_holding_registers(address, quantity)
         if request is not None and bit_offset > -1:
-            value = test_bit(request[0], bit_offset)
+            value = bool(request[0] >> bit_offset & 1)
             datatype = "Boolean"# if bit_offset > -1 else "ByteString"
             return value, datatype
         elif request is not None and bit_offset == -1:
@@ -86,6 +95,161 @@ class ModbusTCPClient:
         else:
             return None, None
 
+    async def read_block(self, block: ReadBlock) -> dict[str, tuple[int | bool, str]]:
+        """
+        Read a block of the read plan with a single request and slice the response into per-endpoint values.
+        block: The read block to request from the ModbusTCP server.
+        return: A dictionary with the endpoint name as the key and a tuple of value and datatype as the value.
+        """
+        if block.function_code == 1:
+            response = await self.client.read_coils(block.address, block.quantity)
+        elif block.function_code == 2:
+            response = await self.client.read_discrete_inputs(block.address, block.quantity)
+        else:
+            response = await self.client.read_holding_registers(block.address, block.quantity)
+        return block.slice_response(response)
+
+    async def poll(self, budget: float, scan_classes: list[float | None] | None = None) -> dict[str, dict[str, str | int | bool]]:
+        """
+        Read the blocks of the due scan classes within the time budget of one cycle.
+        The requests are pipelined on the connection of this client. Blocks that are not answered before the
+        budget is used up, or that are skipped because the circuit breaker is open, carry their last good values
+        marked as stale.
+        budget: The time budget in seconds for this server in the current cycle.
+        scan_classes: The scan classes to read in this cycle (all scan classes if None).
+        return: A dictionary with the values of this server, including its connection and circuit breaker status.
+        """
+        values = {}
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        if scan_classes is None:
+            blocks = self.read_plan
+        else:
+            blocks = [block for scanrate in scan_classes for block in self.read_plans.get(scanrate, [])]
+        stale_blocks = blocks
+
+        if self.breaker.allow_request():
+            if not self.client.is_open:
+                try:
+                    await asyncio.wait_for(self.retry_connection(), budget)
+                except asyncio.TimeoutError:
+                    _logger.error(f"Reconnection to {self.client.host} exceeded the cycle budget.")
+                if not self.client.is_open:
+                    # The next attempt waits for the backoff of the breaker instead of blocking every cycle
+                    self.breaker.record_failure(trip=True)
+            if self.client.is_open:
+                stale_blocks, answered, connection_failed = await self._read_blocks_until(blocks, deadline, values)
+                # Slow blocks and exception responses only affect their own endpoints, not the breaker
+                if answered and not connection_failed:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+
+        for block in stale_blocks:
+            for endpoint in block.endpoints:
+                last_value = self._last_values.get(endpoint['name'])
+                if last_value is not None:
+                    values[f"{self.serveralias}: {endpoint['name']}"] = {**last_value, "stale": True}
+
+        values[f"ModbusTCP Connections:{self.serveralias}: Connection status"] = {
+                                        "value": self.client.is_open,
+                                        "varType": "Boolean",
+                                        "description": "Connection status to the Modbus server"
+                                    }
+        values[f"ModbusTCP Connections:{self.serveralias}: Circuit breaker"] = {
+                                        "value": self.breaker.state,
+                                        "varType": "String",
+                                        "description": "Circuit breaker state of the Modbus server (closed, open, half-open)"
+                                    }
+        return values
+
+    async def _read_blocks_until(self, blocks: list[ReadBlock], deadline: float,
+                                 values: dict[str, dict[str, str | int | bool]]) -> tuple[list[ReadBlock], bool, bool]:
+        """
+        Read the given blocks of the read plan until the deadline is reached.
+        Blocks the server rejects because of an unreadable address are split and read again in the same cycle.
+        blocks: The blocks to read.
+        deadline: The event loop time at which outstanding requests are cancelled.
+        values: The dictionary the read values are added to.
+        return: A tuple with the list of blocks that were not read in time, whether the server answered any request
+                (with values or an exception response) and whether a request failed because of the connection.
+        """
+        if not blocks:
+            return [], True, False
+
+        # TODO: Test with different endpoints and Modbus-Functions, e.g., Write Coils, Write Single Register, Write Multiple Registers
+        tasks = {asyncio.create_task(self.read_block(block)): block for block in blocks}
+        done, pending = await asyncio.wait(tasks, timeout=max(deadline - asyncio.get_running_loop().time(), 0))
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Collect the cancelled requests, a connection error racing the cancellation is retrieved here
+            await asyncio.gather(*pending, return_exceptions=True)
+            _logger.warning(f"Cycle budget of {self.serveralias} used up, {len(pending)} of {len(tasks)} blocks marked as stale.")
+
+        answered = False
+        connection_failed = False
+        split_blocks = []
+        for task in done:
+            block = tasks[task]
+            exception = task.exception()
+            if isinstance(exception, asyncio.TimeoutError):
+                pass  # Not answered in time, like the blocks still pending at the deadline
+            elif isinstance(exception, OSError):
+                connection_failed = True
+            else:
+                answered = True
+            if isinstance(exception, ModbusExceptionResponse) and exception.exception_code in SPLIT_EXCEPTION_CODES:
+                replacement = self._split_block(block, exception)
+                if replacement:
+                    split_blocks.extend(replacement)
+                    continue
+            if exception is not None:
+                _logger.error(f"Error reading {block} from {self.ipaddr} with alias {self.serveralias}: {exception!r}")
+                for endpoint in block.endpoints:
+                    values[f"{self.serveralias}: {endpoint['name']}"] = {
+                                                "value": "ERROR READING VALUE",
+                                                "varType": "String",
+                                                "description": f"{endpoint['description']}",
+                                                "status": "bad"
+                                            }
+                continue
+            for endpoint_name, (value, datatype) in task.result().items():
+                entry = {
+                    "value": value,
+                    "varType": datatype,
+                    "description": f"{self.endpoints[endpoint_name]['description']}"
+                }
+                values[f"{self.serveralias}: {endpoint_name}"] = entry
+                self._last_values[endpoint_name] = entry
+        stale_blocks = [tasks[task] for task in pending]
+        if split_blocks:
+            # Read the endpoints of the rejected blocks with the smaller requests in the same cycle
+            stale_split_blocks, _, split_connection_failed = await self._read_blocks_until(split_blocks, deadline, values)
+            stale_blocks.extend(stale_split_blocks)
+            connection_failed = connection_failed or split_connection_failed
+        return stale_blocks, answered, connection_failed
+
+    def _split_block(self, block: ReadBlock, exception: ModbusExceptionResponse) -> list[ReadBlock]:
+        """
+        Replace a block the server rejected with an exception response by one request per address in the read plan,
+        so one unreadable address only fails its own endpoints, in this and every following cycle.
+        block: The rejected block.
+        exception: The exception response of the server.
+        return: The requests replacing the block or an empty list if the block cannot be split.
+        """
+        blocks = split_block(block)
+        if len(blocks) < 2:
+            return []
+        for plan in self.read_plans.values():
+            for index, planned in enumerate(plan):
+                if planned is block:
+                    plan[index:index + 1] = blocks
+                    break
+        self.read_plan = [planned for plan in self.read_plans.values() for planned in plan]
+        _logger.warning(f"{self.serveralias} rejected {block} ({exception}), split into {len(blocks)} requests.")
+        return blocks
+
     # def write_coils(self, name, value):
     #     endpoint = self.endpoints[name]
     #     address = endpoint['address']
@@ -104,9 +268,14 @@ class ModbusTCPClient:
 
 
 class ModbusClientManager:
-    def __init__(self, xml_config_path: str, xsd_path: str):
+    def __init__(self, xml_config_path: str, xsd_path: str, max_gap: int = DEFAULT_MAX_GAP,
+                 max_parallel_servers: int = 16, server_cycle_budget: float | None = None):
         self.xml_config_path = xml_config_path
         self.xsd_path = xsd_path
+        self.max_gap = max_gap  # Default of the servers without `max_gap` in the XML configuration
+        self.max_gaps: dict[tuple[str, int, str], int] = {}  # Per server, filled by load_endpoints_from_xml
+        self.max_parallel_servers = max_parallel_servers
+        self.server_cycle_budget = server_cycle_budget
         self.endpoints = self.load_endpoints_from_xml()
         self.clients = self.create_clients()
 
@@ -121,7 +290,10 @@ class ModbusClientManager:
         else:
             for ipaddr, port, serveralias in self.endpoints:
                 client_endpoints = self.endpoints[(ipaddr, port, serveralias)]
-                modbus_client = ModbusTCPClient(ipaddr, port, serveralias, client_endpoints)
+                max_gap = self.max_gaps.get((ipaddr, port, serveralias), self.max_gap)
+                modbus_client = ModbusTCPClient(ipaddr, port, serveralias, client_endpoints, max_gap)
+                _logger.info(f"Read plan for {serveralias}: {len(modbus_client.read_plan)} requests per cycle "
+                             f"instead of {count_naive_requests(client_endpoints)}.")
                 modbus_clients.append(modbus_client)
         return modbus_clients
 
@@ -129,99 +301,76 @@ class ModbusClientManager:
         """
         Connect to the ModbusTCP servers.
         """
-        #await asyncio.gather(*(client.connect() for client in self.clients))
-        pass
+        await asyncio.gather(*(client.retry_connection() for client in self.clients))
 
     async def stop_clients(self) -> None:
         """
         Close the ModbusTCP connections.
         """
-        client: ModbusTCPClient
-        for client in self.clients:
-            client.client.close()
+        await asyncio.gather(*(client.client.close() for client in self.clients))
     
-    async def periodic_read(self, interval: float, shm_list: list[shared_memory.SharedMemory], semaphore_list: list[posix_ipc.Semaphore]) -> None:
+    def tag_catalog(self) -> list[tuple[str, str, str]]:
+        """
+        List the tags the clients publish, under the names and datatypes they are published with. Used to size the
+        shared memory segment and published as tag catalog before connecting. Endpoints that are not read are omitted.
+        return: A list of (name, datatype, description).
+        """
+        tags = []
+        for client in self.clients:
+            tags.append((f"ModbusTCP Connections:{client.serveralias}: Connection status", "Boolean",
+                         "Connection status to the Modbus server"))
+            tags.append((f"ModbusTCP Connections:{client.serveralias}: Circuit breaker", "String",
+                         "Circuit breaker state of the Modbus server (closed, open, half-open)"))
+            tags.extend((f"{client.serveralias}: {name}", published_datatype(endpoint), f"{endpoint['description']}")
+                        for name, endpoint in client.endpoints.items() if published_datatype(endpoint) is not None)
+        return tags
+
+    async def periodic_read(self, interval: float, publisher: SnapshotPublisher) -> None:
         """
         Periodically read the ModbusTCP values and write them to shared memory.
-        interval: The time interval in seconds between each read operation.
-        shm_list: A list of shared memory objects to write the ModbusTCP values to.
-        semaphore_list: A list of semaphores to control access to the shared memory objects.
+        interval: The default time interval in seconds between each read operation.
+                  Endpoints with a `scanrate` in the XML configuration are read on their own period.
+                  Each server gets a time budget of `server_cycle_budget` seconds per cycle
+                  (default: 80 % of the shortest due scan period).
+        publisher: The publisher of the shared memory segment. Any number of readers can attach to it.
+                   The segment grows when the snapshot does not fit.
+        Only the values that pass the report-by-exception filter of their client (deadbands and heartbeats configured
+        per endpoint) are published, the other tags keep their last reported value in the snapshot.
         """
         # Abort if no Modbus clients have been created
         if self.clients == []:
             _logger.error(f"Modbus client list is empty. Periodic value reading aborted.")
             return
 
+        # Servers are polled concurrently, the number of servers polled at the same time is bounded
+        limiter = asyncio.Semaphore(self.max_parallel_servers)
+        scan_periods = {scanrate: scanrate if scanrate is not None else interval
+                        for client in self.clients for scanrate in client.read_plans}
+        if not scan_periods:
+            scan_periods = {None: interval}  # Keep publishing the connection status of servers without endpoints
+        scheduler = ScanScheduler(scan_periods)
+        _logger.info(f"ModbusTCP scan classes: {sorted(scan_periods.values())} s")
+
+        async def poll_server(client: ModbusTCPClient, due: list[float | None], budget: float) -> dict[str, dict[str, str | int | bool]]:
+            async with limiter:
+                return await client.poll(budget, due)
+
+        # Values of scan classes that are not due keep their last read value in the published snapshot
+        modbus_values = {}
         while True:
-            modbus_values = {}
-            client: ModbusTCPClient
-            for client in self.clients:
-                if not client.client.is_open:
-                    client.retry_connection()
-                if not client.client.is_open: # Check again if the connection was successful
-                    modbus_values[f"ModbusTCP Connections:{client.serveralias}: Connection status"] = {
-                                                    "value": False,
-                                                    "varType": "Boolean",
-                                                    "description": "Connection status to the Modbus server"
-                                                }
-                if client.client.is_open:
-                    modbus_values[f"ModbusTCP Connections:{client.serveralias}: Connection status"] = {
-                                                    "value": True,
-                                                    "varType": "Boolean",
-                                                    "description": "Connection status to the Modbus server"
-                                                }
-                    for endpoint_name in client.endpoints:      
-                        # TODO: Test with different endpoints and Modbus-Functions, e.g., Write Coils, Write Single Register, Write Multiple Registers
-                        try:
-                            if client.endpoints[endpoint_name]['function'] == 'Read Holding Registers':
-                                register_values, datatype = client.fc03_read_holding_registers(endpoint_name)
-                                if register_values is not None and datatype is not None:
-                                    modbus_values[f"{client.serveralias}: {endpoint_name}"] = {
-                                                            "value": register_values,
-                                                            "varType": datatype,
-                                                            "description": f"{client.endpoints[endpoint_name]['description']}"
-                                                        }
-                            elif client.endpoints[endpoint_name]['function'] == 'Read Discrete Input':   
-                                discrete_input_values = client.fc02_read_discrete_inputs(endpoint_name)
-                                if discrete_input_values is not None:
-                                    modbus_values[f"{client.serveralias}: {endpoint_name}"] = {
-                                                            "value": discrete_input_values,
-                                                            "varType": "Boolean",
-                                                            "description": f"{client.endpoints[endpoint_name]['description']}"
-                                                        }
-                            elif client.endpoints[endpoint_name]['function'] == 'Read Coil Status' or client.endpoints[endpoint_name]['function'] == 'Read Coils':
-                                coil_status_values = client.fc01_read_coil_status(endpoint_name)
-                                if coil_status_values is not None:
-                                    modbus_values[f"{client.serveralias}: {endpoint_name}"] = {
-                                                            "value": coil_status_values,
-                                                            "varType": "Boolean",
-                                                            "description": f"{client.endpoints[endpoint_name]['description']}"
-                                                        }
-                        except Exception as e:
-                            _logger.error(f"Error reading {endpoint_name} from {client.ipaddr} with alias {client.serveralias}: {e}")
-                            modbus_values[f"{client.serveralias}: {endpoint_name}"] = {
-                                                        "value": "ERROR READING VALUE",
-                                                        "varType": "String",
-                                                        "description": f"{client.endpoints[endpoint_name]['description']}"
-                                                    }
-                            
-            # Write the modbus_values to shared memory with semaphore
-            for shm, sem in zip(shm_list, semaphore_list):
-                sem: posix_ipc.Semaphore
-                shm: shared_memory.SharedMemory
-
-                sem.release()
-                await asyncio.sleep(0.01)
-                sem.acquire()
-                shm_size = shm.size
-                modbus_values_json = json.dumps(modbus_values)
-                shm.buf[:shm_size] = b'\x00' * shm_size  # Clear the shared memory buffer
-                shm.buf[:len(modbus_values_json)] = modbus_values_json.encode('utf-8')
-
-                if len(modbus_values_json)/shm_size >= 0.9: # Log a warning if the shared memory is more than 90% full
-                    _logger.error(f"ModbusTCP Shared Memory     {len(modbus_values_json)}/{shm_size} bytes used (more than 90% full).")
-                sem.release()
-            await asyncio.sleep(interval)
+            due = await scheduler.wait_next()
+            budget = self.server_cycle_budget
+            if budget is None:
+                budget = 0.8 * min(scan_periods[scanrate] for scanrate in due)
+            results = await asyncio.gather(*(poll_server(client, due, budget) for client in self.clients))
+            for client, server_values in zip(self.clients, results):
+                modbus_values.update(client.report_filter.filter(server_values))
+
+            # Publish the modbus_values, readers pick up the new snapshot without any handshake
+            try:
+                publisher.write(modbus_values)
+            except SnapshotOverflowError as e:
+                _logger.error(f"ModbusTCP Shared Memory: {e}")
 
     def load_endpoints_from_xml(self) -> dict[tuple[str, int, str], dict[str, dict[str, str | int]]]:
         """
@@ -247,6 +396,9 @@ class ModbusClientManager:
             ipaddr = server.find('ipaddr').text
             port = int(server.find('port').text)
             serveralias = server.find('serveralias').text
+            max_gap = server.find('max_gap')
+            if max_gap is not None:
+                self.max_gaps[(ipaddr, port, serveralias)] = int(max_gap.text)
 
             # Create a dictionary to store the server's endpoints
             server_endpoints = {}
@@ -258,6 +410,8 @@ class ModbusClientManager:
                 offset = int(endpoint.find('offset').text)
                 type = endpoint.find('type').text
                 description = endpoint.find('description').text
+                scanrate = endpoint.find('scanrate')
+                deadband = parse_deadband(endpoint)
 
                 # Create a dictionary to store the endpoint details
                 endpoint_details = {
@@ -267,7 +421,9 @@ class ModbusClientManager:
                     'quantity': quantity,
                     'offset': offset,
                     'type': type,
-                    'description': description
+                    'description': description,
+                    'scanrate': int(scanrate.text) / 1000 if scanrate is not None else None,  # Milliseconds in the XML file
+                    'deadband': deadband
                 }
                 server_endpoints[name] = endpoint_details
 
@@ -0,0 +1,134 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Modbus function codes of the supported read functions (names as used in the XML configuration)
+FUNCTION_CODES = {
+    'Read Coil Status': 1,
+    'Read Coils': 1,
+    'Read Discrete Input': 2,
+    'Read Holding Registers': 3,
+}
+
+# Maximum quantity per request as defined by the Modbus application protocol specification
+MAX_QUANTITY = {
+    1: 2000,  # FC01 Read Coils
+    2: 2000,  # FC02 Read Discrete Inputs
+    3: 125,   # FC03 Read Holding Registers
+}
+
+# Unused addresses between two endpoints that are still read in the same block. Only contiguous endpoints are merged
+# by default, reading addresses nobody configured has to be enabled per server (`max_gap` in the XML configuration)
+DEFAULT_MAX_GAP = 0
+
+# Exception codes (illegal data address, illegal data value) after which a block is split into smaller requests
+SPLIT_EXCEPTION_CODES = (2, 3)
+
+
+def published_datatype(endpoint: dict[str, str | int]) -> str | None:
+    """
+    Datatype an endpoint is published with, see ReadBlock.slice_response.
+    endpoint: The endpoint details from the XML configuration.
+    return: The datatype or None if the function of the endpoint is not read.
+    """
+    function_code = FUNCTION_CODES.get(endpoint['function'])
+    if function_code is None:
+        return None
+    if function_code == 3 and endpoint['offset'] == -1:
+        return "UInt16"
+    return "Boolean"
+
+
+class ReadBlock:
+    """
+    A single Modbus read request covering one or more endpoints of the same function code.
+    """
+    def __init__(self, function_code: int, address: int, quantity: int, endpoints: list[dict[str, str | int]]):
+        self.function_code = function_code
+        self.address = address
+        self.quantity = quantity
+        self.endpoints = endpoints
+
+    @property
+    def end(self) -> int:
+        """
+        First address after the block.
+        """
+        return self.address + self.quantity
+
+    def slice_response(self, response: list[int | bool]) -> dict[str, tuple[int | bool, str]]:
+        """
+        Slice the response of a block read back into per-endpoint values.
+        response: The registers or bits returned for the whole block.
+        return: A dictionary with the endpoint name as the key and a tuple of value and datatype as the value.
+        """
+        values = {}
+        for endpoint in self.endpoints:
+            raw_value = response[endpoint['address'] - self.address]
+            if self.function_code == 3:
+                bit_offset = endpoint['offset']
+                if bit_offset > -1:
+                    values[endpoint['name']] = (bool(raw_value >> bit_offset & 1), "Boolean")
+                else:
+                    values[endpoint['name']] = (raw_value, "UInt16")
+            else:
+                values[endpoint['name']] = (bool(raw_value), "Boolean")
+        return values
+
+    def __repr__(self) -> str:
+        return f"ReadBlock(fc={self.function_code:02d}, address={self.address}, quantity={self.quantity}, endpoints={len(self.endpoints)})"
+
+
+def compile_read_plan(endpoints: dict[str, dict[str, str | int]], max_gap: int = DEFAULT_MAX_GAP) -> list[ReadBlock]:
+    """
+    Group the endpoints of one server by function code and merge adjacent or nearby addresses into block reads.
+    endpoints: The endpoint dictionary of one server as returned by ModbusClientManager.load_endpoints_from_xml.
+    max_gap: The maximum number of unused addresses between two endpoints that are still read in the same block.
+             Unused addresses must be readable on the device, otherwise the block fails with an exception response
+             and is split (see split_block). -1 only merges endpoints that share an address.
+    return: A list of read blocks ordered by function code and address.
+    """
+    by_function: dict[int, list[dict[str, str | int]]] = {}
+    for endpoint in endpoints.values():
+        function_code = FUNCTION_CODES.get(endpoint['function'])
+        if function_code is None:
+            continue  # Write functions and unsupported read functions are not part of the read plan
+        by_function.setdefault(function_code, []).append(endpoint)
+
+    plan = []
+    for function_code in sorted(by_function):
+        max_quantity = MAX_QUANTITY[function_code]
+        block: ReadBlock | None = None
+        for endpoint in sorted(by_function[function_code], key=lambda ep: ep['address']):
+            address = endpoint['address']
+            quantity = max(int(endpoint['quantity']), 1)
+            if block is not None:
+                new_end = max(block.end, address + quantity)
+                if address - block.end <= max_gap and new_end - block.address <= max_quantity:
+                    block.quantity = new_end - block.address
+                    block.endpoints.append(endpoint)
+                    continue
+                plan.append(block)
+            block = ReadBlock(function_code, address, min(quantity, max_quantity), [endpoint])
+        if block is not None:
+            plan.append(block)
+    return plan
+
+
+def split_block(block: ReadBlock) -> list[ReadBlock]:
+    """
+    Split a block into one request per address, for a device that rejected the block with an exception response.
+    Endpoints that share an address (bits of the same register) stay in one request.
+    block: The rejected block.
+    return: The requests replacing the block, a single block if it cannot be split any further.
+    """
+    return compile_read_plan({endpoint['name']: endpoint for endpoint in block.endpoints}, max_gap=-1)
+
+
+def count_naive_requests(endpoints: dict[str, dict[str, str | int]]) -> int:
+    """
+    Count the requests needed to read every endpoint on its own.
+    endpoints: The endpoint dictionary of one server.
+    return: The number of readable endpoints.
+    """
+    return sum(1 for endpoint in endpoints.values() if endpoint['function'] in FUNCTION_CODES)
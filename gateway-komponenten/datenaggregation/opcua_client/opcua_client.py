@@ -11,18 +11,23 @@ SecurityPolicyAes256Sha256RsaPss
 from asyncua.crypto.validator import CertificateValidator, CertificateValidatorOptions
 from asyncua.crypto.truststore import TrustStore
 from pathlib import Path
-from multiprocessing import shared_memory
 import json
 import xmlschema
 import logging
 import os
 import time
 
-import posix_ipc
+from datetime import datetime, timezone
 from typing import Optional
 
+from report_filter import ReportFilter, parse_deadband
+from scan_scheduler import ScanScheduler
+from shm_snapshot import SnapshotPublisher, SnapshotOverflowError
+
 _logger = logging.getLogger(__name__)
 
+DISCONNECT_TIMEOUT = 2.0  # Seconds to close the session of a failed connection attempt
+
 SECURITY_POLICY_MAP = {
     "SecurityPolicyNone": None,
     "SecurityPolicyBasic128Rsa15": SecurityPolicyBasic128Rsa15,
@@ -32,19 +37,72 @@ SECURITY_POLICY_MAP = {
     "SecurityPolicyAes256Sha256RsaPss": SecurityPolicyAes256Sha256RsaPss,
 }
 
+def _to_epoch(timestamp: datetime | None) -> float:
+    """
+    Convert an OPC UA timestamp (UTC, naive or timezone aware) to seconds since the epoch
+    """
+    if timestamp is None:
+        return time.time()
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+class SubscriptionHandler:
+    """
+    Handler for data change notifications of an OPC UA subscription.
+    Every notification updates the in-memory value table of the client, which periodic_read flushes to shared memory.
+    """
+    def __init__(self, opcua_client: "OpcUaClient"):
+        self._client = opcua_client
+
+    def datachange_notification(self, node, val, data) -> None:
+        node_info = self._client.nodes_by_id.get(node.nodeid)
+        if node_info is None or not node_info.get('browse_name'):
+            return
+        data_value: ua.DataValue = data.monitored_item.Value
+        if data_value.StatusCode.is_good():
+            self._client.value_table[node_info['browse_name']] = {
+                "value": val,
+                "varType": node_info['varType'],
+                "description": f"{node_info['description']}",
+                "timestamp": _to_epoch(data_value.SourceTimestamp)
+            }
+        else:
+            _logger.error(f"Bad data change notification from {node.nodeid}: {data_value.StatusCode}")
+            self._client.value_table[node_info['browse_name']] = {
+                "value": "Error reading value",
+                "varType": "String",
+                "description": f"{node_info['description']}",
+                "status": "bad"
+            }
+
+    def status_change_notification(self, status) -> None:
+        _logger.error(f"Subscription status of {self._client.server_app_uri} changed: {status}")
+        self._client.connected = False
+
+
 class OpcUaClient:
     def __init__(self, server_app_uri: str, client_app_uri: str, alias: str, 
                  security_settings: dict[str, str | None],
-                   nodes: list[dict[str, ua.NodeId | str]]):
+                   nodes: list[dict[str, ua.NodeId | str]],
+                 acquisition_settings: dict[str, str | float | int] | None = None):
         self.server_app_uri = server_app_uri
         self.security_settings = security_settings
+        self.acquisition_settings = acquisition_settings or {'mode': 'polling'}
         self.alias = alias
         self.client = Client(url=server_app_uri)
         self.client.application_uri = client_app_uri
         self.nodes = nodes
-        self.connected = False
+        self.nodes_by_id = {node['node_id']: node for node in nodes}
+        self.report_filter = ReportFilter()  # Deadbands are keyed by browse name, added when the nodes are resolved
+        self.value_table: dict[str, dict[str, str | int | float | bool]] = {}  # Filled by data change notifications
+        self._subscription = None
+        self._last_values: dict[str, dict[str, str | int | float | bool]] = {}
+        self.connected = False  # True once the session is open and the nodes are resolved
+        self._reconnect_task: asyncio.Task | None = None
         self._retry_interval = 5
         self._last_connection_attempt_time = 0
+        self._max_nodes_per_read = 0  # 0: no operation limit
 
     async def connect(self) -> None:
         cert_base = Path(__file__).parent
@@ -55,11 +113,9 @@ class OpcUaClient:
             self.client.set_password(self.security_settings['password'])
         if policy == 'SecurityPolicyNone':
             try:
-                await self.client.connect()
-                self.connected = True
+                await self._establish()
                 _logger.warning(f"Connected to {self.server_app_uri}")
             except Exception as e:
-                self.connected = False
                 _logger.error(f"Error connecting to {self.server_app_uri}.")
         else:
             client_cert = Path(cert_base / self.security_settings['client_certificate'])
@@ -78,11 +134,9 @@ class OpcUaClient:
             validator = CertificateValidator(CertificateValidatorOptions.TRUSTED_VALIDATION | CertificateValidatorOptions.PEER_SERVER, trust_store)
             self.client.certificate_validator = validator
             try:
-                await self.client.connect()
-                self.connected = True
+                await self._establish()
                 _logger.info(f"Connected to {self.server_app_uri}")
             except Exception as e:
-                self.connected = False
                 _logger.error(f"Error connecting to {self.server_app_uri}.")
 
 
@@ -98,13 +152,235 @@ class OpcUaClient:
         self._last_connection_attempt_time = current_time  # Update the last connection attempt time
         
         try:
-            await self.client.connect()
-            self.connected = True
+            await self._establish()
             _logger.info(f"(Re)connection to {self.server_app_uri} successful.")
         except Exception as e:
-            self.connected = False
             _logger.error(f"Reconnection to {self.server_app_uri} failed.")
 
+    def start_reconnect(self) -> None:
+        """
+        Start a reconnection attempt in the background. Connecting and resolving the nodes then run in their own task
+        and are neither bounded nor cancelled by the deadline of a poll.
+        """
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self.retry_connection())
+
+    async def _establish(self) -> None:
+        """
+        Open the session and resolve the nodes. The client only counts as connected once the nodes are resolved, so
+        a resolution that failed or was cancelled is repeated with the next connection attempt instead of leaving the
+        nodes unread until the next reconnect.
+        """
+        self.connected = False
+        try:
+            await self.client.connect()
+            await self._after_connect()
+        except BaseException:
+            await self._discard_session()  # Also on cancellation, so the next attempt starts with a fresh session
+            raise
+        self.connected = True
+
+    async def _discard_session(self) -> None:
+        """
+        Close the session of a failed connection attempt, including the watchdog tasks of the client.
+        """
+        try:
+            await asyncio.wait_for(self.client.disconnect(), DISCONNECT_TIMEOUT)
+        except Exception:
+            self.client.disconnect_socket()
+
+
+    @property
+    def subscription_mode(self) -> bool:
+        return self.acquisition_settings['mode'] == 'subscription'
+
+    async def _after_connect(self) -> None:
+        """
+        Resolve the configured nodes and, in subscription mode, create the subscription after (re)connecting.
+        """
+        await self.resolve_nodes()
+        if self.subscription_mode:
+            await self.subscribe()
+
+    async def subscribe(self) -> None:
+        """
+        Create a subscription with one monitored item per configured node.
+        Sampling interval, queue size and deadband are taken from the acquisition settings of the server.
+        """
+        settings = self.acquisition_settings
+        self.value_table.clear()
+        try:
+            self._subscription = await self.client.create_subscription(settings['publishing_interval'], SubscriptionHandler(self))
+            requests = []
+            for client_handle, node in enumerate(self.nodes, start=1):
+                if node['datatype'] == 'Object' or not node.get('browse_name'):
+                    continue
+                item_to_monitor = ua.ReadValueId()
+                item_to_monitor.NodeId = node['node_id']
+                item_to_monitor.AttributeId = ua.AttributeIds.Value
+
+                parameters = ua.MonitoringParameters()
+                parameters.ClientHandle = client_handle
+                parameters.SamplingInterval = settings['sampling_interval']
+                parameters.QueueSize = settings['queue_size']
+                parameters.DiscardOldest = True
+                if settings['deadband'] > 0:
+                    data_change_filter = ua.DataChangeFilter()
+                    data_change_filter.Trigger = ua.DataChangeTrigger.StatusValue
+                    data_change_filter.DeadbandType = ua.DeadbandType.Percent if settings['deadband_type'] == 'Percent' else ua.DeadbandType.Absolute
+                    data_change_filter.DeadbandValue = settings['deadband']
+                    parameters.Filter = data_change_filter
+
+                request = ua.MonitoredItemCreateRequest()
+                request.ItemToMonitor = item_to_monitor
+                request.MonitoringMode = ua.MonitoringMode.Reporting
+                request.RequestedParameters = parameters
+                requests.append(request)
+
+            results = await self._subscription.create_monitored_items(requests)
+            failed = [result for result in results if isinstance(result, ua.StatusCode)]
+            if failed:
+                _logger.error(f"{len(failed)} of {len(requests)} monitored items of {self.server_app_uri} could not be created: {failed[0]}")
+            _logger.info(f"Subscribed to {len(requests) - len(failed)} nodes of {self.server_app_uri}.")
+        except Exception as e:
+            _logger.error(f"Error creating subscription on {self.server_app_uri}: {e}")
+
+    async def resolve_nodes(self) -> None:
+        """
+        Resolve the browse names and datatypes of the configured nodes once after connecting and cache them
+        in the node dictionaries. Also reads the MaxNodesPerRead operation limit of the server.
+        :raises Exception: If the nodes could not be read, the connection attempt then fails
+        """
+        try:
+            max_nodes_node = self.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead))
+            self._max_nodes_per_read = int(await max_nodes_node.read_value() or 0)
+        except Exception:
+            self._max_nodes_per_read = 0  # The server does not publish the operation limit
+        _logger.info(f"MaxNodesPerRead of {self.server_app_uri}: {self._max_nodes_per_read or 'unlimited'}")
+
+        variable_nodes = [node for node in self.nodes if node['datatype'] != 'Object']
+        node_ids = [node['node_id'] for node in variable_nodes]
+        try:
+            browse_names = await self._bulk_read(node_ids, ua.AttributeIds.BrowseName)
+            data_values = await self._bulk_read(node_ids, ua.AttributeIds.Value)
+        except Exception as e:
+            _logger.error(f"Error resolving nodes of {self.server_app_uri}: {e}")
+            raise
+        for node, browse_name, data_value in zip(variable_nodes, browse_names, data_values):
+            if browse_name.StatusCode.is_good():
+                qualified_name = browse_name.Value.Value
+                node['browse_name'] = f"{qualified_name.NamespaceIndex}:{qualified_name.Name}"
+            else:
+                _logger.error(f"Error resolving browse name of {node['node_id']}: {browse_name.StatusCode}")
+                node['browse_name'] = None
+            if node['browse_name'] and node.get('deadband') is not None:
+                self.report_filter.deadbands[node['browse_name']] = node['deadband']
+            if data_value.StatusCode.is_good() and data_value.Value is not None:
+                node['varType'] = data_value.Value.VariantType.name
+            else:
+                node['varType'] = node['datatype']
+
+    async def _bulk_read(self, node_ids: list[ua.NodeId], attribute_id: ua.AttributeIds,
+                         timestamps: ua.TimestampsToReturn = ua.TimestampsToReturn.Neither) -> list[ua.DataValue]:
+        """
+        Read one attribute of many nodes with as few Read service calls as the MaxNodesPerRead limit allows
+        :param node_ids: The OPC UA node IDs to read from
+        :param attribute_id: The attribute to read
+        :param timestamps: The timestamps the server should return
+        :return: List of data values in the order of node_ids
+        """
+        results = []
+        chunk_size = self._max_nodes_per_read or max(len(node_ids), 1)
+        for start in range(0, len(node_ids), chunk_size):
+            params = ua.ReadParameters()
+            params.TimestampsToReturn = timestamps
+            for node_id in node_ids[start:start + chunk_size]:
+                read_value_id = ua.ReadValueId()
+                read_value_id.NodeId = node_id
+                read_value_id.AttributeId = attribute_id
+                params.NodesToRead.append(read_value_id)
+            results.extend(await self.client.uaclient.read(params))
+        return results
+
+    async def read_values(self, nodes: list[dict[str, ua.NodeId | str]]) -> list[ua.DataValue] | None:
+        """
+        Read value, status and source timestamp of many nodes with a single (chunked) Read request
+        :param nodes: The node dictionaries to read, browse names and datatypes must be resolved
+        :return: List of data values in the order of nodes or None if there was an error
+        """
+        try:
+            return await self._bulk_read([node['node_id'] for node in nodes], ua.AttributeIds.Value,
+                                         ua.TimestampsToReturn.Source)
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            _logger.error(f"Connection to {self.server_app_uri} lost while reading values: {e}")
+            self.connected = False
+            return None
+        except Exception as e:
+            _logger.error(f"Error reading values from {self.server_app_uri}: {e}")
+            return None
+
+    async def poll(self, due: list[float | None]) -> dict[str, dict[str, str | int | float | bool]]:
+        """
+        Read the nodes of the due scan classes (or flush the value table in subscription mode). While the server is
+        not connected only the connection status is returned and a reconnection is started in the background
+        :param due: The scan classes to read in this cycle
+        :return: Dictionary with the values of this server, including its connection status
+        """
+        values = {}
+        if not self.connected:
+            self.start_reconnect()
+        values[f"OPC UA Connections:{self.alias}"] = {
+                                        "value": self.connected,
+                                        "varType": "Boolean",
+                                        "description": "Connection status to the OPC UA server"
+                                    }
+        if not self.connected:
+            return values
+
+        if self.subscription_mode:
+            values.update(self.value_table)
+            self._last_values.update(self.value_table)
+            return values
+
+        due_nodes = [node for node in self.nodes
+                     if node['datatype'] != 'Object' and node['scanrate'] in due and node.get('browse_name')]
+        if not due_nodes:
+            return values
+        data_values = await self.read_values(due_nodes)
+        if data_values is None:
+            data_values = [None] * len(due_nodes)
+        for node, data_value in zip(due_nodes, data_values):
+            if data_value is not None and data_value.StatusCode.is_good():
+                entry = {
+                    "value": data_value.Value.Value,
+                    "varType": node['varType'],
+                    "description": f"{node['description']}",
+                    "timestamp": _to_epoch(data_value.SourceTimestamp)
+                }
+                values[node['browse_name']] = entry
+                self._last_values[node['browse_name']] = entry
+            else:
+                _logger.error(f"Error reading value from {node['node_id']}")
+                values[node['browse_name']] = {
+                                            "value": "Error reading value",
+                                            "varType": "String",
+                                            "description": f"{node['description']}",
+                                            "status": "bad"
+                                        }
+        return values
+
+    def stale_values(self) -> dict[str, dict[str, str | int | float | bool]]:
+        """
+        Last good values of this server marked as stale, used when the server missed the deadline of a cycle
+        :return: Dictionary with the stale values and the connection status of this server
+        """
+        values = {name: {**entry, "stale": True} for name, entry in self._last_values.items()}
+        values[f"OPC UA Connections:{self.alias}"] = {
+                                        "value": self.connected,
+                                        "varType": "Boolean",
+                                        "description": "Connection status to the OPC UA server"
+                                    }
+        return values
 
     async def read_value(self, node_id: ua.NodeId) -> tuple[str | None, Optional[any], str | None]:
         """
@@ -137,13 +413,16 @@ class OpcUaClient:
             _logger.error(f"Error writing value to {node_id}.")
 
     async def disconnect(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
         await self.client.disconnect()
         _logger.warning(f"Disconnected from {self.server_app_uri}")
 
 class OpcUaClientManager:
-    def __init__(self, xml_config_path: str | Path, xsd_path: str | Path):
+    def __init__(self, xml_config_path: str | Path, xsd_path: str | Path, server_timeout: float | None = None):
         self.xml_config_path = str(xml_config_path)
         self.xsd_path = str(xsd_path)
+        self.server_timeout = server_timeout
         self.clients: list[OpcUaClient] = self.parse_clients()
 
     def parse_clients(self) -> list[OpcUaClient]:
@@ -185,84 +464,107 @@ class OpcUaClientManager:
                 node_info = {
                     'node_id': ua.NodeId(int(node.find('Identifier').text), int(node.find('NamespaceIndex').text)),
                     'datatype': node.find('datatype').text,
-                    'description': node.find('description').text
+                    'description': node.find('description').text,
+                    'scanrate': int(node.find('scanrate').text) / 1000 if node.find('scanrate') is not None else None,  # Milliseconds in the XML file
+                    'deadband': parse_deadband(node)
                 }
                 nodes.append(node_info)
 
-            client = OpcUaClient(server_app_uri, client_app_uri, alias, security_settings, nodes)
+            acquisition = server.find('acquisition')
+            acquisition_settings = {'mode': 'polling'}
+            if acquisition is not None:
+                acquisition_settings = {
+                    'mode': acquisition.find('mode').text,
+                    'publishing_interval': float(acquisition.findtext('publishing_interval', '1000')),  # Milliseconds
+                    'sampling_interval': float(acquisition.findtext('sampling_interval', '0')),  # Milliseconds, 0: fastest practical rate
+                    'queue_size': int(acquisition.findtext('queue_size', '1')),
+                    'deadband': float(acquisition.findtext('deadband', '0')),
+                    'deadband_type': acquisition.findtext('deadband_type', 'Absolute')
+                }
+
+            client = OpcUaClient(server_app_uri, client_app_uri, alias, security_settings, nodes, acquisition_settings)
             clients.append(client)
         return clients
 
-    async def start_clients(self) -> list[None]:
+    async def start_clients(self, timeout: float | None = None) -> list[None]:
         """
         Connect to all OPC UA servers
+        :param timeout: Seconds to wait for each connection attempt (None: no limit). Servers that are not connected
+                        in time are reconnected in the background by periodic_read
         :return: A list of futures for the connection attempts
         """
-        future_list = await asyncio.gather(*(client.connect() for client in self.clients))
+        future_list = await asyncio.gather(*(self._start_client(client, timeout) for client in self.clients))
         return future_list
 
+    @staticmethod
+    async def _start_client(client: OpcUaClient, timeout: float | None) -> None:
+        try:
+            await asyncio.wait_for(client.connect(), timeout)
+        except asyncio.TimeoutError:
+            _logger.error(f"Connecting to {client.server_app_uri} took longer than {timeout} s, retrying in the background.")
 
-    async def periodic_read(self, interval: float,
-                            shm_list: list[shared_memory.SharedMemory],
-                            semaphore_list: list[posix_ipc.Semaphore]) -> None:
+
+    def tag_catalog(self, resolved_only: bool = False) -> list[tuple[str, str, str]]:
         """
-        Periodically read values from OPC UA nodes and write them to shared memory
-        :param interval: Time between reads in seconds
-        :param shm_list: List of shared memory objects to write to
-        :param semaphore_list: List of semaphores for synchronizing access to shared memory
+        List the tags the clients can publish, used to size the shared memory segment before connecting.
+        Browse names are only known after connecting, the node id stands in for the name of unresolved nodes.
+        :param resolved_only: Only list the nodes whose browse name has been resolved, under the name and datatype
+                              they are published with (used for the tag catalog published after connecting)
+        :return: A list of (name, datatype, description)
+        """
+        tags = []
+        for client in self.clients:
+            tags.append((f"OPC UA Connections:{client.alias}", "Boolean", "Connection status to the OPC UA server"))
+            for node in client.nodes:
+                if node['datatype'] == 'Object':
+                    continue
+                if node.get('browse_name'):
+                    tags.append((node['browse_name'], node['varType'], f"{node['description']}"))
+                elif not resolved_only:
+                    tags.append((str(node['node_id']), node['datatype'], f"{node['description']}"))
+        return tags
+
+    async def periodic_read(self, interval: float, publisher: SnapshotPublisher) -> None:
+        """
+        Periodically read values from OPC UA nodes and write them to shared memory.
+        Nodes with a `scanrate` in the XML configuration are read on their own period, all other nodes every `interval` seconds.
+        All servers are polled concurrently, each within its own timeout (`server_timeout`, default 80 % of the shortest
+        due scan period). Servers that miss the deadline are published with their last good values marked as stale.
+        Only the values that pass the report-by-exception filter of their client (deadbands and heartbeats configured
+        per node) are published, the other tags keep their last reported value in the snapshot.
+        :param interval: Default time between reads in seconds
+        :param publisher: Publisher of the shared memory segment, any number of readers can attach to it.
+                          The segment grows when the snapshot does not fit
         """
         client: OpcUaClient
+        scan_periods = {node['scanrate']: node['scanrate'] if node['scanrate'] is not None else interval
+                        for client in self.clients for node in client.nodes}
+        scan_periods.setdefault(None, interval)  # The connection status is published every interval
+        scheduler = ScanScheduler(scan_periods)
+        _logger.info(f"OPC UA scan classes: {sorted(scan_periods.values())} s")
+
+        # Values of scan classes that are not due keep their last read value in the published snapshot
+        opcua_values = {}
         while True:
-            opcua_values = {}
-            for client in self.clients:
-                if not client.connected:
-                    await client.retry_connection()
-                    if not client.connected:
-                        opcua_values[f"OPC UA Connections:{client.alias}"] = {
-                                                     "value": client.connected,
-                                                     "varType": "Boolean",
-                                                     "description": "Connection status to the OPC UA server"
-                                                 }
-                else:
-                    opcua_values[f"OPC UA Connections:{client.alias}"] = {
-                                                    "value": client.connected,
-                                                    "varType": "Boolean",
-                                                    "description": "Connection status to the OPC UA server"
-                                                }
-                    for node in client.nodes:
-                        value = None
-                        browse_name = None
-                        if node['datatype'] != 'Object':
-                            browse_name, value, datatype = await client.read_value(node['node_id'])
-                            if value is not None:
-                                opcua_values[browse_name] = {
-                                                            "value": value,
-                                                            "varType": str(datatype),
-                                                            "description": f"{node['description']}"
-                                                        }
-                            else:
-                                _logger.error(f"Error reading value from {node['node_id']}")
-                                opcua_values[browse_name] = {
-                                                            "value": "Error reading value",
-                                                            "varType": "String",
-                                                            "description": f"{node['description']}"
-                                                        }
-            # Write the opcua_values to shared memory with semaphore protection
-            for shm, sem in zip(shm_list, semaphore_list):
-                sem: posix_ipc.Semaphore
-                shm: shared_memory.SharedMemory
-
-                sem.release()
-                await asyncio.sleep(0.01)
-                sem.acquire()
-                shm_size = shm.size
-                opcua_values_json = json.dumps(opcua_values)
-                shm.buf[:shm_size] = b'\x00' * shm_size  # Clear the shared memory buffer
-                shm.buf[:len(opcua_values_json)] = opcua_values_json.encode('utf-8')
-                if len(opcua_values_json)/shm_size > 0.9: # Log a warning if the shared memory is more than 90% full
-                    _logger.warning(f"ModbusTCP Shared Memory     {len(opcua_values_json)}/{shm_size} bytes used (more than 90% full).")
-                sem.release()
-            await asyncio.sleep(interval)
+            due = await scheduler.wait_next()
+            timeout = self.server_timeout
+            if timeout is None:
+                timeout = 0.8 * min(scan_periods[scanrate] for scanrate in due)
+            results = await asyncio.gather(*(asyncio.wait_for(client.poll(due), timeout) for client in self.clients),
+                                           return_exceptions=True)
+            for client, client_values in zip(self.clients, results):
+                if isinstance(client_values, asyncio.TimeoutError):
+                    _logger.warning(f"{client.alias} missed the deadline of {timeout:.2f} s, publishing last good values as stale.")
+                    client_values = client.stale_values()
+                elif isinstance(client_values, Exception):
+                    _logger.error(f"Error polling {client.alias}: {client_values!r}")
+                    client_values = client.stale_values()
+                opcua_values.update(client.report_filter.filter(client_values))
+            # Publish the opcua_values, readers pick up the new snapshot without any handshake
+            try:
+                publisher.write(opcua_values)
+            except SnapshotOverflowError as e:
+                _logger.error(f"OPC UA Shared Memory: {e}")
 
     async def stop_clients(self) -> None:
         """
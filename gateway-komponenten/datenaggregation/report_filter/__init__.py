@@ -0,0 +1,2 @@
+# __init__.py
+from .report_filter import Deadband, ReportFilter, parse_deadband
@@ -0,0 +1,109 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+_logger = logging.getLogger(__name__)
+
+DEADBAND_ABSOLUTE = 'Absolute'
+DEADBAND_PERCENT = 'Percent'
+
+
+class Deadband:
+    """
+    Report-by-exception settings of a tag.
+    A numeric value is only reported when it moved by more than the deadband since the last reported value. With
+    DEADBAND_ABSOLUTE the deadband is in the unit of the value, with DEADBAND_PERCENT it is a percentage of the last
+    reported value (the endpoint configuration has no engineering range to relate it to).
+    An unchanged value is reported again after `max_silence` seconds, so consumers can tell a quiet tag from a dead one.
+    """
+    def __init__(self, deadband: float = 0.0, deadband_type: str = DEADBAND_ABSOLUTE, max_silence: float | None = None):
+        """
+        :param deadband: Deadband, 0 reports every change
+        :param deadband_type: DEADBAND_ABSOLUTE or DEADBAND_PERCENT
+        :param max_silence: Seconds after which the value is reported even if it did not change (None: never)
+        """
+        if deadband_type not in (DEADBAND_ABSOLUTE, DEADBAND_PERCENT):
+            raise ValueError(f"Unknown deadband type {deadband_type!r}.")
+        self.deadband = deadband
+        self.deadband_type = deadband_type
+        self.max_silence = max_silence
+
+    def exceeded(self, last_value: int | float, value: int | float) -> bool:
+        """
+        Check whether a numeric value left the deadband around the last reported value.
+        """
+        if self.deadband_type == DEADBAND_PERCENT:
+            return abs(value - last_value) > self.deadband / 100 * abs(last_value)
+        return abs(value - last_value) > self.deadband
+
+
+def parse_deadband(element: ET.Element) -> Deadband | None:
+    """
+    Read the optional `deadband`, `deadband_type` and `max_silence` (milliseconds) elements of a node or endpoint
+    of the XML configuration.
+    :return: The settings or None if the element has none of them
+    """
+    deadband = element.findtext('deadband')
+    max_silence = element.findtext('max_silence')
+    if deadband is None and max_silence is None:
+        return None
+    return Deadband(float(deadband or 0), element.findtext('deadband_type', DEADBAND_ABSOLUTE),
+                    int(max_silence) / 1000 if max_silence is not None else None)  # Milliseconds in the XML file
+
+
+class ReportFilter:
+    """
+    Report-by-exception filter of a client. Takes the values read in a cycle and returns only the entries worth
+    publishing: new tags, changes of status, type or description, numeric values outside their deadband, any change
+    of other values, and heartbeats of tags that were silent for `max_silence` seconds.
+    Entries that are not returned keep their last reported entry in the published snapshot, so the shared memory
+    writer does not see them as changed and downstream work scales with the number of meaningful changes.
+    """
+    def __init__(self, deadbands: dict[str, Deadband] | None = None):
+        """
+        :param deadbands: Dictionary mapping tag names to their settings, tags without settings are reported on
+                          every change. The dictionary may be filled later (e.g. after browse names are resolved)
+        """
+        self.deadbands = deadbands if deadbands is not None else {}
+        self._reported: dict[str, tuple[dict[str, str | int | float | bool], float]] = {}  # Last entry and time
+        self.reported = 0
+        self.suppressed = 0
+
+    def filter(self, values: dict[str, dict[str, str | int | float | bool]],
+               now: float | None = None) -> dict[str, dict[str, str | int | float | bool]]:
+        """
+        Select the entries of a cycle that have to be published.
+        :param values: Dictionary mapping tag names to dicts with 'value', 'varType', 'description' and the optional
+                       keys 'timestamp', 'stale' and 'status'
+        :param now: Current time in seconds since the epoch (default: time.time())
+        :return: The entries to publish. Heartbeats carry `now` as timestamp, so the writer publishes them although
+                 the value did not change
+        """
+        if now is None:
+            now = time.time()
+        changes = {}
+        for name, entry in values.items():
+            last = self._reported.get(name)
+            deadband = self.deadbands.get(name)
+            if last is not None and not self._changed(last[0], entry, deadband):
+                if deadband is None or deadband.max_silence is None or now - last[1] < deadband.max_silence:
+                    self.suppressed += 1
+                    continue
+                entry = {**entry, 'timestamp': now}  # Heartbeat
+            self._reported[name] = (entry, now)
+            changes[name] = entry
+        self.reported += len(changes)
+        return changes
+
+    @staticmethod
+    def _changed(last: dict[str, str | int | float | bool], entry: dict[str, str | int | float | bool],
+                 deadband: Deadband | None) -> bool:
+        if (last['varType'] != entry['varType'] or last['description'] != entry['description']
+                or last.get('status') != entry.get('status') or bool(last.get('stale')) != bool(entry.get('stale'))):
+            return True
+        last_value, value = last['value'], entry['value']
+        if type(last_value) is not type(value):
+            return True
+        if deadband is not None and type(value) in (int, float):
+            return deadband.exceeded(last_value, value)
+        return last_value != value
@@ -0,0 +1,56 @@
+import asyncio
+import heapq
+import logging
+from typing import Hashable
+
+_logger = logging.getLogger(__name__)
+
+
+class ScanScheduler:
+    """
+    Heap-based scheduler for scan classes.
+    Each scan class is read on its own period. `wait_next` sleeps until the earliest scan class is due and
+    returns all scan classes that are due at that time, so groups with a common multiple are read together.
+    """
+    def __init__(self, periods: dict[Hashable, float], tolerance: float = 0.005):
+        """
+        :param periods: Dictionary mapping the scan class key to its period in seconds
+        :param tolerance: Scan classes that are due within this many seconds are returned together
+        """
+        self.periods = periods
+        self.tolerance = tolerance
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._order = {key: i for i, key in enumerate(periods)}  # Tie breaker for keys that are not comparable
+
+    def start(self) -> None:
+        """
+        Schedule all scan classes to be due immediately.
+        """
+        now = asyncio.get_running_loop().time()
+        self._heap = [(now, self._order[key], key) for key in self.periods]
+        heapq.heapify(self._heap)
+
+    async def wait_next(self) -> list[Hashable]:
+        """
+        Wait until the next scan class is due.
+        :return: The keys of all scan classes that are due
+        """
+        if not self._heap:
+            self.start()
+        loop = asyncio.get_running_loop()
+        due_time = self._heap[0][0]
+        delay = due_time - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        now = loop.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now + self.tolerance:
+            scheduled, order, key = heapq.heappop(self._heap)
+            due.append(key)
+            next_time = scheduled + self.periods[key]
+            if next_time <= now:
+                _logger.warning(f"Scan class {key} overran its period of {self.periods[key]} s, skipping missed scans.")
+                next_time = now + self.periods[key]
+            heapq.heappush(self._heap, (next_time, order, key))
+        return due
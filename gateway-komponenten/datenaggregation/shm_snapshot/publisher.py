@@ -0,0 +1,119 @@
+import logging
+from multiprocessing import shared_memory
+
+from .layout import (SEGMENT_CONTROL, SEGMENT_CONTROL_SIZE, SEGMENT_MAGIC, SEGMENT_VERSION, MAX_SEGMENT_SIZE,
+                     FORMAT_BINARY, KEYFRAME_INTERVAL, SnapshotOverflowError, control_segment_name,
+                     data_segment_name, segment_size)
+from .history import HistoryWriter
+from .tag_catalog import write_tag_catalog
+from .writer import SnapshotWriter
+
+_logger = logging.getLogger(__name__)
+
+
+class SnapshotPublisher:
+    """
+    Publishes snapshots under a name and grows the data segment when a snapshot does not fit.
+    The generation of the current data segment is published in a small control segment (see layout.py). On overflow
+    the snapshot is written into a new segment of at least twice the size, the generation is bumped and the old
+    segment is unlinked. Readers that still have the old segment attached keep a valid mapping until they re-attach.
+    """
+    def __init__(self, name: str, size: int, snapshot_format: int = FORMAT_BINARY,
+                 keyframe_interval: int = KEYFRAME_INTERVAL, history: HistoryWriter | None = None,
+                 max_size: int = MAX_SEGMENT_SIZE):
+        """
+        :param name: Name readers attach to with SnapshotReader
+        :param size: Initial size of the data segment, see snapshot_segment_size
+        :param max_size: Size up to which the data segment is grown
+        """
+        self.name = name
+        self.max_size = max_size
+        self.generation = 0
+        self._control = shared_memory.SharedMemory(name=control_segment_name(name), create=True,
+                                                   size=SEGMENT_CONTROL_SIZE)
+        self._published_shm: shared_memory.SharedMemory | None = None
+        self._tag_catalog: shared_memory.SharedMemory | None = None
+        self._shm = self._create_segment(size)
+        self._writer = SnapshotWriter(self._shm, snapshot_format, keyframe_interval, history)
+        self._publish_generation()
+
+    @property
+    def size(self) -> int:
+        """
+        Capacity of a single snapshot buffer in bytes.
+        """
+        return self._writer.size
+
+    @property
+    def used_bytes(self) -> int:
+        return self._writer.used_bytes
+
+    def write(self, values: dict[str, dict[str, str | int | float | bool]]) -> int:
+        """
+        Publish a snapshot, growing the data segment if necessary. See SnapshotWriter.write.
+        :return: The sequence number of the snapshot
+        :raises SnapshotOverflowError: If the snapshot would need a segment larger than `max_size`
+        """
+        while True:
+            try:
+                seq = self._writer.write(values)
+                break
+            except SnapshotOverflowError as e:
+                size = max(2 * self._shm.size, segment_size(2 * e.required_bytes))
+                if size > self.max_size:
+                    raise SnapshotOverflowError(f"{e} Segment {self.name} cannot grow beyond {self.max_size} bytes.",
+                                                e.required_bytes) from e
+                _logger.warning(f"Snapshot of {self.name} needs {e.required_bytes} bytes per buffer, growing the segment from {self._shm.size} to {size} bytes.")
+                self._grow(size)
+        if self._shm is not self._published_shm:
+            self._publish_generation()
+        return seq
+
+    def publish_tag_catalog(self, tags: list[tuple[str, str, str]]) -> None:
+        """
+        Publish the tags this publisher is going to write, once. Consumers read it with read_tag_catalog and can set
+        up before the first snapshot. Tags that are not in the catalog may still be published later.
+        :param tags: List of (name, varType, description) under which the tags are published
+        :raises RuntimeError: If the catalog has already been published
+        """
+        if self._tag_catalog is not None:
+            raise RuntimeError(f"The tag catalog of {self.name} has already been published.")
+        self._tag_catalog = write_tag_catalog(self.name, tags)
+        _logger.info(f"Tag catalog of {self.name} published with {len(tags)} tags.")
+
+    def close(self) -> None:
+        """
+        Unlink the control, data and tag catalog segments.
+        """
+        # The current data segment is not published yet if a write failed after the segment was grown
+        published = self._published_shm if self._published_shm is not self._shm else None
+        for shm in (self._shm, published, self._control, self._tag_catalog):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def _create_segment(self, size: int) -> shared_memory.SharedMemory:
+        return shared_memory.SharedMemory(name=data_segment_name(self.name, self.generation + 1), create=True,
+                                          size=size)
+
+    def _grow(self, size: int) -> None:
+        """
+        Move the writer to a new data segment. The segment is published after the next snapshot has been written
+        into it, so readers never attach to an empty segment.
+        """
+        if self._shm is not self._published_shm:
+            # A new segment that turned out to be too small as well
+            self._shm.close()
+            self._shm.unlink()
+        self._shm = self._create_segment(size)
+        self._writer.remap(self._shm)
+
+    def _publish_generation(self) -> None:
+        self.generation += 1
+        SEGMENT_CONTROL.pack_into(self._control.buf, 0, SEGMENT_MAGIC, SEGMENT_VERSION, self.generation,
+                                  self._shm.size)
+        old, self._published_shm = self._published_shm, self._shm
+        if old is not None:
+            old.close()
+            old.unlink()
+        _logger.info(f"Snapshot segment {self._shm.name} ({self._shm.size} bytes) published as generation {self.generation} of {self.name}.")
@@ -0,0 +1,290 @@
+import json
+import logging
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+from .layout import (CONTROL, CONTROL_SIZE, BUFFER_COUNT, HEADER, HEADER_SIZE, LOCK, INDEX, MAGIC, LAYOUT_VERSION,
+                     FORMAT_JSON, FLAG_KEYFRAME, SLOT_HEADER, INT64, DOUBLE, KIND_BOOL, KIND_INT, KIND_FLOAT,
+                     KIND_STRING, STATUS_STALE, STATUS_BAD, SEGMENT_CONTROL, SEGMENT_MAGIC, SEGMENT_VERSION,
+                     control_segment_name, data_segment_name)
+
+_logger = logging.getLogger(__name__)
+
+
+class SnapshotHeader:
+    def __init__(self, lock: int, snapshot_format: int, flags: int, seq: int, catalog_version: int,
+                 catalog_offset: int, catalog_length: int, values_offset: int, values_length: int, payload_length: int,
+                 timestamp: float, changes_offset: int, changes_count: int):
+        self.lock = lock
+        self.format = snapshot_format
+        self.flags = flags
+        self.seq = seq
+        self.catalog_version = catalog_version
+        self.catalog_offset = catalog_offset
+        self.catalog_length = catalog_length
+        self.values_offset = values_offset
+        self.values_length = values_length
+        self.payload_length = payload_length
+        self.timestamp = timestamp
+        self.changes_offset = changes_offset
+        self.changes_count = changes_count
+
+
+def attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a published segment as a reader.
+    The segment is owned by the producer. It is not registered with the resource tracker of the reading process,
+    otherwise the segment would be unlinked for all readers as soon as one reader exits.
+    :raises FileNotFoundError: If the producer has not created the segment yet
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def read_published_seq(buf: memoryview) -> tuple[int, int]:
+    """
+    Read the control block of a segment.
+    :param buf: The buffer of the shared memory segment
+    :return: Tuple of (sequence number of the last published snapshot, buffer size), seq is 0 if nothing has been
+             published yet
+    """
+    magic, version, buffer_count, seq, buffer_size = CONTROL.unpack_from(buf, 0)
+    if magic != MAGIC:
+        return 0, 0
+    if version != LAYOUT_VERSION:
+        raise ValueError(f"Unsupported snapshot layout version {version} (expected {LAYOUT_VERSION}).")
+    return seq, buffer_size
+
+
+def snapshot_buffer(buf: memoryview, seq: int, buffer_size: int) -> memoryview:
+    """
+    Get the buffer that holds snapshot `seq`.
+    """
+    buffer_offset = CONTROL_SIZE + (seq % BUFFER_COUNT) * buffer_size
+    return buf[buffer_offset:buffer_offset + buffer_size]
+
+
+def read_header(buf: memoryview) -> SnapshotHeader:
+    """
+    Read the header of a snapshot buffer.
+    :param buf: The snapshot buffer as returned by snapshot_buffer
+    """
+    return SnapshotHeader(*HEADER.unpack_from(buf, 0))
+
+
+def read_catalog(buf: memoryview, header: SnapshotHeader) -> dict[str, tuple[str, str, int, int, int]]:
+    """
+    Parse the catalog of a binary snapshot. The catalog only changes when the catalog version changes,
+    so readers should cache the result per catalog version.
+    :return: Dictionary mapping tag names to (varType, description, kind, slot offset in the buffer, capacity)
+    """
+    catalog = json.loads(bytes(buf[header.catalog_offset:header.catalog_offset + header.catalog_length]))
+    return {name: (var_type, description, kind, header.values_offset + offset, capacity)
+            for name, var_type, description, kind, offset, capacity in catalog}
+
+
+def read_value(buf: memoryview, kind: int, offset: int) -> tuple[str | int | float | bool, int, float]:
+    """
+    Read a single value slot directly from the buffer without decoding the rest of the snapshot.
+    :return: Tuple of (value, status flags, timestamp)
+    """
+    _, status, length, timestamp = SLOT_HEADER.unpack_from(buf, offset)
+    data_offset = offset + SLOT_HEADER.size
+    if kind == KIND_BOOL:
+        value = bool(INT64.unpack_from(buf, data_offset)[0])
+    elif kind == KIND_INT:
+        value = INT64.unpack_from(buf, data_offset)[0]
+    elif kind == KIND_FLOAT:
+        value = DOUBLE.unpack_from(buf, data_offset)[0]
+    elif kind == KIND_STRING:
+        value = str(buf[data_offset:data_offset + length], 'utf-8')
+    else:
+        value = json.loads(bytes(buf[data_offset:data_offset + length]))
+    return value, status, timestamp
+
+
+def decode_values(buf: memoryview, header: SnapshotHeader,
+                  catalog: dict[str, tuple[str, str, int, int, int]] | None = None) -> dict[str, dict[str, str | int | float | bool]]:
+    """
+    Decode a whole snapshot into the value dictionary format of the client managers.
+    :param catalog: Cached catalog of the same catalog version (parsed from the buffer if None)
+    :return: Dictionary mapping tag names to dicts with 'value', 'varType', 'description' and 'timestamp'
+             ('stale' and 'status' are only set if flagged)
+    """
+    if header.format == FORMAT_JSON:
+        return json.loads(bytes(buf[HEADER_SIZE:HEADER_SIZE + header.payload_length]))
+    if catalog is None:
+        catalog = read_catalog(buf, header)
+    values = {}
+    for name, slot in catalog.items():
+        entry = _decode_entry(buf, slot)
+        if entry is not None:
+            values[name] = entry
+    return values
+
+
+def decode_changes(buf: memoryview, header: SnapshotHeader,
+                   slots: list[tuple[str, tuple[str, str, int, int, int]]]) -> dict[str, dict[str, str | int | float | bool]]:
+    """
+    Decode only the tags in the change list of a binary snapshot (the delta to snapshot `seq - 1`).
+    :param slots: Catalog of the same catalog version as a list of (name, slot) in slot index order
+    :return: Value dictionary of the changed tags, see decode_values
+    """
+    values = {}
+    for i in range(header.changes_count):
+        name, slot = slots[INDEX.unpack_from(buf, header.changes_offset + i * INDEX.size)[0]]
+        entry = _decode_entry(buf, slot)
+        if entry is not None:
+            values[name] = entry
+    return values
+
+
+def _decode_entry(buf: memoryview, slot: tuple[str, str, int, int, int]) -> dict[str, str | int | float | bool] | None:
+    var_type, description, kind, offset, _ = slot
+    value, status, timestamp = read_value(buf, kind, offset)
+    if timestamp == 0:
+        return None  # Slot has not been written yet
+    entry = {"value": value, "varType": var_type, "description": description, "timestamp": timestamp}
+    if status & STATUS_STALE:
+        entry["stale"] = True
+    if status & STATUS_BAD:
+        entry["status"] = "bad"
+    return entry
+
+
+def read_snapshot(buf: memoryview, last_seq: int = 0, catalog_cache: dict | None = None,
+                  retries: int = 3) -> tuple[int, dict[str, dict[str, str | int | float | bool]], bool] | None:
+    """
+    Read the last published snapshot of a segment without taking a lock.
+    The snapshot is decoded optimistically and discarded if the producer started to rewrite its buffer meanwhile.
+    If the caller has read the previous snapshot (`last_seq == seq - 1`) and the snapshot is not a keyframe, only the
+    changed tags are decoded. Otherwise, e.g. after the caller missed a snapshot, the whole snapshot is decoded.
+    :param buf: The buffer of the shared memory segment
+    :param last_seq: Sequence number of the last snapshot the caller has read
+    :param catalog_cache: Dictionary in which the parsed catalog is cached between calls (one per reader).
+                          Deltas are only decoded with a cache
+    :param retries: Number of attempts if the snapshot is overwritten while it is decoded
+    :return: Tuple of (sequence number, value dictionary, full) or None if no new consistent snapshot is available.
+             `full` is False if the value dictionary only holds the tags that changed since `last_seq`
+    """
+    for _ in range(retries):
+        seq, buffer_size = read_published_seq(buf)
+        if seq == 0 or seq == last_seq:
+            return None
+        snapshot = snapshot_buffer(buf, seq, buffer_size)
+        try:
+            header = read_header(snapshot)
+            if header.lock & 1 or header.seq != seq:
+                continue  # The producer already reuses this buffer for a newer snapshot
+            full = True
+            try:
+                cached = None
+                if catalog_cache is not None and header.format != FORMAT_JSON:
+                    cached = catalog_cache.get(header.catalog_version)
+                    if cached is None:
+                        catalog = read_catalog(snapshot, header)
+                        cached = (catalog, list(catalog.items()))
+                if cached is not None and seq == last_seq + 1 and not header.flags & FLAG_KEYFRAME:
+                    values = decode_changes(snapshot, header, cached[1])
+                    full = False
+                else:
+                    values = decode_values(snapshot, header, cached[0] if cached is not None else None)
+            except (ValueError, struct.error, IndexError):
+                values = None  # Torn read, validated below
+            if LOCK.unpack_from(snapshot, 0)[0] != header.lock:
+                continue
+            if values is None:
+                raise ValueError(f"Snapshot {seq} is corrupt.")
+            if cached is not None and header.catalog_version not in catalog_cache:
+                catalog_cache.clear()
+                catalog_cache[header.catalog_version] = cached
+            return seq, values, full
+        finally:
+            snapshot.release()
+    _logger.debug(f"Snapshot was overwritten {retries} times while reading, retrying later.")
+    return None
+
+
+class SnapshotReader:
+    """
+    Consumer side of a published snapshot segment, shared by all consumer partitions.
+    Checking for a new snapshot only reads the control blocks. Snapshots are decoded in place from the segment, so the
+    work per snapshot scales with the number of changed tags and not with the segment size.
+    When the producer has grown the data segment, the reader attaches the new generation and the next read returns
+    the full state.
+    """
+    def __init__(self, name: str):
+        """
+        :param name: Name the producer publishes under (see SnapshotPublisher)
+        :raises FileNotFoundError: If the producer has not created the segments yet
+        """
+        self.name = name
+        self.seq = 0  # Sequence number of the last snapshot read by this reader
+        self.generation = 0  # Generation of the attached data segment
+        self._control = attach_segment(control_segment_name(name))
+        self._shm: shared_memory.SharedMemory | None = None
+        self._catalog_cache = {}
+        if not self._remap():
+            self._control.close()
+            raise FileNotFoundError(f"No data segment has been published for {name} yet.")
+
+    def has_new(self) -> bool:
+        """
+        Check whether a snapshot newer than the last one read has been published (reads only the control blocks).
+        """
+        if not self._remap():
+            return False
+        seq, _ = read_published_seq(self._shm.buf)
+        return seq not in (0, self.seq)
+
+    def read(self) -> tuple[dict[str, dict[str, str | int | float | bool]], bool] | None:
+        """
+        Read the newest snapshot if it has not been read yet.
+        :return: Tuple of (value dictionary, full) or None if there is no new consistent snapshot.
+                 If `full` is False the dictionary only holds the tags that changed since the previous read
+        """
+        if not self.has_new():
+            return None
+        snapshot = read_snapshot(self._shm.buf, self.seq, self._catalog_cache)
+        if snapshot is None:
+            return None
+        self.seq, values, full = snapshot
+        return values, full
+
+    def reset(self) -> None:
+        """
+        Forget the last read snapshot, the next read returns the full state.
+        """
+        self.seq = 0
+
+    def close(self) -> None:
+        self._shm.close()
+        self._control.close()
+
+    def _remap(self) -> bool:
+        """
+        Attach the data segment of the current generation if the producer has replaced it.
+        :return: False if no data segment is attached
+        """
+        magic, version, generation, _ = SEGMENT_CONTROL.unpack_from(self._control.buf, 0)
+        if magic != SEGMENT_MAGIC or generation == self.generation:
+            return self._shm is not None
+        if version != SEGMENT_VERSION:
+            raise ValueError(f"Unsupported segment control version {version} (expected {SEGMENT_VERSION}).")
+        try:
+            shm = attach_segment(data_segment_name(self.name, generation))
+        except FileNotFoundError:
+            return self._shm is not None  # Replaced again meanwhile, retry on the next call
+        if self._shm is not None:
+            self._shm.close()
+            _logger.info(f"Snapshot segment of {self.name} was replaced, attached generation {generation} ({shm.size} bytes).")
+        self._shm = shm
+        self.generation = generation
+        self.seq = 0
+        self._catalog_cache = {}
+        return True
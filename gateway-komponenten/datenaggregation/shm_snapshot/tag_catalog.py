@@ -0,0 +1,40 @@
+import json
+from multiprocessing import shared_memory
+
+from .layout import TAG_CATALOG, TAG_CATALOG_SIZE, TAG_CATALOG_MAGIC, TAG_CATALOG_VERSION, tag_catalog_segment_name
+from .reader import attach_segment
+
+
+def write_tag_catalog(name: str, tags: list[tuple[str, str, str]]) -> shared_memory.SharedMemory:
+    """
+    Publish the tags of a producer once, so consumers can set up before the first value has been read.
+    :param name: Name the snapshots are published under
+    :param tags: List of (name, varType, description) under which the tags are published
+    :return: The catalog segment, owned by the producer
+    """
+    payload = json.dumps([list(tag) for tag in tags]).encode('utf-8')
+    shm = shared_memory.SharedMemory(name=tag_catalog_segment_name(name), create=True,
+                                     size=TAG_CATALOG_SIZE + len(payload))
+    shm.buf[TAG_CATALOG_SIZE:TAG_CATALOG_SIZE + len(payload)] = payload
+    TAG_CATALOG.pack_into(shm.buf, 0, TAG_CATALOG_MAGIC, TAG_CATALOG_VERSION, len(payload))  # Publish the list
+    return shm
+
+
+def read_tag_catalog(name: str) -> list[tuple[str, str, str]] | None:
+    """
+    Read the tag catalog of a producer.
+    :param name: Name the snapshots are published under
+    :return: List of (name, varType, description) or None if the catalog is still being written
+    :raises FileNotFoundError: If the producer has not published a catalog (yet)
+    """
+    shm = attach_segment(tag_catalog_segment_name(name))
+    try:
+        magic, version, length = TAG_CATALOG.unpack_from(shm.buf, 0)
+        if magic != TAG_CATALOG_MAGIC:
+            return None
+        if version != TAG_CATALOG_VERSION:
+            raise ValueError(f"Unsupported tag catalog version {version} (expected {TAG_CATALOG_VERSION}).")
+        catalog = json.loads(bytes(shm.buf[TAG_CATALOG_SIZE:TAG_CATALOG_SIZE + length]))
+    finally:
+        shm.close()
+    return [tuple(tag) for tag in catalog]
@@ -0,0 +1,244 @@
+import json
+import logging
+import time
+from multiprocessing import shared_memory
+
+from .layout import (CONTROL, CONTROL_SIZE, BUFFER_COUNT, HEADER, HEADER_SIZE, LOCK, INDEX, MAGIC, LAYOUT_VERSION,
+                     FORMAT_BINARY, FORMAT_JSON, FLAG_KEYFRAME, KEYFRAME_INTERVAL, SLOT_HEADER, INT64, DOUBLE, KIND_BOOL, KIND_INT, KIND_FLOAT,
+                     KIND_STRING, KIND_JSON, STATUS_STALE, STATUS_BAD, MIN_STRING_CAPACITY, SnapshotOverflowError,
+                     kind_of, slot_size, align8)
+from .history import HistoryWriter
+
+_logger = logging.getLogger(__name__)
+
+
+class _Slot:
+    def __init__(self, index: int, name: str, var_type: str, description: str, kind: int, offset: int, capacity: int):
+        self.index = index
+        self.name = name
+        self.var_type = var_type
+        self.description = description
+        self.kind = kind
+        self.offset = offset
+        self.capacity = capacity
+
+
+class SnapshotWriter:
+    """
+    Writes value snapshots into a shared memory segment using the layout described in layout.py.
+    Snapshots alternate between the buffers of the segment and are published by updating the sequence number in the
+    control block, so readers always find a complete snapshot and the writer never waits for a reader.
+    The catalog (names, types, descriptions, slot offsets) is only rewritten when a tag is added or its type changes,
+    every other snapshot only updates the value slots of the tags that changed and lists them in the change list
+    (delta). Every `keyframe_interval` snapshots all tags are listed (keyframe).
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, snapshot_format: int = FORMAT_BINARY,
+                 keyframe_interval: int = KEYFRAME_INTERVAL, history: HistoryWriter | None = None):
+        self._history = history
+        self._format = snapshot_format
+        self._keyframe_interval = keyframe_interval
+        self._seq = 0
+        self._published: dict[str, dict[str, str | int | float | bool]] = {}
+        self._catalog = b""
+        self._catalog_version = 0
+        self._values_offset = HEADER_SIZE
+        self._values_length = 0
+        self.used_bytes = HEADER_SIZE
+        self.remap(shm)
+
+    def remap(self, shm: shared_memory.SharedMemory) -> None:
+        """
+        Continue writing into another (usually larger) segment. The published state and the sequence number are kept,
+        the catalog is rebuilt and the next snapshot is a keyframe.
+        :param shm: The new segment, its content is overwritten
+        """
+        self._shm = shm
+        self._buffer_size = (shm.size - CONTROL_SIZE) // BUFFER_COUNT & ~7
+        self._slots: dict[str, _Slot] = {}
+        self._buffer_catalog_versions = [0] * BUFFER_COUNT
+        self._dirty: list[set[str]] = [set() for _ in range(BUFFER_COUNT)]  # Tags changed since a buffer was written
+        self._shm.buf[:shm.size] = bytes(shm.size)
+        CONTROL.pack_into(self._shm.buf, 0, MAGIC, LAYOUT_VERSION, BUFFER_COUNT, 0, self._buffer_size)
+
+    @property
+    def size(self) -> int:
+        """
+        Capacity of a single snapshot buffer in bytes.
+        """
+        return self._buffer_size
+
+    def write(self, values: dict[str, dict[str, str | int | float | bool]]) -> int:
+        """
+        Publish a snapshot.
+        :param values: Dictionary mapping tag names to dicts with 'value', 'varType', 'description' and the optional
+                       keys 'timestamp', 'stale' and 'status'
+        :return: The sequence number of the snapshot (also recorded with the samples in the history segment)
+        :raises SnapshotOverflowError: If the snapshot does not fit into a buffer
+        """
+        if self._format == FORMAT_JSON:
+            payload = json.dumps(values).encode('utf-8')
+            if HEADER_SIZE + len(payload) > self._buffer_size:
+                raise SnapshotOverflowError(f"JSON snapshot of {HEADER_SIZE + len(payload)} bytes exceeds the buffer size of {self._buffer_size} bytes.",
+                                            HEADER_SIZE + len(payload))
+            self._publish(self._write_json, payload)
+        else:
+            changed = self._merge(values)
+            keyframe = (self._seq + 1) % self._keyframe_interval == 0
+            if self._catalog_outdated(changed):
+                self._build_catalog()
+                keyframe = True
+            if keyframe:
+                changed = set(self._slots)
+            for dirty in self._dirty:
+                dirty |= changed
+            self._publish(self._write_binary, changed, keyframe)
+        if self._history is not None:
+            self._history.append(self._seq, values)
+        return self._seq
+
+    def _publish(self, write_buffer, *args) -> None:
+        """
+        Write the next snapshot into its buffer under the buffer's seqlock and publish its sequence number.
+        """
+        seq = self._seq + 1
+        buffer_offset = CONTROL_SIZE + (seq % BUFFER_COUNT) * self._buffer_size
+        buf = self._shm.buf[buffer_offset:buffer_offset + self._buffer_size]
+        try:
+            lock = LOCK.unpack_from(buf, 0)[0] + 1 | 1
+            LOCK.pack_into(buf, 0, lock)  # Odd: buffer is being written
+            payload_length, flags, changes_offset, changes_count = write_buffer(buf, seq % BUFFER_COUNT, *args)
+            HEADER.pack_into(buf, 0, lock, self._format, flags, seq, self._catalog_version, HEADER_SIZE,
+                             len(self._catalog), self._values_offset, self._values_length, payload_length, time.time(),
+                             changes_offset, changes_count)
+            LOCK.pack_into(buf, 0, lock + 1)  # Even: buffer is consistent
+        finally:
+            buf.release()
+        self._seq = seq
+        CONTROL.pack_into(self._shm.buf, 0, MAGIC, LAYOUT_VERSION, BUFFER_COUNT, seq, self._buffer_size)
+
+    def _write_json(self, buf: memoryview, buffer_index: int, payload: bytes) -> tuple[int, int, int, int]:
+        buf[HEADER_SIZE:HEADER_SIZE + len(payload)] = payload
+        self.used_bytes = HEADER_SIZE + len(payload)
+        return len(payload), FLAG_KEYFRAME, 0, 0
+
+    def _write_binary(self, buf: memoryview, buffer_index: int, changed: set[str],
+                      keyframe: bool) -> tuple[int, int, int, int]:
+        """
+        Bring the buffer up to date with the published state. Only the slots that changed since the buffer was written
+        last are packed, unless the buffer still holds an older catalog.
+        """
+        names = self._dirty[buffer_index]
+        if self._buffer_catalog_versions[buffer_index] != self._catalog_version:
+            buf[HEADER_SIZE:HEADER_SIZE + len(self._catalog)] = self._catalog
+            self._buffer_catalog_versions[buffer_index] = self._catalog_version
+            names = self._slots
+        for name in names:
+            slot = self._slots[name]
+            entry = self._published[name]
+            status = STATUS_STALE if entry.get('stale') else 0
+            if entry.get('status') == 'bad':
+                status |= STATUS_BAD
+            self._pack_value(buf, slot, entry['value'], status, entry['timestamp'])
+        self._dirty[buffer_index] = set()
+
+        changes_offset = self._values_offset + self._values_length
+        for i, index in enumerate(sorted(self._slots[name].index for name in changed)):
+            INDEX.pack_into(buf, changes_offset + i * INDEX.size, index)
+        return 0, FLAG_KEYFRAME if keyframe else 0, changes_offset, len(changed)
+
+    def _merge(self, values: dict[str, dict[str, str | int | float | bool]]) -> set[str]:
+        """
+        Merge the values of a cycle into the published state. Tags that are missing in a cycle keep their last value.
+        :return: Names of the tags whose value, type, description or status changed
+        """
+        now = time.time()
+        changed = set()
+        for name, entry in values.items():
+            last = self._published.get(name)
+            if entry.get('status') == 'bad' and last is not None and entry['varType'] != last['varType']:
+                # Keep the last good value and only flag it
+                entry = {**last, 'status': 'bad', 'stale': entry.get('stale', False)}
+            if last is not None and not self._differs(last, entry):
+                continue  # Unchanged values keep the timestamp of their last change
+            self._published[name] = {**entry, 'timestamp': entry.get('timestamp', now)}
+            changed.add(name)
+        return changed
+
+    @staticmethod
+    def _differs(last: dict[str, str | int | float | bool], entry: dict[str, str | int | float | bool]) -> bool:
+        """
+        An entry with a newer timestamp but the same value is published as well (heartbeat of a report-by-exception
+        filter). Entries without a timestamp are only compared by value, type, description and status.
+        """
+        return (type(last['value']) is not type(entry['value']) or last['value'] != entry['value']
+                or last['varType'] != entry['varType'] or last['description'] != entry['description']
+                or last.get('status') != entry.get('status') or bool(last.get('stale')) != bool(entry.get('stale'))
+                or entry.get('timestamp', last['timestamp']) > last['timestamp'])
+
+    def _pack_value(self, buf: memoryview, slot: _Slot, value, status: int, timestamp: float) -> None:
+        data_offset = slot.offset + SLOT_HEADER.size
+        if slot.kind in (KIND_BOOL, KIND_INT):
+            SLOT_HEADER.pack_into(buf, slot.offset, slot.kind, status, 0, timestamp)
+            INT64.pack_into(buf, data_offset, int(value))
+        elif slot.kind == KIND_FLOAT:
+            SLOT_HEADER.pack_into(buf, slot.offset, slot.kind, status, 0, timestamp)
+            DOUBLE.pack_into(buf, data_offset, float(value))
+        else:
+            data = self._encode_text(slot.kind, value)
+            SLOT_HEADER.pack_into(buf, slot.offset, slot.kind, status, len(data), timestamp)
+            buf[data_offset:data_offset + len(data)] = data
+
+    @staticmethod
+    def _encode_text(kind: int, value) -> bytes:
+        return (value if kind == KIND_STRING else json.dumps(value)).encode('utf-8')
+
+    def _catalog_outdated(self, changed: set[str]) -> bool:
+        """
+        Check whether the catalog has to be rebuilt for the tags that changed in this cycle. Unchanged tags still fit
+        their slots, so the cost does not grow with the number of published tags.
+        """
+        if len(self._slots) != len(self._published):
+            return True  # New tags, or the slots were dropped by remap()
+        for name in changed:
+            entry = self._published[name]
+            slot = self._slots[name]
+            if entry['varType'] != slot.var_type or entry['description'] != slot.description \
+                    or kind_of(entry['varType'], entry['value']) != slot.kind:
+                return True
+            if slot.kind in (KIND_STRING, KIND_JSON) and len(self._encode_text(slot.kind, entry['value'])) > slot.capacity:
+                return True
+        return False
+
+    def _build_catalog(self) -> None:
+        """
+        Assign slots to all published tags and encode the catalog. The catalog is written into each buffer the next
+        time that buffer is used.
+        """
+        catalog = []
+        offset = 0
+        slots = {}
+        for index, (name, entry) in enumerate(self._published.items()):
+            kind = kind_of(entry['varType'], entry['value'])
+            capacity = 0
+            if kind in (KIND_STRING, KIND_JSON):
+                # Reserve room for growing strings so the catalog is not rebuilt for every longer value
+                capacity = max(MIN_STRING_CAPACITY, align8(2 * len(self._encode_text(kind, entry['value']))))
+            slots[name] = _Slot(index, name, entry['varType'], entry['description'], kind, offset, capacity)
+            catalog.append([name, entry['varType'], entry['description'], kind, offset, capacity])
+            offset += slot_size(kind, capacity)
+        catalog_bytes = json.dumps(catalog).encode('utf-8')
+        values_offset = align8(HEADER_SIZE + len(catalog_bytes))
+        used_bytes = values_offset + offset + INDEX.size * len(slots)
+        if used_bytes > self._buffer_size:
+            raise SnapshotOverflowError(f"Snapshot with {len(slots)} tags needs {used_bytes} bytes, a buffer of {self._shm.name} has {self._buffer_size} bytes.",
+                                        used_bytes)
+
+        for slot in slots.values():
+            slot.offset += values_offset
+        self._slots = slots
+        self._catalog = catalog_bytes
+        self._catalog_version += 1
+        self._values_offset = values_offset
+        self._values_length = offset
+        self.used_bytes = used_bytes
+        _logger.info(f"Snapshot catalog version {self._catalog_version} of {self._shm.name}: {len(slots)} tags, {used_bytes}/{self._buffer_size} bytes per buffer.")
@@ -0,0 +1,46 @@
+import asyncio
+import struct
+
+from modbus_tcp_client.async_modbus_tcp import MBAP_HEADER, READ_REQUEST
+
+
+def response(transaction_id: int, pdu: bytes, length: int | None = None) -> bytes:
+    return MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1 if length is None else length, 1) + pdu
+
+
+def registers(request: tuple[int, int, int], count: int | None = None) -> bytes:
+    """
+    Response PDU to a register read whose registers hold their own address.
+    """
+    function_code, address, quantity = request
+    count = quantity if count is None else count
+    return struct.pack(f">BB{count}H", function_code, 2 * count, *range(address, address + count))
+
+
+async def serve(respond, delay=None) -> tuple[asyncio.AbstractServer, int]:
+    """
+    Start a Modbus/TCP server on a free port that answers every read request with `respond(transaction id, request)`.
+    Requests are answered concurrently, each after `delay(request)` seconds (default: at once).
+    """
+    async def answer(writer: asyncio.StreamWriter, transaction_id: int, request: tuple[int, int, int]) -> None:
+        if delay is not None:
+            await asyncio.sleep(delay(request))
+        if not writer.is_closing():
+            writer.write(respond(transaction_id, request))
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        tasks = set()
+        try:
+            while True:
+                transaction_id, _, length, _ = MBAP_HEADER.unpack(await reader.readexactly(MBAP_HEADER.size))
+                request = READ_REQUEST.unpack(await reader.readexactly(length - 1))
+                task = asyncio.create_task(answer(writer, transaction_id, request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from fake_modbus_server import registers, response, serve
+from modbus_tcp_client.async_modbus_tcp import AsyncModbusTcpClient
+
+
+def test_read_holding_registers():
+    async def run() -> None:
+        server, port = await serve(lambda transaction_id, request: response(transaction_id, registers(request)))
+        client = AsyncModbusTcpClient('127.0.0.1', port)
+        assert await client.open()
+        assert await asyncio.gather(client.read_holding_registers(10, 3), client.read_holding_registers(20, 2)) == \
+            [[10, 11, 12], [20, 21]]
+        await client.close()
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_short_response_is_rejected():
+    async def run() -> None:
+        server, port = await serve(lambda transaction_id, request: response(transaction_id, registers(request, 1)))
+        client = AsyncModbusTcpClient('127.0.0.1', port)
+        assert await client.open()
+        with pytest.raises(ValueError, match="Malformed response"):
+            await client.read_holding_registers(10, 3)
+        assert client.is_open  # The framing is intact, only the response is wrong
+        await client.close()
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_malformed_header_closes_the_connection():
+    async def run() -> None:
+        server, port = await serve(lambda transaction_id, request: response(transaction_id, b'', length=0))
+        client = AsyncModbusTcpClient('127.0.0.1', port, timeout=5.0)
+        assert await client.open()
+        # The pending request fails at once instead of timing out, and the client reconnects on the next open()
+        with pytest.raises(ConnectionError):
+            await client.read_holding_registers(10, 3)
+        assert not client.is_open
+        assert await client.open()
+        await client.close()
+        server.close()
+
+    asyncio.run(run())
@@ -0,0 +1,130 @@
+import sys
+import threading
+from multiprocessing import shared_memory
+
+import pytest
+
+from shm_snapshot import HistoryReader, HistoryWriter, history_segment_size
+from shm_snapshot.history import UINT64
+from shm_snapshot.layout import INT64
+
+CAPACITY = 8
+
+
+@pytest.fixture
+def segment():
+    shm = shared_memory.SharedMemory(create=True, size=history_segment_size(4, CAPACITY))
+    yield shm
+    shm.close()
+    shm.unlink()
+
+
+def entry(n: int) -> dict:
+    """
+    Value dictionary entry whose seq, timestamp and value all equal `n`, so a torn sample is detectable.
+    """
+    return {'value': float(n), 'varType': 'Double', 'timestamp': float(n)}
+
+
+def assert_consistent(samples: list[tuple[int, float, float]]) -> None:
+    seqs = [seq for seq, _, _ in samples]
+    assert all(seq == timestamp == value for seq, timestamp, value in samples)
+    assert seqs == list(range(seqs[0], seqs[0] + len(seqs))) if seqs else True
+
+
+def test_torn_sample_is_not_returned(segment):
+    writer = HistoryWriter(segment, 4, CAPACITY)
+    for n in range(1, CAPACITY + 1):
+        writer.append(n, {'tag': entry(n)})
+    reader = HistoryReader(segment)
+    assert [seq for seq, _, _ in reader.last('tag', CAPACITY)] == list(range(2, CAPACITY + 1))
+
+    # The writer stored the seq of sample `head` over sample `head - capacity` and was interrupted before the value
+    seq_offset = reader._layout.ring_offsets(0)[0]
+    UINT64.pack_into(segment.buf, seq_offset, CAPACITY + 1)
+    assert_consistent(reader.last('tag', CAPACITY))
+    assert_consistent(reader.since('tag', 0))
+    assert reader.overruns == 1
+    assert reader.lost_samples == 0
+
+
+def test_since_without_loss_is_no_overrun(segment):
+    writer = HistoryWriter(segment, 4, CAPACITY)
+    for n in range(1, 3 * CAPACITY):
+        writer.append(n, {'tag': entry(n)})
+    reader = HistoryReader(segment)
+    head = 3 * CAPACITY - 1
+    samples = reader.since('tag', head - CAPACITY + 1)
+    assert [seq for seq, _, _ in samples] == list(range(head - CAPACITY + 2, head + 1))
+    assert reader.overruns == 0
+    reader.since('tag', head - CAPACITY)
+    assert reader.overruns == 1
+
+
+def test_concurrent_reader_lagging_by_capacity(segment):
+    writer = HistoryWriter(segment, 4, CAPACITY)
+    writer.append(1, {'tag': entry(1)})
+    reader = HistoryReader(segment)
+    reader.tags  # Load the catalog
+    head_offset = reader._layout.head_offset(0)
+    stop = threading.Event()
+
+    def write() -> None:
+        n = 2
+        while not stop.is_set():
+            writer.append(n, {'tag': entry(n)})
+            n += 1
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        reads = 0
+        while reads < 20000:
+            head = INT64.unpack_from(segment.buf, head_offset)[0]
+            # Sample n has seq n + 1: ask for everything after the sample `capacity` behind the head, the oldest one
+            # is the position the writer overwrites next
+            assert_consistent(reader.since('tag', head - CAPACITY))
+            assert_consistent(reader.last('tag', CAPACITY))
+            reads += 1
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+
+
+def test_wraparound(segment):
+    writer = HistoryWriter(segment, 4, CAPACITY)
+    reader = HistoryReader(segment)
+    count = 3 * CAPACITY + CAPACITY // 2
+    for n in range(1, count + 1):
+        writer.append(n, {'tag': entry(n), 'every other': entry(n - n % 2),  # Unchanged values are not recorded
+                          'bad': {**entry(n), 'status': 'bad'}, 'stale': {**entry(n), 'stale': True},
+                          'text': {'value': str(n), 'varType': 'String'}})
+    assert reader.tags == ['tag', 'every other']
+
+    newest = reader.last('tag', 100)
+    assert [seq for seq, _, _ in newest] == list(range(count - CAPACITY + 2, count + 1))
+    assert_consistent(newest)
+    assert reader.last('tag', 3) == newest[-3:]
+    assert reader.since('tag', count - 4) == newest[-4:]
+    assert reader.since('tag', count) == []
+    assert reader.overruns == 0
+    assert [value for _, _, value in reader.last('every other', 3)] == [count - 4, count - 2, count]  # count is even
+    assert reader.since_all(count - 2) == {'tag': newest[-2:], 'every other': [(count, count, count)]}
+
+    head, seqs, timestamps, values = reader.views('tag')
+    assert head == count
+    assert [seqs[n % CAPACITY] for n in range(head - CAPACITY + 1, head)] == [seq for seq, _, _ in newest]
+    assert values[(head - 1) % CAPACITY] == timestamps[(head - 1) % CAPACITY] == count
+    for view in (seqs, timestamps, values):
+        view.release()
+
+
+def test_tags_beyond_max_tags_are_not_recorded(segment):
+    writer = HistoryWriter(segment, 4, CAPACITY)
+    writer.append(1, {f"tag{i}": entry(1) for i in range(6)})
+    reader = HistoryReader(segment)
+    assert reader.tags == [f"tag{i}" for i in range(4)]
+    assert reader.last('tag5', 1) == []
@@ -0,0 +1,87 @@
+import asyncio
+import gc
+import socket
+
+from fake_modbus_server import registers, response, serve
+from modbus_tcp_client.modbus_tcp_client import ModbusTCPClient
+from modbus_tcp_client.circuit_breaker import CircuitBreaker
+
+
+def endpoint(name: str, address: int) -> dict:
+    return {'name': name, 'function': 'Read Holding Registers', 'address': address, 'quantity': 1, 'offset': -1,
+            'type': 'UInt16', 'description': name, 'scanrate': None, 'deadband': None}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_checked(coroutine) -> list[dict]:
+    """
+    Run a coroutine and return the errors the event loop reported, e.g. task exceptions that were never retrieved.
+    """
+    errors = []
+
+    async def main() -> None:
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        await coroutine
+        gc.collect()  # Report tasks with unretrieved exceptions now
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    return errors
+
+
+def test_slow_block_does_not_open_the_breaker():
+    async def run() -> None:
+        server, port = await serve(lambda transaction_id, request: response(transaction_id, registers(request)),
+                                   delay=lambda request: 0.3 if request[1] == 100 else 0.0)
+        client = ModbusTCPClient('127.0.0.1', port, 'Slow', {'fast': endpoint('fast', 0), 'slow': endpoint('slow', 100)})
+        for _ in range(CircuitBreaker(client.serveralias).failure_threshold + 2):
+            values = await client.poll(0.1)
+            assert values['Slow: fast'] == {'value': 0, 'varType': 'UInt16', 'description': 'fast'}
+            assert 'Slow: slow' not in values  # Never answered in time, so no last value to publish as stale
+            assert values['ModbusTCP Connections:Slow: Connection status']['value'] is True
+            assert values['ModbusTCP Connections:Slow: Circuit breaker']['value'] == CircuitBreaker.CLOSED
+        await client.client.close()
+        server.close()
+
+    assert run_checked(run()) == []
+
+
+def test_cancelled_requests_are_collected_when_the_connection_closes():
+    async def run() -> None:
+        server, port = await serve(lambda transaction_id, request: response(transaction_id, registers(request)),
+                                   delay=lambda request: 10.0)
+        client = ModbusTCPClient('127.0.0.1', port, 'Silent', {'a': endpoint('a', 0), 'b': endpoint('b', 100)})
+        poll = asyncio.create_task(client.poll(0.1))
+        await asyncio.sleep(0.1)
+        await client.client.close()  # Fails the pending requests while the poll cancels them
+        values = await poll
+        assert values['ModbusTCP Connections:Silent: Connection status']['value'] is False
+        server.close()
+
+    assert run_checked(run()) == []
+
+
+def test_failed_connect_opens_the_breaker_at_once():
+    async def run() -> None:
+        client = ModbusTCPClient('127.0.0.1', free_port(), 'Down', {'a': endpoint('a', 0)})
+        attempts = 0
+        open_connection = client.client.open
+
+        async def counting_open() -> bool:
+            nonlocal attempts
+            attempts += 1
+            return await open_connection()
+
+        client.client.open = counting_open
+        for _ in range(5):
+            values = await client.poll(1.0)
+            assert values['ModbusTCP Connections:Down: Circuit breaker']['value'] == CircuitBreaker.OPEN
+        assert attempts == 1  # The following cycles wait for the backoff
+        assert client.breaker.retry_in > 0
+
+    assert run_checked(run()) == []
@@ -0,0 +1,197 @@
+import random
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+from shm_snapshot import FORMAT_BINARY, FORMAT_JSON, SnapshotOverflowError, SnapshotPublisher, SnapshotReader
+
+TYPES = [("Double", lambda rng: rng.random()), ("Int32", lambda rng: rng.randrange(-1000, 1000)),
+         ("Boolean", lambda rng: rng.random() < 0.5), ("String", lambda rng: "x" * rng.randrange(0, 40))]
+
+
+@pytest.fixture
+def publisher_name():
+    return f"test_snapshot_{uuid.uuid4().hex[:12]}"
+
+
+def entry(var_type: str, value) -> dict:
+    return {'value': value, 'varType': var_type, 'description': f"{var_type} tag"}
+
+
+def merge(state: dict, values: dict, full: bool) -> dict:
+    """
+    Apply a snapshot to the consumer state like the consumer partitions do.
+    """
+    if full:
+        state = {}
+    for name, tag_entry in values.items():
+        state[name] = {key: tag_entry[key] for key in ('value', 'varType', 'description')}
+    return state
+
+
+def test_round_trip_across_keyframes(publisher_name):
+    rng = random.Random(3)
+    publisher = SnapshotPublisher(publisher_name, 64 * 1024, keyframe_interval=4)
+    try:
+        tags = {f"Server: tag{i}": TYPES[i % len(TYPES)] for i in range(12)}
+        expected = {name: entry(var_type, make(rng)) for name, (var_type, make) in tags.items()}
+        publisher.write(expected)
+        reader = SnapshotReader(publisher_name)
+        values, full = reader.read()
+        assert full
+        state = merge({}, values, full)
+        assert state == expected
+
+        fulls = []
+        for cycle in range(13):
+            changed = {name: entry(var_type, make(rng)) for name, (var_type, make) in tags.items() if rng.random() < 0.3}
+            expected.update(changed)
+            seq = publisher.write(changed)
+            values, full = reader.read()
+            if full:
+                fulls.append(seq)
+            else:
+                assert set(values) <= set(changed)  # A delta only lists tags whose entry changed
+            state = merge(state, values, full)
+            assert state == expected
+        assert fulls == [4, 8, 12]
+        reader.close()
+    finally:
+        publisher.close()
+
+
+def test_reader_that_missed_snapshots_gets_the_full_state(publisher_name):
+    publisher = SnapshotPublisher(publisher_name, 64 * 1024, keyframe_interval=100)
+    try:
+        publisher.write({'a': entry("Int32", 1), 'b': entry("Int32", 2)})
+        reader = SnapshotReader(publisher_name)
+        reader.read()
+        publisher.write({'a': entry("Int32", 3)})
+        publisher.write({'b': entry("Int32", 4)})
+        values, full = reader.read()
+        assert full
+        assert merge({}, values, full) == {'a': entry("Int32", 3), 'b': entry("Int32", 4)}
+        reader.close()
+    finally:
+        publisher.close()
+
+
+def test_catalog_follows_changed_tags(publisher_name):
+    publisher = SnapshotPublisher(publisher_name, 64 * 1024, keyframe_interval=100)
+    try:
+        expected = {'text': entry("String", "short"), 'number': entry("Int32", 1), 'other': entry("Double", 0.5)}
+        publisher.write(expected)
+        reader = SnapshotReader(publisher_name)
+        state = merge({}, *reader.read())
+        for changed in ({'text': entry("String", "long" * 100)},  # Outgrows the capacity of its slot
+                        {'number': entry("Double", 1.5)},  # Changes its type
+                        {'number': {**entry("Double", 2.5), 'description': "Renamed"}},
+                        {'added': entry("Boolean", True)}):
+            expected.update(changed)
+            publisher.write(changed)
+            state = merge(state, *reader.read())
+            assert state == expected
+        reader.close()
+    finally:
+        publisher.close()
+
+
+@pytest.mark.parametrize('snapshot_format', [FORMAT_BINARY, FORMAT_JSON])
+def test_round_trip_of_all_kinds(publisher_name, snapshot_format):
+    values = {'bool': entry("Boolean", True), 'int': entry("Int64", -2 ** 62), 'float': entry("Double", 1.25),
+              'string': entry("String", "Grüße"), 'json': entry("ByteString", [1, "two", {"three": 3.0}]),
+              'huge int': entry("UInt64", 2 ** 64 - 1),
+              'stale': {**entry("Float", 2.5), 'stale': True}, 'bad': {**entry("Int32", 7), 'status': 'bad'}}
+    publisher = SnapshotPublisher(publisher_name, 64 * 1024, snapshot_format)
+    try:
+        publisher.write(values)
+        reader = SnapshotReader(publisher_name)
+        read, full = reader.read()
+        assert full
+        for name, tag_entry in values.items():
+            assert {key: read[name][key] for key in tag_entry} == tag_entry
+            assert type(read[name]['value']) is type(tag_entry['value'])
+        assert 'stale' not in read['bool'] and 'status' not in read['bool']
+        assert reader.read() is None  # Nothing new
+        reader.close()
+    finally:
+        publisher.close()
+
+
+def test_concurrent_reader_sees_only_complete_snapshots(publisher_name):
+    tags = [f"tag{i}" for i in range(50)]
+    publisher = SnapshotPublisher(publisher_name, 64 * 1024, keyframe_interval=7)
+    publisher.write({name: entry("Int64", 0) for name in tags})
+    reader = SnapshotReader(publisher_name)
+    stop = threading.Event()
+
+    def write() -> None:
+        cycle = 1
+        while not stop.is_set():
+            publisher.write({name: entry("Int64", cycle) for name in tags})  # Every snapshot holds a single value
+            cycle += 1
+            time.sleep(0)  # Let the reader run, it retries when a buffer is overwritten while it is decoded
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        reads = 0
+        while reads < 500:
+            snapshot = reader.read()
+            if snapshot is None:
+                continue
+            values, full = snapshot
+            assert len({tag_entry['value'] for tag_entry in values.values()}) == 1
+            assert not full or len(values) == len(tags)
+            reads += 1
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+        reader.close()
+        publisher.close()
+
+
+def test_round_trip_across_segment_grow(publisher_name):
+    publisher = SnapshotPublisher(publisher_name, 4096, keyframe_interval=100)
+    try:
+        expected = {f"tag{i}": entry("Int32", i) for i in range(4)}
+        publisher.write(expected)
+        reader = SnapshotReader(publisher_name)
+        state = merge({}, *reader.read())
+        assert state == expected and reader.generation == 1
+
+        # Tags added at runtime no longer fit, the publisher moves to a larger segment
+        added = {f"added{i}": entry("String", "x" * 20) for i in range(100)}
+        expected.update(added)
+        publisher.write(added)
+        assert publisher.generation == 2
+        values, full = reader.read()
+        assert full and reader.generation == 2
+        state = merge(state, values, full)
+        assert state == expected
+
+        changed = {'tag1': entry("Int32", 100), 'added7': entry("String", "y")}
+        expected.update(changed)
+        publisher.write(changed)
+        values, full = reader.read()
+        assert not full and set(values) == set(changed)
+        assert merge(state, values, full) == expected
+        reader.close()
+    finally:
+        publisher.close()
+
+
+def test_segment_does_not_grow_beyond_max_size(publisher_name):
+    publisher = SnapshotPublisher(publisher_name, 4096, max_size=16 * 1024)
+    try:
+        with pytest.raises(SnapshotOverflowError):
+            publisher.write({f"tag{i}": entry("String", "x" * 100) for i in range(200)})
+        assert publisher.generation == 1
+    finally:
+        publisher.close()
@@ -0,0 +1,178 @@
+"""
+Micro-benchmark of the per-cycle cost of the DataManager update path at 1k and 10k tags.
+
+Both paths get the same input, the batches the update loop receives from the reader thread: only the tags that
+changed in the cycle. The previous path is the update loop before the converters were precomputed (unchanged-value
+skip, Variant with type detection, WriteValue and DataValue built with their default factories). The current path is
+DataManager._prepare_write. The batched write of the prepared values into the address space is measured separately,
+it is the same for both paths. The conversion alone (if/elif chain over the data type name against the precomputed
+converter of the tag) is measured on the same values as well.
+
+Run from the datenbereitstellung folder:
+    python benchmarks/bench_data_manager.py [tag counts...]
+"""
+import asyncio
+import gc
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from asyncua import Server, ua
+
+from data_manager import DataManager
+
+CYCLES = 20
+CHANGED_FRACTIONS = (0.01, 0.1, 1.0)
+VAR_TYPES = ("Float", "Int64", "Boolean", "UInt16")
+
+
+class PreviousVariable:
+    """
+    Index entry of the previous update loop
+    """
+    def __init__(self, node, var_type: str):
+        self.node = node
+        self.var_type = var_type
+        self.variant_type = ua.VariantType[var_type]
+        self.value = None
+        self.status = None
+
+
+def previous_prepare_write(variable: PreviousVariable,
+                           varData: dict[str, int | float | bool]) -> ua.WriteValue | None:
+    """
+    The hot path of the update loop before the converters were precomputed
+    """
+    value = varData['value']
+    status = DataManager._status_code(varData)
+    if varData['varType'] == variable.var_type and type(value) is type(variable.value) \
+            and value == variable.value and status == variable.status:
+        return None  # Only the timestamp changed
+    variant = ua.Variant(value, variable.variant_type)
+    source_timestamp = None
+    if 'timestamp' in varData:
+        source_timestamp = datetime.fromtimestamp(varData['timestamp'], timezone.utc)
+    write = ua.WriteValue()
+    write.NodeId = variable.node.nodeid
+    write.AttributeId = ua.AttributeIds.Value
+    write.Value = ua.DataValue(variant, status, SourceTimestamp=source_timestamp)
+    variable.value = value
+    variable.status = status
+    return write
+
+
+def legacy_convert_value(varType: str, value: str | int | float | bool) -> ua.Variant:
+    """
+    The conversion before the converters were precomputed per tag
+    """
+    if varType == "Boolean":
+        return ua.Variant(value, ua.VariantType.Boolean)
+    elif varType == "Float":
+        return ua.Variant(value, ua.VariantType.Float)
+    elif varType == "Int64":
+        return ua.Variant(value, ua.VariantType.Int64)
+    elif varType == "UInt32":
+        return ua.Variant(value, ua.VariantType.UInt32)
+    elif varType == "Byte":
+        return ua.Variant(value, ua.VariantType.Byte)
+    elif varType == "Int32":
+        return ua.Variant(value, ua.VariantType.Int32)
+    elif varType == "Int16":
+        return ua.Variant(value, ua.VariantType.Int16)
+    elif varType == "UInt16":
+        return ua.Variant(value, ua.VariantType.UInt16)
+    elif varType == "String":
+        return ua.Variant(value, ua.VariantType.String)
+    else:
+        raise ValueError(f"Unsupported varType: {varType}")
+
+
+def make_value(var_type: str, i: int, cycle: int) -> int | float | bool:
+    if var_type == "Float":
+        return float(i + cycle)
+    if var_type == "Boolean":
+        return (i + cycle) % 2 == 0
+    return (i + cycle) % 1000
+
+
+def make_batch(count: int, cycle: int, changed_fraction: float) -> dict[str, dict[str, int | float | bool]]:
+    """
+    Batch of the first `changed_fraction` of `count` tags, each with a new value in every cycle
+    """
+    now = time.time()
+    batch = {}
+    for i in range(int(count * changed_fraction) if cycle else count):
+        var_type = VAR_TYPES[i % len(VAR_TYPES)]
+        batch[f"Bench{i % 10}: tag{i}"] = {"value": make_value(var_type, i, cycle), "varType": var_type,
+                                          "description": f"Tag {i}", "timestamp": now}
+    return batch
+
+
+async def bench(count: int) -> None:
+    server = Server()
+    await server.init()
+    data_manager = DataManager(server, "bench_opcua_shm", "bench_modbus_shm")
+    object_name = f"bench_{count}"
+    initial = make_batch(count, 0, 1.0)
+    catalog = [(name, varData["varType"], varData["description"]) for name, varData in initial.items()]
+    start = time.perf_counter()
+    await data_manager._create_opcua_objects(catalog, object_name)
+    print(f"{count} tags: address space created in {time.perf_counter() - start:.2f} s")
+    index = data_manager._variables[object_name]
+    previous_index = {name: PreviousVariable(variable.node, variable.var_type) for name, variable in index.items()}
+    await data_manager._write_values([data_manager._prepare_write(name, index[name], varData)
+                                      for name, varData in initial.items()])
+    for name, varData in initial.items():
+        previous_prepare_write(previous_index[name], varData)
+
+    for changed_fraction in CHANGED_FRACTIONS:
+        batches = [make_batch(count, cycle, changed_fraction) for cycle in range(1, CYCLES + 1)]
+
+        gc.collect()
+        start = time.perf_counter()
+        for batch in batches:
+            writes = [previous_prepare_write(previous_index[name], varData) for name, varData in batch.items()]
+        previous = (time.perf_counter() - start) / CYCLES
+
+        gc.collect()
+        prepare = write = 0.0
+        for batch in batches:
+            start = time.perf_counter()
+            writes = [data_manager._prepare_write(name, index[name], varData) for name, varData in batch.items()]
+            prepare += time.perf_counter() - start
+            start = time.perf_counter()
+            await data_manager._write_values(writes)
+            write += time.perf_counter() - start
+
+        gc.collect()
+        start = time.perf_counter()
+        for batch in batches:
+            variants = [legacy_convert_value(varData['varType'], varData['value']) for varData in batch.values()]
+        legacy_conversion = (time.perf_counter() - start) / CYCLES
+
+        gc.collect()
+        start = time.perf_counter()
+        for batch in batches:
+            variants = [index[name].convert(varData['value']) for name, varData in batch.items()]
+        conversion = (time.perf_counter() - start) / CYCLES
+
+        print(f"{count} tags, {changed_fraction:4.0%} changed: "
+              f"previous path {previous * 1e3:8.2f} ms/cycle, "
+              f"precomputed converters {prepare / CYCLES * 1e3:8.2f} ms/cycle, "
+              f"batched write {write / CYCLES * 1e3:8.2f} ms/cycle; "
+              f"conversion only: if/elif {legacy_conversion * 1e3:8.2f} ms/cycle, "
+              f"converter {conversion * 1e3:8.2f} ms/cycle")
+
+
+async def main(counts: list[int]) -> None:
+    for count in counts:
+        await bench(count)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main([int(count) for count in sys.argv[1:]] or [1000, 10000]))
@@ -1,316 +1,403 @@
 import asyncio
 import logging
-import json
-from multiprocessing import shared_memory
+from datetime import datetime, timezone
 from asyncua import ua, Node, Server
-import posix_ipc
-import hashlib
-from typing import Any
+from typing import Callable
+
+from shm_snapshot import SnapshotReader, read_tag_catalog
+from .shm_reader_thread import ShmReaderThread
 
 _logger = logging.getLogger(__name__)
 
+# Status codes of the values written to the OPC UA variables, derived from the flags of a shared memory entry
+STATUS_GOOD = ua.StatusCode(ua.StatusCodes.Good)
+STATUS_STALE = ua.StatusCode(ua.StatusCodes.UncertainLastUsableValue)
+STATUS_BAD = ua.StatusCode(ua.StatusCodes.Bad)
+STATUS_WAITING = ua.StatusCode(ua.StatusCodes.BadWaitingForInitialData)  # Created from the catalog, no value yet
+
+CATALOG_RETRY_INTERVAL = 1.0  # Seconds between attempts to read the tag catalog of a producer
+
+Converter = Callable[[str | int | float | bool], ua.Variant]
+
+# Data types of the shared memory entries ('varType') that can be published
+VARIANT_TYPES = {var_type: ua.VariantType[var_type]
+                 for var_type in ("Boolean", "SByte", "Byte", "Int16", "UInt16", "Int32", "UInt32", "Int64", "UInt64",
+                                  "Float", "Double", "String")}
+
+
+def _compile_converter(variant_type: ua.VariantType) -> Converter:
+    def convert(value: str | int | float | bool) -> ua.Variant:
+        # Scalar with a known type, so the Variant skips the array and type detection
+        return ua.Variant(value, variant_type, None, False)
+    return convert
+
+
+_CONVERTERS: dict[str, Converter] = {var_type: _compile_converter(variant_type)
+                                     for var_type, variant_type in VARIANT_TYPES.items()}
+
+
+def converter(var_type: str) -> Converter:
+    """
+    Get the converter of a data type, resolved once per tag when its variable is created or its type changes
+    :param var_type: OPC UA data type of a shared memory entry
+    :return: Callable that wraps a value into a Variant of the data type
+    :raises ValueError: If the data type is not supported
+    """
+    convert = _CONVERTERS.get(var_type)
+    if convert is None:
+        raise ValueError(f"Unsupported varType: {var_type}")
+    return convert
+
+
+class _Variable:
+    """
+    Index entry of an OPC UA variable created from shared memory
+    """
+    def __init__(self, node: Node | None, var_type: str, convert: Converter | None, value: str | int | float | bool):
+        self.node = node  # None if the variable could not be created
+        self.var_type = var_type
+        self.convert = convert  # Converter of var_type
+        self.value = value  # Last value written to the node
+        self.status = STATUS_GOOD  # Status code of the last value written to the node
+
 
 class DataManager:
-    def __init__(self, opcua_server: Server, opcua_shared_mem: str, opcua_semaphore: str,
-                 modbus_shared_mem: str, modbus_semaphore: str):
+    def __init__(self, opcua_server: Server, opcua_shared_mem: str, modbus_shared_mem: str):
         self._server = opcua_server
         self._opcua_shm = opcua_shared_mem
-        self._opcua_sem = opcua_semaphore
         self._modbus_shm = modbus_shared_mem
-        self._modbus_sem = modbus_semaphore
+        self._readers: dict[str, SnapshotReader] = {}
+        # Per OPC UA object ("opcua_shm", "modbus_shm"): tag name -> variable
+        self._variables: dict[str, dict[str, _Variable]] = {}
+        # OPC UA object name -> namespace index
+        self._namespaces: dict[str, int] = {}
+        # Path of the created objects ("opcua_shm", "opcua_shm.Ecotec") -> object node
+        self._objects: dict[str, Node] = {}
 
-    async def _create_opcua_objects(self, shared_memory_values: dict[str, dict[str, str | int | float | bool]],
+    async def _create_opcua_objects(self, catalog: list[tuple[str, str, str]],
                                     opcua_object_name: str) -> list[tuple[str, Node | None]]:
         """
-        Create OPC UA objects and variables from shared memory values
-        :param shared_memory_values: Dictionary mapping variable names to their properties
-                                    Each value is a dict with 'value', 'varType', and 'description' keys
+        Create the OPC UA object, its sub-objects and variables of a tag catalog. The variables hold
+        BadWaitingForInitialData until the update loop writes their first value
+        :param catalog: List of (name, varType, description) of the tags the producer publishes
         :param opcua_object_name: Name of the OPC UA object
         :return: List of OPC UA variables
         """
-        opcua_variables = []
-        _idx = await self._server.register_namespace(f"idx.{opcua_object_name}.ua")
-        obj = await self._server.nodes.objects.add_object(_idx, opcua_object_name)
+        opcua_variables = await self._add_variables(opcua_object_name, catalog)
+        writes = [ua.WriteValue(node.nodeid, ua.AttributeIds.Value, None, ua.DataValue(None, STATUS_WAITING))
+                  for _, node in opcua_variables if node is not None]
+        index = self._variables[opcua_object_name]
+        for name, node in opcua_variables:
+            if node is not None:
+                index[name].status = STATUS_WAITING
+        if writes:
+            await self._write_values(writes)
+        _logger.info(f"Initial OPC UA Variables of {opcua_object_name}: {len(opcua_variables)}")
+        return opcua_variables
 
-        for name, varData in shared_memory_values.items():
-            value = varData['value']
-            varType = varData['varType']
-            description = varData['description']
+    async def _add_variables(self, opcua_object_name: str,
+                             tags: list[tuple[str, str, str]]) -> list[tuple[str, Node | None]]:
+        """
+        Create the variables of tags and the objects they belong to, and add them to the index. Objects and variables
+        are each added in one bulk AddNodes call, the namespace index and the objects that already exist are taken
+        from the cache instead of being browsed. The NodeIds are derived from the tag names, so they are the same
+        after every restart
+        :param opcua_object_name: Name of the OPC UA object ("opcua_shm" or "modbus_shm")
+        :param tags: List of (name, varType, description), names that are already indexed are skipped
+        :return: List of the new OPC UA variables, the node is None if the variable could not be created
+        """
+        _idx = self._namespaces.get(opcua_object_name)
+        if _idx is None:
+            _idx = self._namespaces[opcua_object_name] = \
+                await self._server.register_namespace(f"idx.{opcua_object_name}.ua")
+        index = self._variables.setdefault(opcua_object_name, {})
+        root_id = ua.NodeId(opcua_object_name, _idx)
+        objects = {}  # Path -> objects that do not exist yet
+        if opcua_object_name not in self._objects:
+            objects[opcua_object_name] = self._object_item(ua.NodeId(ua.ObjectIds.ObjectsFolder), root_id,
+                                                           ua.QualifiedName(opcua_object_name, _idx),
+                                                           ua.ObjectIds.Organizes)
+        variables = []
+        for name, varType, description in tags:
+            if name in index:
+                continue
             # inside the name there is the first word before ":" e.g., "Ecotec: AM13 Volumenstrom 2"
-            # depending on this word, create a new object and add the variable to it
-            # if the object already exists, add the variable to it
-            if ":" in name:
-                object_name = name.split(":", 1)[0]
-                object_name_rest = name.split(":", 1)[1]
-                try:
-                    new_obj = await obj.get_child(f"{_idx}:{object_name}")
-                except Exception as e:
-                    _logger.warning(f"Creating new object: {object_name}...")#
-                    new_obj = await obj.add_object(_idx, object_name)                
-                try:
-                    converted_value = self._convert_value(varType, value)
-                    var = await new_obj.add_variable(_idx, object_name_rest, converted_value)
-                    await var.write_attribute(ua.AttributeIds.Description, 
-                                              ua.DataValue(ua.Variant(ua.LocalizedText(description))))
-                    opcua_variables.append((str(name), var))
-                except ValueError as e:
-                    _logger.error(f"Error converting value for {name}: {e}")
-                    opcua_variables.append((str(name), None))
-            else:
+            # depending on this word, the variable is added to an object of that name
+            if ":" not in name:
                 _logger.error(f"Error creating object for {name}: No object name found.")
-        _logger.info(f"Initial OPC UA Variables: {opcua_variables}")
-        return opcua_variables
+                index[name] = _Variable(None, varType, None, None)
+                continue
+            try:
+                convert = converter(varType)
+            except ValueError as e:
+                _logger.error(f"Error converting value for {name}: {e}")
+                index[name] = _Variable(None, varType, None, None)
+                continue
+            object_name, object_name_rest = name.split(":", 1)
+            path = f"{opcua_object_name}.{object_name}"
+            if path not in self._objects and path not in objects:
+                objects[path] = self._object_item(root_id, ua.NodeId(path, _idx), ua.QualifiedName(object_name, _idx),
+                                                  ua.ObjectIds.HasComponent)
+            index[name] = _Variable(None, varType, convert, None)
+            variables.append((name, self._variable_item(ua.NodeId(path, _idx),
+                                                        ua.NodeId(f"{opcua_object_name}.{name}", _idx),
+                                                        ua.QualifiedName(object_name_rest, _idx), varType, description)))
 
+        if objects:
+            for path, node_id in zip(objects, await self._add_nodes(list(objects.values()))):
+                if node_id is not None:
+                    self._objects[path] = self._server.get_node(node_id)
+        new_variables = []
+        for (name, item), node_id in zip(variables, await self._add_nodes([item for _, item in variables])):
+            node = index[name].node = self._server.get_node(node_id) if node_id is not None else None
+            new_variables.append((str(name), node))
+        return new_variables
 
-    async def create_opcua_population(self) -> list[tuple[str, Node | None]]:
+    async def _add_nodes(self, items: list[ua.AddNodesItem]) -> list[ua.NodeId | None]:
         """
-        Create the initial population of OPC UA variables from OPC UA shared memory
+        Add nodes in one request through the internal session of the server
+        :param items: Nodes to add, parents before their children
+        :return: The NodeId of each node or None if it could not be added
         """
-        opcua_variables = []
-        opcua_semaphore = None
+        results = await self._server.iserver.isession.add_nodes(items)
+        added = []
+        for item, result in zip(items, results):
+            if result.StatusCode.is_good():
+                added.append(result.AddedNodeId)
+            else:
+                _logger.error(f"Error adding node {item.RequestedNewNodeId}: {result.StatusCode}")
+                added.append(None)
+        return added
 
-        while opcua_variables == []:
-            try:
-                opcua_semaphore = posix_ipc.Semaphore(self._opcua_sem)
-                opcua_shm = shared_memory.SharedMemory(name=self._opcua_shm)
-                opcua_semaphore.acquire()
-                opcua_variables = await self._create_opcua_objects(json.loads(bytes(opcua_shm.buf[:]).decode('utf-8').rstrip('\x00')), "opcua_shm")
-                opcua_semaphore.release()
-            except Exception as e:
-                _logger.error(f"OPC UA: Error initializing shared memory while populating server: {e}")
-                opcua_variables = []
-                opcua_semaphore.release()
-            await asyncio.sleep(0.1)
-        return opcua_variables
+    @staticmethod
+    def _object_item(parent_id: ua.NodeId, node_id: ua.NodeId, browse_name: ua.QualifiedName,
+                     reference_type: int) -> ua.AddNodesItem:
+        """
+        Describe an object node like Node.add_object does, without reading the type of its parent
+        :param reference_type: Organizes below a folder, HasComponent below an object
+        """
+        attrs = ua.ObjectAttributes()
+        attrs.EventNotifier = 0
+        attrs.Description = ua.LocalizedText(browse_name.Name)
+        attrs.DisplayName = ua.LocalizedText(browse_name.Name)
+        attrs.WriteMask = 0
+        attrs.UserWriteMask = 0
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = node_id
+        item.BrowseName = browse_name
+        item.ParentNodeId = parent_id
+        item.ReferenceTypeId = ua.NodeId(reference_type)
+        item.NodeClass = ua.NodeClass.Object
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseObjectType)
+        item.NodeAttributes = attrs
+        return item
 
-    async def create_modbus_population(self) -> list[tuple[str, Node | None]]:
+    @staticmethod
+    def _variable_item(parent_id: ua.NodeId, node_id: ua.NodeId, browse_name: ua.QualifiedName, varType: str,
+                       description: str) -> ua.AddNodesItem:
         """
-        Create the initial population of OPC UA variables from Modbus TCP shared memory
+        Describe a read-only scalar variable like Node.add_variable does. The data type is taken from the catalog
+        instead of being guessed from a first value, the value is null until the first one is written
         """
-        modbus_variables = []
-        modbus_semaphore = None
+        attrs = ua.VariableAttributes()
+        attrs.Description = ua.LocalizedText(description)
+        attrs.DisplayName = ua.LocalizedText(browse_name.Name)
+        attrs.DataType = ua.NodeId(getattr(ua.ObjectIds, varType))
+        attrs.Value = ua.Variant()
+        attrs.ValueRank = ua.ValueRank.Scalar
+        attrs.ArrayDimensions = None
+        attrs.WriteMask = 0
+        attrs.UserWriteMask = 0
+        attrs.Historizing = False
+        attrs.AccessLevel = ua.AccessLevel.CurrentRead.mask
+        attrs.UserAccessLevel = ua.AccessLevel.CurrentRead.mask
+        item = ua.AddNodesItem()
+        item.RequestedNewNodeId = node_id
+        item.BrowseName = browse_name
+        item.ParentNodeId = parent_id
+        item.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HasComponent)
+        item.NodeClass = ua.NodeClass.Variable
+        item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+        item.NodeAttributes = attrs
+        return item
 
-        while modbus_variables == []:
+    async def _wait_for_catalog(self, shared_mem: str) -> list[tuple[str, str, str]]:
+        """
+        Wait until the producer has published the tag catalog of a shared memory segment. The producer publishes it
+        before (Modbus TCP) or right after (OPC UA) connecting to its servers, not after the first values were read
+        :param shared_mem: Name of the shared memory segment
+        :return: List of (name, varType, description)
+        """
+        waiting = False
+        while True:
             try:
-                modbus_semaphore = posix_ipc.Semaphore(self._modbus_sem)
-                modbus_shm = shared_memory.SharedMemory(name=self._modbus_shm)
-                modbus_semaphore.acquire()
-                modbus_variables = await self._create_opcua_objects(json.loads(bytes(modbus_shm.buf[:]).decode('utf-8').rstrip('\x00')), "modbus_shm")
-                modbus_semaphore.release()
-            except Exception as e:
-                _logger.error(f"ModbusTCP: Error initializing shared memory while populating server: {e}")
-                modbus_variables = []
-                modbus_semaphore.release()
-            await asyncio.sleep(0.1)
-        return modbus_variables
-    
+                catalog = read_tag_catalog(shared_mem)
+                if catalog is not None:
+                    return catalog
+            except FileNotFoundError:
+                if not waiting:
+                    _logger.warning(f"Waiting for the tag catalog of {shared_mem}...")
+                    waiting = True
+            await asyncio.sleep(CATALOG_RETRY_INTERVAL)
 
-    async def update_population_from_opcua_shm(self, opcua_variables: list[tuple[str, Node | None]]) -> None:
+    async def create_opcua_population(self) -> list[tuple[str, Node | None]]:
         """
-        Update the population of OPC UA variables from OPC UA shared memory
-        :param opcua_variables: List of OPC UA variables
+        Create the initial population of OPC UA variables from the tag catalog of the OPC UA shared memory
         """
-        # Initialize values at the beginning
-        opcua_values: dict[str, dict[str, Any]] = {}
-        opcua_shm_response: str = ""
-        opcua_semaphore = None
         try:
-            opcua_semaphore = posix_ipc.Semaphore(self._opcua_sem)
-            opcua_shm = shared_memory.SharedMemory(name=self._opcua_shm)
-            opcua_shm_size = opcua_shm.size
-            while True:
-                try:
-                    # Read the content from shared memory
-                    if opcua_variables is not None:
-                        opcua_semaphore.acquire()
-                        opcua_values_json = bytes(opcua_shm.buf[:]).decode('utf-8').rstrip('\x00')
-                        if opcua_values_json:
-
-                            while opcua_values_json == opcua_shm_response:
-                                opcua_semaphore.release()
-                                await asyncio.sleep(.01)
-                                opcua_semaphore.acquire()
-                                opcua_values_json = bytes(opcua_shm.buf[:]).decode('utf-8').rstrip('\x00')
-                            try:
-                                opcua_values = json.loads(opcua_values_json)
-                                _logger.info(f"Shared Memory Content of {self._opcua_shm}: {json.dumps(opcua_values, indent=4)}")
-                            except json.JSONDecodeError as e:
-                                _logger.error(f"Error decoding JSON from shared memory: {e}")
-                            opcua_shm_response = hashlib.md5(opcua_values_json.encode()).hexdigest()
-                            opcua_shm.buf[:opcua_shm_size] = b'\x00' * opcua_shm_size  # Clear the shared memory buffer
-                            opcua_shm.buf[:len(opcua_shm_response)] = opcua_shm_response.encode('utf-8')
-                        opcua_semaphore.release()
-                        
-                        if opcua_values:
-                            list_a = [name for name, varData in opcua_values.items()]
-                            list_b = [name for name, var_node in opcua_variables]
-                            intersection = list(set(list_a) & set(list_b))
-                            difference = list(set(list_a) - set(list_b))
-                            _logger.info(f"Intersection: {intersection}")
-                            _logger.info(f"Difference: {difference}")
-
-                            for name, varData in opcua_values.items():
-                                if name in intersection:
-                                    value = varData['value']
-                                    varType = varData['varType']
-                                    for var_name, test_var in opcua_variables:
-                                        if var_name == name:
-                                            test_var: Node
-                                            await test_var.set_value(self._convert_value(varType, value))
-
-                                if name in difference:
-                                    _logger.warning(f"Adding new variable: {name}...")
-                                    _idx = await self._server.register_namespace(f"idx.opcua_shm.ua")
-                                    obj = await self._server.nodes.objects.get_child(f"{_idx}:opcua_shm")
-                                    # inside the name there is the first word before ":" e.g., "Ecotec: AM13 Volumenstrom 2"
-                                    # depending on this word, create a new object and add the variable to it
-                                    # if the object already exists, add the variable to it
-                                    if ":" in name:
-                                        object_name = name.split(":", 1)[0]
-                                        object_name_rest = name.split(":", 1)[1]
-                                        try:
-                                            new_obj = await obj.get_child(f"{_idx}:{object_name}")
-                                        except Exception as e:
-                                            _logger.warning(f"Creating new object: {object_name}...")
-                                            new_obj = await obj.add_object(_idx, object_name)
-                                        try:
-                                            converted_value = self._convert_value(varType, value)
-                                            var = await new_obj.add_variable(_idx, object_name_rest, converted_value)
-                                            opcua_variables.append((str(name), var))
-                                        except ValueError as e:
-                                            _logger.error(f"Error converting value for {name}: {e}")
-                                            opcua_variables.append((str(name), None))
-                                    else:
-                                        _logger.error(f"Error creating object for {name}: No object name found.")
-
-                    await asyncio.sleep(0.01)
-                except Exception as e:
-                    _logger.error(f"Error reading shared memory while updating server objects: {e}")
+            catalog = await self._wait_for_catalog(self._opcua_shm)
+            return await self._create_opcua_objects(catalog, "opcua_shm")
+        except Exception as e:
+            _logger.error(f"OPC UA: Error creating the address space from the tag catalog: {e}")
+            return []
 
-        except FileNotFoundError as e:
-            _logger.error(f"Shared memory {e} not found.")
+    async def create_modbus_population(self) -> list[tuple[str, Node | None]]:
+        """
+        Create the initial population of OPC UA variables from the tag catalog of the Modbus TCP shared memory
+        """
+        try:
+            catalog = await self._wait_for_catalog(self._modbus_shm)
+            return await self._create_opcua_objects(catalog, "modbus_shm")
         except Exception as e:
-            _logger.error(f"Error initializing shared memory while updating server objects: {e}")
-            if opcua_semaphore is not None:
-                opcua_semaphore.close()
+            _logger.error(f"ModbusTCP: Error creating the address space from the tag catalog: {e}")
+            return []
 
 
+    async def update_population_from_opcua_shm(self, opcua_variables: list[tuple[str, Node | None]]) -> None:
+        """
+        Update the population of OPC UA variables from OPC UA shared memory
+        :param opcua_variables: List of OPC UA variables, new variables are appended
+        """
+        await self._update_population(self._opcua_shm, "opcua_shm", opcua_variables)
 
     async def update_population_from_modbus_tcp_shm(self, modbus_tcp_variables: list[tuple[str, Node | None]]) -> None:
         """
         Update the population of OPC UA variables from Modbus TCP shared memory
-        :param modbus_tcp_variables: List of OPC UA variables
+        :param modbus_tcp_variables: List of OPC UA variables, new variables are appended
         """
-        # Initialize values at the beginning
-        modbus_values: dict[str, dict[str, Any]] = {}
-        modbus_shm_response: str = ""
-        modbus_semaphore = None
-        try:
-            modbus_semaphore = posix_ipc.Semaphore(self._modbus_sem)
-            modbus_shm = shared_memory.SharedMemory(name=self._modbus_shm)
-            modbus_shm_size = modbus_shm.size
-            while True:
-                try:
-                    # Read the content from shared memory
-                    if modbus_tcp_variables is not None:
-                        modbus_semaphore.acquire()
-                        modbus_values_json = bytes(modbus_shm.buf[:]).decode('utf-8').rstrip('\x00')
-                        if modbus_values_json:
-                            while modbus_values_json == modbus_shm_response:
-                                modbus_semaphore.release()
-                                await asyncio.sleep(.01)
-                                modbus_semaphore.acquire()
-                                modbus_values_json = bytes(modbus_shm.buf[:]).decode('utf-8').rstrip('\x00')
-                            try:
-                                modbus_values = json.loads(modbus_values_json)
-                                _logger.info(f"Shared Memory Content of {self._modbus_shm}: {json.dumps(modbus_values, indent=4)}")
-                            except json.JSONDecodeError as e:
-                                _logger.error(f"Error decoding JSON from shared memory: {e}")
-                            modbus_shm_response = hashlib.md5(modbus_values_json.encode()).hexdigest()
-                            modbus_shm.buf[:modbus_shm_size] = b'\x00' * modbus_shm_size  # Clear the shared memory buffer
-                            modbus_shm.buf[:len(modbus_shm_response)] = modbus_shm_response.encode('utf-8')
-                        modbus_semaphore.release()
-                        
-                        if modbus_values:
-                            list_a = [name for name, varData in modbus_values.items()]
-                            list_b = [name for name, var_node in modbus_tcp_variables]
-                            intersection = list(set(list_a) & set(list_b))
-                            difference = list(set(list_a) - set(list_b))
-                            _logger.info(f"Intersection: {intersection}")
-                            _logger.info(f"Difference: {difference}")
-
-                            for name, varData in modbus_values.items():
-                                if name in intersection:
-                                    value = varData['value']
-                                    varType = varData['varType']
-                                    for var_name, test_var in modbus_tcp_variables:
-                                        if var_name == name:
-                                            test_var: Node
-                                            await test_var.set_value(self._convert_value(varType, value))
-                                if name in difference:
-                                    _logger.warning(f"Adding new variable: {name}...")
-                                    _idx = await self._server.register_namespace(f"idx.modbus_shm.ua")
-                                    obj = await self._server.nodes.objects.get_child(f"{_idx}:modbus_shm")
-
-                                    # inside the name there is the first word before ":" e.g., "Ecotec: AM13 Volumenstrom 2"
-                                    # depending on this word, create a new object and add the variable to it
-                                    # if the object already exists, add the variable to it
-                                    if ":" in name:
-                                        object_name = name.split(":", 1)[0]
-                                        object_name_rest = name.split(":", 1)[1]
-                                        try:
-                                            new_obj = await obj.get_child(f"{_idx}:{object_name}")
-                                        except Exception as e:
-                                            _logger.warning(f"Creating new object: {object_name}...")
-                                            new_obj = await obj.add_object(_idx, object_name)
-
-                                        try:
-                                            converted_value = self._convert_value(varType, value)
-                                            var = await new_obj.add_variable(_idx, object_name_rest, converted_value)
-                                            modbus_tcp_variables.append((str(name), var))
-                                        except ValueError as e:
-                                            _logger.error(f"Error converting value for {name}: {e}")
-                                            modbus_tcp_variables.append((str(name), None))
-                                    else:
-                                        _logger.error(f"Error creating object for {name}: No object name found.")
-
-                    await asyncio.sleep(0.01)
-                except Exception as e:
-                    _logger.error(f"Error reading shared memory while updating server objects: {e}") # TODO: Change errror message
+        await self._update_population(self._modbus_shm, "modbus_shm", modbus_tcp_variables)
 
+    async def _update_population(self, shared_mem: str, opcua_object_name: str,
+                                 variables: list[tuple[str, Node | None]]) -> None:
+        """
+        Write the values of every new snapshot to the OPC UA variables. The snapshots are read and decoded by a
+        ShmReaderThread, the event loop only applies the batches it hands over. The variables are looked up in the
+        index, so the work per batch is proportional to the number of changed tags. All changes of a batch are applied
+        in a single write request with their source timestamp and status code
+        :param shared_mem: Name of the shared memory segment
+        :param opcua_object_name: Name of the OPC UA object the variables belong to
+        :param variables: List of OPC UA variables, new variables are appended
+        """
+        index = self._variables.setdefault(opcua_object_name, {})
+        try:
+            reader_thread = ShmReaderThread(self._reader(shared_mem), asyncio.get_running_loop())
         except FileNotFoundError as e:
             _logger.error(f"Shared memory {e} not found.")
+            return
         except Exception as e:
             _logger.error(f"Error initializing shared memory while updating server objects: {e}")
-            if modbus_semaphore is not None:
-                modbus_semaphore.close()
-
-
-    def _convert_value(self, varType: str, value: str | int | float | bool) -> ua.Variant:
-        """
-        Convert the value to the appropriate OPC UA data type
-        :param varType: OPC UA data type
-        :param value: Value to convert
-        :return: Converted value
-        """
-        if varType == "Boolean":
-            return ua.Variant(value, ua.VariantType.Boolean)
-        elif varType == "Float":
-            return ua.Variant(value, ua.VariantType.Float)
-        elif varType == "Int64":
-            return ua.Variant(value, ua.VariantType.Int64)
-        elif varType == "UInt32":
-            return ua.Variant(value, ua.VariantType.UInt32)
-        elif varType == "Byte":
-            return ua.Variant(value, ua.VariantType.Byte)
-        elif varType == "Int32":
-            return ua.Variant(value, ua.VariantType.Int32)
-        elif varType == "Int16":
-            return ua.Variant(value, ua.VariantType.Int16)
-        elif varType == "UInt16":
-            return ua.Variant(value, ua.VariantType.UInt16)
-        elif varType == "String":
-            return ua.Variant(value, ua.VariantType.String)
-        # Add other conversions as needed
-        else:
-            raise ValueError(f"Unsupported varType: {varType}")
\ No newline at end of file
+            return
+        reader_thread.start()
+        try:
+            while True:
+                values = await reader_thread.get()
+                try:
+                    new_tags = [(name, varData['varType'], varData['description'])
+                                for name, varData in values.items() if name not in index]
+                    if new_tags:
+                        _logger.warning(f"Adding {len(new_tags)} new variables to {opcua_object_name}...")
+                        variables.extend(await self._add_variables(opcua_object_name, new_tags))
+                    writes = []
+                    for name, varData in values.items():
+                        variable = index[name]
+                        if variable.node is None:
+                            continue
+                        write = self._prepare_write(name, variable, varData)
+                        if write is not None:
+                            writes.append(write)
+
+                    if writes:
+                        await self._write_values(writes)
+                except Exception as e:
+                    _logger.error(f"Error updating server objects from {shared_mem}: {e}")
+        finally:
+            reader_thread.stop()
+
+
+    def _reader(self, shared_mem: str) -> SnapshotReader:
+        """
+        Get the reader of a shared memory segment. The segment is attached once, the first read of the update loop
+        returns the full state
+        :param shared_mem: Name of the shared memory segment
+        :raises FileNotFoundError: If the producer has not created the segment yet
+        """
+        reader = self._readers.get(shared_mem)
+        if reader is None:
+            reader = self._readers[shared_mem] = SnapshotReader(shared_mem)
+        return reader
+
+    def _prepare_write(self, name: str, variable: _Variable,
+                       varData: dict[str, str | int | float | bool]) -> ua.WriteValue | None:
+        """
+        Hot path of the update loop: convert a changed value with the precomputed converter of its tag. Unchanged
+        values are skipped before a Variant is built
+        :param name: Tag name
+        :param variable: Index entry of the tag
+        :param varData: Dict with 'value', 'varType', 'description' and 'timestamp' keys
+        :return: The write of the value or None if neither value nor status changed
+        """
+        value = varData['value']
+        status = self._status_code(varData)
+        if varData['varType'] != variable.var_type:
+            try:
+                variable.convert = converter(varData['varType'])
+            except ValueError as e:
+                _logger.error(f"Error converting value for {name}: {e}")
+                return None
+            variable.var_type = varData['varType']
+        elif type(value) is type(variable.value) and value == variable.value and status == variable.status:
+            return None  # Only the timestamp changed
+        variable.value = value
+        variable.status = status
+        return self._write_value(variable.node, variable.convert(value), status, varData)
+
+    async def _write_values(self, writes: list[ua.WriteValue]) -> None:
+        """
+        Apply the value changes of a batch in one write request through the internal session of the server,
+        instead of one awaited set_value per variable
+        :param writes: Write values of the changed variables
+        """
+        params = ua.WriteParameters()
+        params.NodesToWrite = writes
+        results = await self._server.iserver.isession.write(params)
+        for write, result in zip(writes, results):
+            if not result.is_good():
+                _logger.error(f"Error writing value to {write.NodeId}: {result}")
+
+    @staticmethod
+    def _write_value(node: Node, variant: ua.Variant, status: ua.StatusCode,
+                     varData: dict[str, str | int | float | bool]) -> ua.WriteValue:
+        """
+        Build the write of a value with the source timestamp and status code of its shared memory entry
+        :param node: The OPC UA variable
+        :param variant: Converted value
+        :param status: Status code, see _status_code
+        :param varData: Dict with 'value', 'varType', 'description' and 'timestamp' keys
+        """
+        source_timestamp = None
+        if 'timestamp' in varData:
+            source_timestamp = datetime.fromtimestamp(varData['timestamp'], timezone.utc)
+        # Positional arguments, the default factories of WriteValue and DataValue cost more than the write itself
+        return ua.WriteValue(node.nodeid, ua.AttributeIds.Value, None, ua.DataValue(variant, status, source_timestamp))
+
+    @staticmethod
+    def _status_code(varData: dict[str, str | int | float | bool]) -> ua.StatusCode:
+        """
+        Map the flags of a shared memory entry to an OPC UA status code. The server discards the value of a bad write,
+        the variable then holds a null value until the next good one
+        """
+        if varData.get('status') == 'bad':
+            return STATUS_BAD
+        if varData.get('stale'):
+            return STATUS_STALE
+        return STATUS_GOOD
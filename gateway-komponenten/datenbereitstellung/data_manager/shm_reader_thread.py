@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+import time
+from threading import Event, Lock, Thread
+from typing import Any
+
+from shm_snapshot import POLL_INTERVAL, SnapshotReader
+
+_logger = logging.getLogger(__name__)
+
+
+class ShmReaderThread(Thread):
+    """
+    Reads and decodes the snapshots of a shared memory segment in its own thread, so polling and decoding never run on
+    the event loop that serves the OPC UA clients.
+    Snapshots that arrive while the event loop is busy are merged tag by tag into one pending batch, the event loop is
+    woken up with call_soon_threadsafe once per batch and takes the batch with get().
+    """
+    def __init__(self, reader: SnapshotReader, loop: asyncio.AbstractEventLoop):
+        """
+        :param reader: Reader of the producer's segment, it must not be used by the event loop while the thread runs
+        :param loop: Event loop that consumes the batches
+        """
+        Thread.__init__(self, name=f"shm-reader-{reader.name}", daemon=True)
+        self._reader = reader
+        self._loop = loop
+        self._lock = Lock()
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._ready = asyncio.Event()
+        self._stop_event = Event()
+        self.snapshots = 0  # Snapshots read
+        self.batches = 0  # Batches taken by the event loop
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                snapshot = self._reader.read()
+                if snapshot is None:
+                    time.sleep(POLL_INTERVAL) # Wait for new values...
+                    continue
+                values, _ = snapshot # Only the changed tags unless a keyframe was read
+                if _logger.isEnabledFor(logging.DEBUG):  # Serializing a snapshot would compete with the event loop
+                    _logger.debug(f"Shared Memory Content of {self._reader.name}: {json.dumps(values, indent=4)}")
+                self.snapshots += 1
+                with self._lock:
+                    wake_up = not self._pending
+                    self._pending.update(values)
+                if wake_up:
+                    self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                return  # The event loop was closed
+            except Exception as e:
+                _logger.error(f"Error reading shared memory {self._reader.name}: {e}")
+
+    async def get(self) -> dict[str, dict[str, Any]]:
+        """
+        Wait for the next batch.
+        :return: Value dictionary of the tags that changed since the last batch
+        """
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if batch:
+                self.batches += 1
+                return batch
+
+    def stop(self) -> None:
+        self._stop_event.set()
@@ -42,6 +42,16 @@ async def send_vor_request(mq:posix_ipc.MessageQueue, request:str):
         await asyncio.sleep(2)
     
 
+async def provide(populate, update) -> None:
+    """
+    Build the part of the address space of one shared memory source from its tag catalog and keep it updated.
+    Each source runs on its own, a producer that has not published its catalog yet does not hold back the others.
+    """
+    variables = await populate()
+    _logger.info(f"Initial population: {len(variables)} variables")
+    await update(variables)
+
+
 async def main():
     # user_manager_xml = UserManagerXML()
     # list_vor_parameters = user_manager_xml.parameters
@@ -53,16 +63,13 @@ async def main():
 
     #server = await setup_opcua_server()
     server = await setup_opcua_server(list_vor_parameters)
-    await asyncio.sleep(5)
 
-    opcua_shm_name = 'opcua_shm_interface'
-    opcua_sem_name = 'opcua_semaphore_interface'
-    modbus_shm_name = 'modbus_shm_interface'
-    modbus_sem_name = 'modbus_semaphore_interface'
+    opcua_shm_name = 'opcua_shm'
+    modbus_shm_name = 'modbus_shm'
 
     # Initial shared memory reading for OPC UA Server setup
     opcua_variables = []
-    data_manager = DataManager(server, opcua_shm_name, opcua_sem_name, modbus_shm_name, modbus_sem_name)
+    data_manager = DataManager(server, opcua_shm_name, modbus_shm_name)
 
     # Setup POSIX message queue for ipc with the intermediate VoR partition
     # try:
@@ -73,17 +80,13 @@ async def main():
     _logger.warning("OPC UA Server of the interface partition is running.")
     async with server:
         try:
-            # Initial population of OPC UA Server
+            # Initial population and periodic update of OPC UA Server
             #opcua_variables, modbus_variables = await data_manager.populate_opcua_server()
-            opcua_variables = await asyncio.create_task(data_manager.create_opcua_population())
-            print(f"OPC UA: {opcua_variables}")
-            modbus_variables = await asyncio.create_task(data_manager.create_modbus_population())
-            print(f"ModbusTCP: {modbus_variables}")
-
-            # Periodic update of OPC UA Server
             #periodic_update = asyncio.create_task(data_manager.update_server_objects(opcua_variables, modbus_variables))
-            periodic_update_opcua = asyncio.create_task(data_manager.update_population_from_opcua_shm(opcua_variables))
-            periodic_update_modbus_tcp = asyncio.create_task(data_manager.update_population_from_modbus_tcp_shm(modbus_variables))
+            periodic_update_opcua = asyncio.create_task(provide(data_manager.create_opcua_population,
+                                                                data_manager.update_population_from_opcua_shm))
+            periodic_update_modbus_tcp = asyncio.create_task(provide(data_manager.create_modbus_population,
+                                                                     data_manager.update_population_from_modbus_tcp_shm))
             #periodic_vor_request = asyncio.create_task(send_vor_request(mq, "Test Request"))
 
             await asyncio.gather(periodic_update_opcua, periodic_update_modbus_tcp)
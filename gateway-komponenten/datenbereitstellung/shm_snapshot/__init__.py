@@ -0,0 +1,17 @@
+# __init__.py
+# The shm_snapshot package is shared by the producer (datenaggregation) and the consumers (psmo, datenbereitstellung).
+# Each partition is built from its own Docker context, so every partition ships an identical copy. Keep them in sync.
+from .layout import (FORMAT_BINARY, FORMAT_JSON, POLL_INTERVAL, MAX_SEGMENT_SIZE, SnapshotOverflowError,
+                     snapshot_segment_size)
+from .reader import (SnapshotHeader, attach_segment, read_published_seq, snapshot_buffer, read_header, read_catalog,
+                     read_value, decode_values, decode_changes, read_snapshot, SnapshotReader)
+from .writer import SnapshotWriter
+from .publisher import SnapshotPublisher
+from .history import HistoryWriter, HistoryReader, history_segment_size
+from .tag_catalog import write_tag_catalog, read_tag_catalog
+
+__all__ = ["FORMAT_BINARY", "FORMAT_JSON", "POLL_INTERVAL", "MAX_SEGMENT_SIZE", "SnapshotOverflowError",
+           "snapshot_segment_size", "SnapshotHeader", "attach_segment", "read_published_seq", "snapshot_buffer",
+           "read_header", "read_catalog", "read_value", "decode_values", "decode_changes", "read_snapshot",
+           "SnapshotReader", "SnapshotWriter", "SnapshotPublisher", "HistoryWriter", "HistoryReader",
+           "history_segment_size", "write_tag_catalog", "read_tag_catalog"]
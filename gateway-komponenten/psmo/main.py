@@ -1,50 +1,73 @@
 import logging
-import queue
 import time
 
-from psmo_shm_handler import OPCUA_Thread, ModbusTCP_Thread
+from psmo_shm_handler import OPCUA_Thread, ModbusTCP_Thread, Dispatcher, POLICY_MERGE
+from mo_pipeline import Pipeline, Plugin, WindowedAggregator, AGGREGATE_SOURCE
 
 _logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
-# TODO: Decide on message queuing strategy!
+def log_item_count(source: str, item: dict) -> None:
+    _logger.info(f"Retrieved {len(item.keys())} items from {source} queue.")
+
+
+def log_result(plugin: str, result: dict) -> None:
+    _logger.info(f"Result of plugin {plugin}: {result}")
+
+
 def main():
     time.sleep(7)
-    opcua_shm_name = 'opcua_shm_psmo'
-    opcua_semaphore_name = 'opcua_semaphore_psmo'
-    opcua_queue = queue.Queue(maxsize=5)
-    opcua_thread = OPCUA_Thread(opcua_semaphore_name, opcua_shm_name, opcua_queue)
+    # Both reader threads feed the dispatcher, M+O processing hooks are registered per source
+    dispatcher = Dispatcher()
+
+    # M+O analytics plugins run in worker processes, e.g.
+    # LimitMonitor('Pressure limits', 'ModbusTCP', {'<serveralias>: <endpoint name>': (0.0, 10.0)})
+    plugins: list[Plugin] = []
+    pipeline = Pipeline(plugins)
+    pipeline.add_result_hook(log_result)
+
+    # Rolling statistics of all numeric tags, plugins subscribe to them under AGGREGATE_SOURCE,
+    # e.g. LimitMonitor('Pressure trend', AGGREGATE_SOURCE, {'<serveralias>: <endpoint name> [rate@60s]': (-0.5, 0.5)})
+    aggregator = WindowedAggregator(windows=[10, 60, 600], max_tags=4096, memory_budget=32 * 1024 * 1024)
+
+    def aggregate(source: str, item: dict) -> None:
+        aggregator.update(source, item)
+        if aggregator.compute_if_due():
+            pipeline.submit(AGGREGATE_SOURCE, aggregator.aggregates(pipeline.subscriptions(AGGREGATE_SOURCE)))
+
+    opcua_shm_name = 'opcua_shm'
+    opcua_history_name = 'opcua_history'
+    opcua_queue = dispatcher.source('OPC UA', maxsize=5, policy=POLICY_MERGE) # Never stall the shm reader
+    opcua_thread = OPCUA_Thread(opcua_shm_name, opcua_queue, opcua_history_name)
+    dispatcher.register('OPC UA', log_item_count)
+    dispatcher.register('OPC UA', pipeline.submit)
+    dispatcher.register('OPC UA', aggregate)
 
-    modbus_shm_name = 'modbus_shm_psmo'
-    modbus_semaphore_name = 'modbus_semaphore_psmo'
-    modbus_queue = queue.Queue(maxsize=5)
-    modbus_thread = ModbusTCP_Thread(modbus_semaphore_name, modbus_shm_name, modbus_queue)
+    modbus_shm_name = 'modbus_shm'
+    modbus_history_name = 'modbus_history'
+    modbus_queue = dispatcher.source('ModbusTCP', maxsize=5, policy=POLICY_MERGE)
+    modbus_thread = ModbusTCP_Thread(modbus_shm_name, modbus_queue, modbus_history_name)
+    dispatcher.register('ModbusTCP', log_item_count)
+    dispatcher.register('ModbusTCP', pipeline.submit)
+    dispatcher.register('ModbusTCP', aggregate)
 
     opcua_thread.start()
     modbus_thread.start()
 
     try:
         print("psM+O partition is running.")
-        while True:
-            if not opcua_queue.empty():
-                #_logger.info(f"main processing could be done here...")
-                item = opcua_queue.get()
-                item_count = len(item.keys())
-                _logger.info(f"Retrieved {item_count} items from OPC UA queue. Waiting to process...")
-            if not modbus_queue.empty():
-                #_logger.info(f"main processing could be done here...")
-                item = modbus_queue.get()
-                item_count = len(item.keys())
-                _logger.info(f"Retrieved {item_count} items from ModbusTCP queue. Waiting to process...")
-            #time.sleep(.05)
+        dispatcher.run() # Blocks until a reader thread delivers a snapshot, no CPU is used while idle
     except Exception as e:
         _logger.error(f"Error handling main-process: {e}")
     except KeyboardInterrupt:
+        _logger.info(f"Backpressure counters: {dispatcher.stats()}")
+        dispatcher.stop()
         opcua_thread.stop()
         modbus_thread.stop()
         opcua_thread.join()
         modbus_thread.join()
+        pipeline.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,6 @@
+from .plugin import Plugin, TagFrame, LimitMonitor, STATUS_GOOD, STATUS_STALE, STATUS_BAD, STATUS_MISSING
+from .pipeline import Pipeline
+from .aggregation import WindowedAggregator, AGGREGATE_SOURCE, STATISTICS, aggregate_name
+
+__all__ = ["Plugin", "TagFrame", "LimitMonitor", "Pipeline", "WindowedAggregator", "AGGREGATE_SOURCE", "STATISTICS",
+           "aggregate_name", "STATUS_GOOD", "STATUS_STALE", "STATUS_BAD", "STATUS_MISSING"]
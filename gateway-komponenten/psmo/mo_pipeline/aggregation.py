@@ -0,0 +1,233 @@
+import logging
+import time
+from typing import Any
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+# Dispatcher source under which the aggregates are handed to the pipeline
+AGGREGATE_SOURCE = 'Aggregates'
+STATISTICS = ('min', 'max', 'mean', 'std', 'rate', 'crossings')
+
+# Timestamp and value of a sample (float64 each)
+BYTES_PER_SAMPLE = 16
+# Tags computed per chunk by compute()
+CHUNK_TAGS = 256
+# Scratch memory of compute() per sample of a chunk: one float64 work array, four bool masks
+SCRATCH_BYTES_PER_SAMPLE = 12
+# Head (int64) and threshold (float64) of a tag
+BYTES_PER_TAG = 16
+
+
+def aggregate_name(tag: str, statistic: str, window: float) -> str:
+    """
+    Name of an aggregate as published under AGGREGATE_SOURCE, e.g. 'Pump: Pressure [mean@60s]'.
+    """
+    return f"{tag} [{statistic}@{window:g}s]"
+
+
+class WindowedAggregator:
+    """
+    Rolling statistics per tag over several time windows, computed with NumPy, vectorized over chunks of CHUNK_TAGS
+    tags. Samples are kept in preallocated columnar ring buffers (one row per tag for timestamps and values) and the
+    chunks are computed in preallocated scratch buffers, so the memory use is fixed when the aggregator is created.
+    Per window it computes min, max, mean, standard deviation, rate of change (per second, between the first and the
+    last sample in the window) and the number of threshold crossings.
+    Snapshots only carry the tags that changed, so a tag without a sample in a window holds its last value.
+    A window only covers the samples still in the ring, so a tag that changes faster than `capacity / window` samples per
+    second is aggregated over a shorter time.
+    """
+    def __init__(self, windows: list[float], max_tags: int = 4096, memory_budget: int = 32 * 1024 * 1024,
+                 thresholds: dict[str, float] | None = None, interval: float = 1.0):
+        """
+        :param windows: Window lengths in seconds
+        :param max_tags: Maximum number of tags, further tags are ignored
+        :param memory_budget: Bytes for the ring buffers and the scratch buffers of compute(), the number of samples
+                              per tag is derived from it
+        :param thresholds: Dictionary mapping tag names to the threshold whose crossings are counted
+        :param interval: Minimum time in seconds between two computations by compute_if_due
+        """
+        self.windows = sorted(windows)
+        self.max_tags = max_tags
+        chunk = min(CHUNK_TAGS, max_tags)
+        self.capacity = (memory_budget - max_tags * BYTES_PER_TAG) // \
+            (max_tags * BYTES_PER_SAMPLE + chunk * SCRATCH_BYTES_PER_SAMPLE)
+        if self.capacity < 2:
+            raise ValueError(f"A memory budget of {memory_budget} bytes is too small for {max_tags} tags.")
+        self._times = np.full((max_tags, self.capacity), np.nan)
+        self._values = np.full((max_tags, self.capacity), np.nan)
+        self._heads = np.zeros(max_tags, dtype=np.int64)  # Number of samples ever written per tag
+        self._thresholds = np.full(max_tags, np.nan)
+        # Scratch buffers of compute(), one row per tag of a chunk
+        self._work = np.empty((chunk, self.capacity))
+        self._mask = np.empty((chunk, self.capacity), dtype=bool)
+        self._above = np.empty((chunk, self.capacity), dtype=bool)
+        self._changes = np.empty((chunk, self.capacity), dtype=bool)
+        self._pairs = np.empty((chunk, self.capacity), dtype=bool)
+        self._threshold_config = thresholds or {}
+        self._indices: dict[str, int] = {}
+        self._full_logged = False
+        self.interval = interval
+        self._computed_at = 0.0
+        self.results: dict[float, dict[str, np.ndarray]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the ring buffers and the scratch buffers of compute().
+        """
+        return sum(buffer.nbytes for buffer in (self._times, self._values, self._heads, self._thresholds, self._work,
+                                                self._mask, self._above, self._changes, self._pairs))
+
+    @property
+    def tags(self) -> list[str]:
+        return list(self._indices)
+
+    def update(self, source: str, values: dict[str, dict[str, Any]]) -> None:
+        """
+        Dispatcher hook: append a sample for every numeric, good tag of a snapshot (full or delta) whose timestamp is
+        newer than its last sample.
+        """
+        now = time.time()
+        for name, entry in values.items():
+            value = entry['value']
+            if entry.get('status') == 'bad' or entry.get('stale') or not isinstance(value, (bool, int, float)):
+                continue
+            index = self._indices.get(name)
+            if index is None:
+                index = self._add_tag(name)
+                if index is None:
+                    continue
+            head = self._heads[index]
+            timestamp = entry.get('timestamp', now)
+            if head > 0 and timestamp <= self._times[index, (head - 1) % self.capacity]:
+                continue  # Unchanged tag repeated by a keyframe
+            self._times[index, head % self.capacity] = timestamp
+            self._values[index, head % self.capacity] = value
+            self._heads[index] = head + 1
+
+    def compute_if_due(self) -> bool:
+        """
+        Compute the statistics if `interval` seconds have passed since the last computation, so snapshots of several
+        sources arriving in the same cycle are aggregated in one pass.
+        :return: True if the statistics were computed
+        """
+        now = time.time()
+        if now - self._computed_at < self.interval:
+            return False
+        self.compute(now)
+        return True
+
+    def compute(self, now: float | None = None) -> dict[float, dict[str, np.ndarray]]:
+        """
+        Compute all statistics of all windows.
+        :param now: End of the windows (default: current time)
+        :return: Dictionary mapping every window to a dictionary of statistic name to an array with one entry per tag
+                 (in the order of `tags`). Also stored in `results`
+        """
+        if now is None:
+            now = time.time()
+        n = len(self._indices)
+        results = {window: {'min': np.empty(n), 'max': np.empty(n), 'mean': np.empty(n), 'std': np.empty(n),
+                            'rate': np.empty(n), 'crossings': np.empty(n, dtype=np.int64)}
+                   for window in self.windows}
+        chunk = len(self._work)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for start in range(0, n, chunk):
+                self._compute_chunk(start, min(start + chunk, n), now, results)
+        self.results = results
+        self._computed_at = now
+        return results
+
+    def _compute_chunk(self, start: int, stop: int, now: float, results: dict[float, dict[str, np.ndarray]]) -> None:
+        """
+        Compute all statistics of all windows for the tags `start` to `stop` into `results`, using the scratch buffers.
+        """
+        m = stop - start
+        capacity = self.capacity
+        # The samples are evaluated in ring order. Samples are appended in chronological order, so the samples in a
+        # window are always the newest `count` samples of a tag and only the newest/oldest pair is not adjacent in time
+        times = self._times[start:stop]
+        values = self._values[start:stop]
+        heads = self._heads[start:stop]
+        work = self._work[:m]
+        mask = self._mask[:m]
+        pairs = self._pairs[:m]
+        rows = np.arange(m)
+        newest = (heads - 1) % capacity
+        has_value = heads > 0
+        last_value = values[rows, newest]
+        above = np.greater(values, self._thresholds[start:stop, None], out=self._above[:m])
+        # Position j compared with j + 1 (ring order)
+        changes = self._changes[:m]
+        np.not_equal(above[:, :-1], above[:, 1:], out=changes[:, :-1])
+        np.not_equal(above[:, -1], above[:, 0], out=changes[:, -1])
+
+        for window in self.windows:
+            result = {statistic: column[start:stop] for statistic, column in results[window].items()}
+            np.greater_equal(times, now - window, out=mask)  # False for unwritten samples (NaN)
+            count = mask.sum(axis=1)
+            empty = count == 0
+            work.fill(np.inf)
+            np.copyto(work, values, where=mask)
+            work.min(axis=1, out=result['min'])
+            work.fill(-np.inf)
+            np.copyto(work, values, where=mask)
+            work.max(axis=1, out=result['max'])
+            work.fill(0.0)
+            np.copyto(work, values, where=mask)
+            mean = result['mean']
+            np.divide(work.sum(axis=1), count, out=mean)
+            # Two passes: E[x²] - mean² cancels out for small variations of large values (e.g. meter readings)
+            np.subtract(values, mean[:, None], out=work, where=mask)
+            np.sqrt(np.einsum('ij,ij->i', work, work) / count, out=result['std'])
+            oldest = (heads - count) % capacity
+            duration = times[rows, newest] - times[rows, oldest]
+            result['rate'][:] = np.where(duration > 0, (last_value - values[rows, oldest]) / duration, 0.0)
+            np.logical_and(changes, mask, out=pairs)
+            pairs[:, :-1] &= mask[:, 1:]
+            pairs[:, -1] &= mask[:, 0]
+            # The newest/oldest pair is no crossing
+            np.subtract(pairs.sum(axis=1), pairs[rows, newest], out=result['crossings'])
+
+            # No sample in the window: the tag held its last value for the whole window
+            hold = empty & has_value
+            for statistic in ('min', 'max', 'mean'):
+                result[statistic][empty] = np.where(hold, last_value, np.nan)[empty]
+            result['std'][empty] = np.where(hold, 0.0, np.nan)[empty]
+            result['rate'][empty] = np.where(hold, 0.0, np.nan)[empty]
+
+    def aggregates(self, names: set[str] | None = None) -> dict[str, dict[str, Any]]:
+        """
+        Format the last computed results as a value dictionary for the pipeline (source AGGREGATE_SOURCE).
+        :param names: Aggregate names to include (see aggregate_name), default: all
+        """
+        if names is None:
+            names = [aggregate_name(tag, statistic, window) for window in self.results for statistic in STATISTICS
+                     for tag in self._indices]
+        aggregates = {}
+        for aggregate in names:
+            if ' [' not in aggregate:
+                continue
+            tag, spec = aggregate.rsplit(' [', 1)
+            statistic, window = spec[:-2].split('@')
+            column = self.results.get(float(window), {}).get(statistic)
+            index = self._indices.get(tag)
+            if column is None or index is None or index >= len(column):
+                continue  # Unknown window or tag, or tag added after the last compute()
+            aggregates[aggregate] = {'value': column[index].item(),
+                                     'varType': 'UInt32' if statistic == 'crossings' else 'Double',
+                                     'description': f"{statistic} of {tag} over {window} s"}
+        return aggregates
+
+    def _add_tag(self, name: str) -> int | None:
+        if len(self._indices) >= self.max_tags:
+            if not self._full_logged:
+                _logger.error(f"Windowed aggregator is full ({self.max_tags} tags), further tags are not aggregated.")
+                self._full_logged = True
+            return None
+        index = len(self._indices)
+        self._indices[name] = index
+        self._thresholds[index] = self._threshold_config.get(name, np.nan)
+        return index
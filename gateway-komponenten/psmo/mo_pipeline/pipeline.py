@@ -0,0 +1,205 @@
+import logging
+import multiprocessing
+import struct
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+from .plugin import Plugin, TagFrame, STATUS_BAD, STATUS_MISSING, STATUS_STALE
+
+_logger = logging.getLogger(__name__)
+
+DOUBLE = struct.Struct("<d")
+NAN = float('nan')
+
+ResultHook = Callable[[str, dict[str, Any]], None]
+
+
+def _slot_size(tag_count: int) -> int:
+    """
+    Size of the slot of a plugin: one float64 value and one status byte per tag, aligned to 8 bytes.
+    """
+    return (tag_count * (DOUBLE.size + 1) + 7) & ~7
+
+
+# State of a worker process, set up once by _init_worker
+_worker_shm: shared_memory.SharedMemory | None = None
+_worker_plugins: list[Plugin] = []
+_worker_offsets: list[int] = []
+
+
+def _init_worker(arena_name: str, plugins: list[Plugin], offsets: list[int]) -> None:
+    global _worker_shm, _worker_plugins, _worker_offsets
+    # Workers share the resource tracker of the pipeline process, which unlinks the arena, so they attach normally
+    _worker_shm = shared_memory.SharedMemory(name=arena_name)
+    _worker_plugins = plugins
+    _worker_offsets = offsets
+
+
+def _run_plugin(index: int) -> dict[str, Any] | None:
+    """
+    Run a plugin in a worker process on the values in its slot. Only the plugin index is passed between the
+    processes, the values are read from shared memory.
+    """
+    plugin = _worker_plugins[index]
+    offset = _worker_offsets[index]
+    count = len(plugin.tags)
+    values = _worker_shm.buf[offset:offset + count * DOUBLE.size].cast('d')
+    status = _worker_shm.buf[offset + count * DOUBLE.size:offset + count * (DOUBLE.size + 1)]
+    try:
+        return plugin.process(TagFrame(plugin.source, plugin.tags, values, status))
+    finally:
+        values.release()
+        status.release()
+
+
+class Pipeline:
+    """
+    Runs M+O analytics plugins in a process pool, so CPU-heavy models neither hold the GIL of the shm reader threads
+    nor delay the dispatcher.
+    Every plugin owns a slot in a shared memory arena. When a snapshot changes a subscribed tag, the current values of
+    the plugin's tags are packed into its slot and only the plugin index is sent to a worker. A plugin runs at most
+    once at a time; snapshots arriving meanwhile are coalesced and the plugin runs again on the newest values as soon
+    as its run finished, even if its source stays quiet (report-by-exception).
+    """
+    def __init__(self, plugins: list[Plugin], max_workers: int | None = None, arena_name: str = 'psmo_pipeline'):
+        """
+        :param plugins: Plugins to run
+        :param max_workers: Number of worker processes (default: number of CPUs)
+        :param arena_name: Name of the shared memory segment holding the plugin slots
+        """
+        self._plugins = plugins
+        self._by_source: dict[str, list[int]] = {}
+        offsets = []
+        size = 0
+        for index, plugin in enumerate(plugins):
+            self._by_source.setdefault(plugin.source, []).append(index)
+            offsets.append(size)
+            size += _slot_size(len(plugin.tags))
+        self._offsets = offsets
+        self._arena = shared_memory.SharedMemory(name=arena_name, create=True, size=max(size, 8))
+        # Spawn the workers, forking a process that runs reader threads is unsafe
+        self._executor = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(arena_name, plugins, offsets))
+        self._lock = threading.Lock()
+        self._busy: set[int] = set()  # Plugins with a job in flight, their slot must not be written
+        self._pending: set[int] = set()  # Plugins that missed a change while they were busy
+        self._state: dict[str, dict[str, dict[str, Any]]] = {}  # Latest entry of every tag per source, under _lock
+        self._closed = False
+        self._result_hooks: list[ResultHook] = []
+        self.coalesced: dict[str, int] = {plugin.name: 0 for plugin in plugins}  # Changes not processed separately
+        self.failures: dict[str, int] = {plugin.name: 0 for plugin in plugins}
+
+    def add_result_hook(self, hook: ResultHook) -> None:
+        """
+        Register a hook that is called with the plugin name and the result of every plugin run that returned a result.
+        Hooks are called in a thread of the pipeline, not in the dispatcher thread.
+        """
+        self._result_hooks.append(hook)
+
+    def subscriptions(self, source: str) -> set[str]:
+        """
+        Names of all tags of a source the plugins subscribed to.
+        """
+        return {name for index in self._by_source.get(source, []) for name in self._plugins[index].tags}
+
+    def submit(self, source: str, values: dict[str, dict[str, Any]]) -> None:
+        """
+        Dispatcher hook: merge the snapshot (full or delta) into the state of its source and start the plugins whose
+        tags changed.
+        """
+        with self._lock:
+            self._state.setdefault(source, {}).update(values)
+        for index in self._by_source.get(source, []):
+            plugin = self._plugins[index]
+            with self._lock:
+                if index in self._busy:
+                    if any(name in values for name in plugin.tags):
+                        self._pending.add(index)
+                        self.coalesced[plugin.name] += 1
+                    continue
+                if not any(name in values for name in plugin.tags):
+                    continue
+                self._busy.add(index)
+            self._start(index)
+
+    def close(self) -> None:
+        """
+        Wait for running plugins, stop the workers and unlink the arena. Further calls do nothing.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True  # Pending plugins are not resubmitted any more
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._arena.close()
+        self._arena.unlink()
+
+    def _start(self, index: int) -> None:
+        """
+        Pack the current values of a plugin marked as busy into its slot and run it in a worker.
+        """
+        with self._lock:
+            self._pack(index, self._state.get(self._plugins[index].source, {}))
+        try:
+            future = self._executor.submit(_run_plugin, index)
+        except RuntimeError:  # The pipeline was closed
+            with self._lock:
+                self._busy.discard(index)
+            return
+        future.add_done_callback(partial(self._done, index))
+
+    def _pack(self, index: int, state: dict[str, dict[str, Any]]) -> None:
+        """
+        Write the current values of the plugin's tags into its slot. Called with the lock held.
+        """
+        buf = self._arena.buf
+        tags = self._plugins[index].tags
+        offset = self._offsets[index]
+        status_offset = offset + len(tags) * DOUBLE.size
+        for i, name in enumerate(tags):
+            entry = state.get(name)
+            value = entry['value'] if entry is not None else None
+            status = 0
+            if not isinstance(value, (bool, int, float)):
+                value, status = NAN, STATUS_MISSING
+            if entry is not None:
+                if entry.get('stale'):
+                    status |= STATUS_STALE
+                if entry.get('status') == 'bad':
+                    status |= STATUS_BAD
+            DOUBLE.pack_into(buf, offset + i * DOUBLE.size, float(value))
+            buf[status_offset + i] = status
+
+    def _done(self, index: int, future: Future) -> None:
+        """
+        Deliver the result of a plugin run, then run the plugin again on the newest values if its tags changed while
+        it was busy. The next snapshot of its source is not waited for, a quiet source may not send one.
+        """
+        self._deliver(self._plugins[index], future)
+        with self._lock:
+            resubmit = index in self._pending and not self._closed
+            self._pending.discard(index)
+            if not resubmit:
+                self._busy.discard(index)
+        if resubmit:
+            self._start(index)
+
+    def _deliver(self, plugin: Plugin, future: Future) -> None:
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            self.failures[plugin.name] += 1
+            _logger.error(f"Plugin {plugin.name} failed: {exception!r}")
+            return
+        result = future.result()
+        if result is None:
+            return
+        for hook in self._result_hooks:
+            try:
+                hook(plugin.name, result)
+            except Exception as e:
+                _logger.error(f"Error in result hook of plugin {plugin.name}: {e}")
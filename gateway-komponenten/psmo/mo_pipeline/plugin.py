@@ -0,0 +1,84 @@
+import math
+from typing import Any
+
+# Status of a tag value in a frame (STALE and BAD as in shm_snapshot)
+STATUS_GOOD = 0x00
+STATUS_STALE = 0x01
+STATUS_BAD = 0x02
+STATUS_MISSING = 0x04  # Tag not published (yet) or not numeric
+
+
+class TagFrame:
+    """
+    Values of the tags a plugin subscribed to, read in place from the shared memory slot of the plugin.
+    The views are only valid during Plugin.process, copy what has to be kept (e.g. with as_dict).
+    """
+    def __init__(self, source: str, tags: list[str], values: memoryview, status: memoryview):
+        self.source = source
+        self.tags = tags
+        self.values = values  # float64 per tag, NaN if the tag is missing
+        self.status = status  # STATUS_* flags per tag
+        self._indices = {name: index for index, name in enumerate(tags)}
+
+    def __getitem__(self, name: str) -> float:
+        return self.values[self._indices[name]]
+
+    def status_of(self, name: str) -> int:
+        return self.status[self._indices[name]]
+
+    def as_dict(self) -> dict[str, float]:
+        """
+        Copy the values of all tags that are not missing.
+        """
+        return {name: self.values[i] for i, name in enumerate(self.tags) if not self.status[i] & STATUS_MISSING}
+
+
+class Plugin:
+    """
+    Base class of the M+O analytics plugins.
+    A plugin subscribes to a set of tags of one source ('OPC UA' or 'ModbusTCP') and is called in a worker process of
+    the pipeline with the current values of these tags whenever at least one of them changed. Plugins are pickled
+    once per worker process, so every worker holds its own copy and process() must not rely on state kept between
+    calls.
+    """
+    def __init__(self, name: str, source: str, tags: list[str]):
+        """
+        :param name: Name of the plugin, used for results and logging
+        :param source: Dispatcher source the tags are published by
+        :param tags: Names of the subscribed tags
+        """
+        self.name = name
+        self.source = source
+        self.tags = list(tags)
+
+    def process(self, frame: TagFrame) -> dict[str, Any] | None:
+        """
+        Analyse the current values of the subscribed tags.
+        :param frame: Values and status of the subscribed tags
+        :return: Result dictionary that is handed to the result hooks of the pipeline, or None for no result
+        """
+        raise NotImplementedError
+
+
+class LimitMonitor(Plugin):
+    """
+    Example plugin: reports tags whose value is outside of its limits.
+    """
+    def __init__(self, name: str, source: str, limits: dict[str, tuple[float | None, float | None]]):
+        """
+        :param limits: Dictionary mapping tag names to (lower limit, upper limit), None for no limit
+        """
+        super().__init__(name, source, list(limits))
+        self.limits = limits
+
+    def process(self, frame: TagFrame) -> dict[str, Any] | None:
+        violations = {}
+        for name, (lower, upper) in self.limits.items():
+            value = frame[name]
+            if frame.status_of(name) & (STATUS_MISSING | STATUS_BAD) or math.isnan(value):
+                continue
+            if lower is not None and value < lower:
+                violations[name] = {'value': value, 'limit': lower, 'violation': 'low'}
+            elif upper is not None and value > upper:
+                violations[name] = {'value': value, 'limit': upper, 'violation': 'high'}
+        return violations or None
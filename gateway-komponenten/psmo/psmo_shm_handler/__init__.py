@@ -1,3 +1,6 @@
 from .psmo_shm_handler import OPCUA_Thread, ModbusTCP_Thread
+from .dispatcher import (Dispatcher, SourceQueue, POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_KEEP_LATEST, POLICY_MERGE,
+                         POLICIES)
 
-__all__ = ["OPCUA_Thread", "ModbusTCP_Thread"]
\ No newline at end of file
+__all__ = ["OPCUA_Thread", "ModbusTCP_Thread", "Dispatcher", "SourceQueue", "POLICY_BLOCK", "POLICY_DROP_OLDEST",
+           "POLICY_KEEP_LATEST", "POLICY_MERGE", "POLICIES"]
\ No newline at end of file
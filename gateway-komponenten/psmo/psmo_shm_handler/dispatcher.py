@@ -0,0 +1,161 @@
+import itertools
+import logging
+import queue
+from collections import deque
+from threading import Condition
+from typing import Any, Callable
+
+_logger = logging.getLogger(__name__)
+
+Hook = Callable[[str, Any], None]
+
+# Backpressure policies of a source queue, applied when the queue is full
+POLICY_BLOCK = 'block'  # The reader thread waits until the dispatcher took an item
+POLICY_DROP_OLDEST = 'drop_oldest'  # The oldest queued item is dropped
+POLICY_KEEP_LATEST = 'keep_latest'  # All queued items are replaced by the new one
+POLICY_MERGE = 'merge'  # The new value dictionary is merged into the newest queued one, tag by tag
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_KEEP_LATEST, POLICY_MERGE)
+
+
+class SourceQueue:
+    """
+    Bounded queue of a single source. The reader thread of the source puts its items here, the dispatcher it was
+    created by takes them out. Drop-in replacement for the `queue.Queue` the reader threads were given before.
+    The policy decides what happens when the queue is full. Only POLICY_BLOCK lets a slow consumer stall the reader
+    thread; the other policies count what they dropped, replaced or merged and never block.
+    Items are deltas, so after an item was dropped or replaced the queue requests a resync (see take_resync).
+    """
+    def __init__(self, name: str, maxsize: int, dispatcher: "Dispatcher", policy: str = POLICY_BLOCK):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {POLICIES}.")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self._dispatcher = dispatcher
+        self._items: deque[tuple[int, Any]] = deque()  # (arrival number, item)
+        self._resync = False
+        self.blocked = 0  # Puts that had to wait for room (POLICY_BLOCK)
+        self.dropped = 0  # Items dropped (POLICY_DROP_OLDEST)
+        self.coalesced = 0  # Items replaced by a newer one (POLICY_KEEP_LATEST)
+        self.merged = 0  # Items merged into a queued one (POLICY_MERGE)
+
+    def put(self, item: Any, block: bool = True, timeout: float | None = None) -> None:
+        """
+        Append an item and wake up the dispatcher.
+        :raises queue.Full: If the queue is full, the policy is POLICY_BLOCK and `block` is False or the timeout expired
+        """
+        condition = self._dispatcher._condition
+        with condition:
+            if self.maxsize > 0 and len(self._items) >= self.maxsize:
+                if self.policy == POLICY_MERGE:
+                    self._items[-1][1].update(item)
+                    self.merged += 1
+                    return  # The merged item keeps its place, the dispatcher was already notified
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    self._resync = True
+                elif self.policy == POLICY_KEEP_LATEST:
+                    self.coalesced += len(self._items)
+                    self._items.clear()
+                    self._resync = True
+                else:
+                    self.blocked += 1
+                    if not block or not condition.wait_for(lambda: len(self._items) < self.maxsize, timeout):
+                        raise queue.Full
+            self._items.append((next(self._dispatcher._arrivals), item))
+            condition.notify_all()
+
+    def take_resync(self) -> bool:
+        """
+        Check whether items were dropped since the last call. The reader thread then reads the full state next, so
+        the consumer does not miss the changes of the dropped deltas.
+        """
+        with self._dispatcher._condition:
+            resync, self._resync = self._resync, False
+            return resync
+
+    def stats(self) -> dict[str, int]:
+        return {'queued': len(self._items), 'blocked': self.blocked, 'dropped': self.dropped,
+                'coalesced': self.coalesced, 'merged': self.merged}
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+
+class Dispatcher:
+    """
+    Blocks until any source has an item and hands the items to the hooks registered for their source.
+    Items are delivered in the order they arrived across all sources, so bursts are processed in order and the
+    partition uses no CPU while all sources are idle.
+    """
+    def __init__(self):
+        self._condition = Condition()
+        self._arrivals = itertools.count()
+        self._sources: dict[str, SourceQueue] = {}
+        self._hooks: dict[str, list[Hook]] = {}
+        self._stopped = False
+
+    def source(self, name: str, maxsize: int = 0, policy: str = POLICY_BLOCK) -> SourceQueue:
+        """
+        Create the queue of a source.
+        :param name: Name of the source, hooks are registered under this name
+        :param maxsize: Maximum number of queued items (0: unbounded)
+        :param policy: Backpressure policy applied when the queue is full (POLICY_*)
+        """
+        source = SourceQueue(name, maxsize, self, policy)
+        self._sources[name] = source
+        self._hooks.setdefault(name, [])
+        return source
+
+    def register(self, source: str, hook: Hook) -> None:
+        """
+        Register a processing hook for a source.
+        :param hook: Called with the source name and the item, in the dispatcher thread
+        """
+        self._hooks.setdefault(source, []).append(hook)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Backpressure counters of all sources.
+        """
+        return {name: source.stats() for name, source in self._sources.items()}
+
+    def get(self, timeout: float | None = None) -> tuple[str, Any] | None:
+        """
+        Wait for the next item of any source.
+        :return: Tuple of (source name, item), or None if the dispatcher was stopped or the timeout expired
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._stopped or any(s._items for s in self._sources.values()),
+                                            timeout):
+                return None
+            if self._stopped:
+                return None
+            source = min((s for s in self._sources.values() if s._items), key=lambda s: s._items[0][0])
+            _, item = source._items.popleft()
+            self._condition.notify_all()  # Wake up a reader thread waiting for room
+            return source.name, item
+
+    def run(self) -> None:
+        """
+        Dispatch items until stop() is called.
+        """
+        while True:
+            next_item = self.get()
+            if next_item is None:
+                return
+            source, item = next_item
+            for hook in self._hooks.get(source, []):
+                try:
+                    hook(source, item)
+                except Exception as e:
+                    _logger.error(f"Error in processing hook {getattr(hook, '__name__', hook)} of {source}: {e}")
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
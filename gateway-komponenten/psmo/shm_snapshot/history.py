@@ -0,0 +1,295 @@
+"""
+Time-series ring buffers in shared memory: a fixed number of samples per tag, preallocated when the segment is created.
+
+Segment layout:
+    header   HISTORY_HEADER_SIZE bytes, see HISTORY_HEADER
+    catalog  JSON list of [name, varType] in tag index order, `catalog_capacity` bytes reserved. Tags are only appended,
+             so the index of a tag never changes
+    heads    one INT64 per tag: number of samples ever written to the tag
+    rings    per tag three arrays of `capacity` entries: snapshot seq (uint64), timestamp (double), value (double)
+
+Sample `n` of a tag is stored at ring position `n % capacity`. The writer stores the sample before it increments the
+head, readers check the head again after reading and discard samples that were overwritten meanwhile. The position of
+sample `head` still holds sample `head - capacity` until the writer stores the next sample there, so readers only
+use the newest `capacity - 1` samples.
+Only numeric values (Boolean, integer and floating point types) are recorded, as doubles. Samples are appended when
+the value of a tag changes, bad and stale values are not recorded.
+"""
+import json
+import logging
+import struct
+import time
+from multiprocessing import shared_memory
+
+from .layout import INT64, DOUBLE, align8
+
+_logger = logging.getLogger(__name__)
+
+HISTORY_MAGIC = b"SIOH"
+HISTORY_VERSION = 1
+
+# magic, version, max tags, samples per tag, catalog seqlock counter, catalog length, catalog capacity
+HISTORY_HEADER = struct.Struct("<4sH2xIIQII")
+HISTORY_HEADER_SIZE = 64
+UINT64 = struct.Struct("<Q")
+
+CATALOG_BYTES_PER_TAG = 128
+SAMPLE_SIZE = UINT64.size + DOUBLE.size + DOUBLE.size
+
+
+def history_segment_size(max_tags: int, capacity: int) -> int:
+    """
+    Size in bytes of a history segment for `max_tags` tags with `capacity` samples each.
+    """
+    catalog_capacity = max_tags * CATALOG_BYTES_PER_TAG
+    return align8(HISTORY_HEADER_SIZE + catalog_capacity) + max_tags * (INT64.size + capacity * SAMPLE_SIZE)
+
+
+class _RingLayout:
+    """
+    Offsets of the catalog, heads and rings of a history segment.
+    """
+    def __init__(self, max_tags: int, capacity: int, catalog_capacity: int):
+        self.max_tags = max_tags
+        self.capacity = capacity
+        self.catalog_capacity = catalog_capacity
+        self.heads_offset = align8(HISTORY_HEADER_SIZE + catalog_capacity)
+        self.rings_offset = self.heads_offset + max_tags * INT64.size
+
+    def head_offset(self, index: int) -> int:
+        return self.heads_offset + index * INT64.size
+
+    def ring_offsets(self, index: int) -> tuple[int, int, int]:
+        """
+        Offsets of the seq, timestamp and value arrays of a tag.
+        """
+        seq_offset = self.rings_offset + index * self.capacity * SAMPLE_SIZE
+        timestamp_offset = seq_offset + self.capacity * UINT64.size
+        return seq_offset, timestamp_offset, timestamp_offset + self.capacity * DOUBLE.size
+
+
+class HistoryWriter:
+    """
+    Appends the numeric values of every published snapshot to the per-tag rings of a history segment.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, max_tags: int, capacity: int):
+        if history_segment_size(max_tags, capacity) > shm.size:
+            raise ValueError(f"History segment {shm.name} needs {history_segment_size(max_tags, capacity)} bytes, it has {shm.size} bytes.")
+        self._shm = shm
+        self._layout = _RingLayout(max_tags, capacity, max_tags * CATALOG_BYTES_PER_TAG)
+        self._catalog: list[list[str]] = []
+        self._indices: dict[str, int] = {}
+        self._heads: list[int] = []
+        self._last: dict[str, float] = {}
+        self._catalog_lock = 0
+        self._full_logged = False
+        self._shm.buf[:shm.size] = bytes(shm.size)
+        self._write_header()
+
+    def append(self, seq: int, values: dict[str, dict[str, str | int | float | bool]]) -> None:
+        """
+        Append a sample for every numeric tag whose value changed.
+        :param seq: Sequence number of the snapshot the values were published with
+        :param values: Value dictionary of the snapshot
+        """
+        buf = self._shm.buf
+        now = time.time()
+        new_tags = False
+        for name, entry in values.items():
+            value = entry['value']
+            if entry.get('status') == 'bad' or entry.get('stale') or not isinstance(value, (bool, int, float)):
+                continue
+            value = float(value)
+            if self._last.get(name) == value:
+                continue
+            index = self._indices.get(name)
+            if index is None:
+                index = self._add_tag(name, entry['varType'])
+                if index is None:
+                    continue
+                new_tags = True
+            self._last[name] = value
+
+            head = self._heads[index]
+            position = head % self._layout.capacity
+            seq_offset, timestamp_offset, value_offset = self._layout.ring_offsets(index)
+            UINT64.pack_into(buf, seq_offset + position * UINT64.size, seq)
+            DOUBLE.pack_into(buf, timestamp_offset + position * DOUBLE.size, entry.get('timestamp', now))
+            DOUBLE.pack_into(buf, value_offset + position * DOUBLE.size, value)
+            self._heads[index] = head + 1
+            INT64.pack_into(buf, self._layout.head_offset(index), head + 1)  # Publish the sample
+        if new_tags:
+            self._write_catalog()
+
+    def _add_tag(self, name: str, var_type: str) -> int | None:
+        catalog_length = len(json.dumps(self._catalog + [[name, var_type]]).encode('utf-8'))
+        if len(self._catalog) >= self._layout.max_tags or catalog_length > self._layout.catalog_capacity:
+            if not self._full_logged:
+                _logger.error(f"History segment {self._shm.name} is full ({len(self._catalog)} tags), further tags are not recorded.")
+                self._full_logged = True
+            return None
+        self._catalog.append([name, var_type])
+        self._indices[name] = len(self._heads)
+        self._heads.append(0)
+        return self._indices[name]
+
+    def _write_catalog(self) -> None:
+        """
+        Rewrite the catalog under its seqlock. Existing tags keep their index, so readers can keep using it.
+        """
+        catalog_bytes = json.dumps(self._catalog).encode('utf-8')
+        self._catalog_lock += 1
+        self._write_header()  # Odd: catalog is being written
+        self._shm.buf[HISTORY_HEADER_SIZE:HISTORY_HEADER_SIZE + len(catalog_bytes)] = catalog_bytes
+        self._catalog_lock += 1
+        self._write_header(len(catalog_bytes))
+
+    def _write_header(self, catalog_length: int | None = None) -> None:
+        if catalog_length is None:
+            catalog_length = HISTORY_HEADER.unpack_from(self._shm.buf, 0)[5]
+        HISTORY_HEADER.pack_into(self._shm.buf, 0, HISTORY_MAGIC, HISTORY_VERSION, self._layout.max_tags,
+                                 self._layout.capacity, self._catalog_lock, catalog_length,
+                                 self._layout.catalog_capacity)
+
+
+class HistoryReader:
+    """
+    Reads the per-tag rings of a history segment without taking a lock.
+    Every reader keeps its own position (the snapshot seq it has read up to), the writer never waits for a reader.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self._shm = shm
+        self._layout: _RingLayout | None = None
+        self._catalog_lock = 0
+        self._indices: dict[str, int] = {}
+        self.var_types: dict[str, str] = {}
+        self.lost_samples = 0  # Samples overwritten while they were read
+        self.overruns = 0  # Calls of since() that asked for more samples than the ring still holds
+
+    @property
+    def tags(self) -> list[str]:
+        """
+        Names of all recorded tags.
+        """
+        self._refresh_catalog()
+        return list(self._indices)
+
+    def last(self, name: str, n: int) -> list[tuple[int, float, float]]:
+        """
+        Read the last `n` samples of a tag.
+        :return: List of (snapshot seq, timestamp, value), oldest first
+        """
+        index = self._index(name)
+        if index is None:
+            return []
+        head = INT64.unpack_from(self._shm.buf, self._layout.head_offset(index))[0]
+        return self._read(index, max(head - n, 0), head)
+
+    def since(self, name: str, seq: int) -> list[tuple[int, float, float]]:
+        """
+        Read all samples of a tag that were published after snapshot `seq`.
+        :return: List of (snapshot seq, timestamp, value), oldest first. If the reader fell behind by `capacity` samples
+                 or more, the oldest samples are missing and `overruns` is incremented
+        """
+        index = self._index(name)
+        if index is None:
+            return []
+        head = INT64.unpack_from(self._shm.buf, self._layout.head_offset(index))[0]
+        seq_offset = self._layout.ring_offsets(index)[0]
+        capacity = self._layout.capacity
+
+        def seq_of(n: int) -> int:
+            return UINT64.unpack_from(self._shm.buf, seq_offset + (n % capacity) * UINT64.size)[0]
+
+        # Walk back from the newest sample to the first one after `seq` (samples are ordered by seq)
+        start = head
+        while start > max(head - capacity + 1, 0):
+            if seq_of(start - 1) <= seq:
+                break
+            start -= 1
+        else:
+            # Sample `head - capacity` may be being overwritten. It is not read, its seq (old or new) only tells
+            # whether samples after `seq` are missing
+            if start > 0 and seq_of(start - 1) > seq:
+                self.overruns += 1
+        return self._read(index, start, head)
+
+    def since_all(self, seq: int) -> dict[str, list[tuple[int, float, float]]]:
+        """
+        Read the samples of all tags that were published after snapshot `seq`.
+        :return: Dictionary mapping tag names to their samples, tags without new samples are omitted
+        """
+        samples = {}
+        for name in self.tags:
+            tag_samples = self.since(name, seq)
+            if tag_samples:
+                samples[name] = tag_samples
+        return samples
+
+    def views(self, name: str) -> tuple[int, memoryview, memoryview, memoryview] | None:
+        """
+        Zero-copy access to the ring of a tag for vectorized consumers.
+        :return: Tuple of (head, seq array, timestamp array, value array) as typed memoryviews into the segment.
+                 Sample `n` is at position `n % capacity`; samples older than `head - capacity + 1` are overwritten
+                 or being overwritten.
+                 The views must be released before the segment is closed
+        """
+        index = self._index(name)
+        if index is None:
+            return None
+        capacity = self._layout.capacity
+        seq_offset, timestamp_offset, value_offset = self._layout.ring_offsets(index)
+        buf = self._shm.buf
+        head = INT64.unpack_from(buf, self._layout.head_offset(index))[0]
+        return (head, buf[seq_offset:seq_offset + capacity * UINT64.size].cast('Q'),
+                buf[timestamp_offset:timestamp_offset + capacity * DOUBLE.size].cast('d'),
+                buf[value_offset:value_offset + capacity * DOUBLE.size].cast('d'))
+
+    def _read(self, index: int, start: int, head: int) -> list[tuple[int, float, float]]:
+        """
+        Read the samples [start, head) of a tag and drop the ones the writer overwrote while they were read.
+        """
+        capacity = self._layout.capacity
+        start = max(start, head - capacity + 1)
+        seq_offset, timestamp_offset, value_offset = self._layout.ring_offsets(index)
+        buf = self._shm.buf
+        samples = []
+        for n in range(start, head):
+            position = n % capacity
+            samples.append((UINT64.unpack_from(buf, seq_offset + position * UINT64.size)[0],
+                            DOUBLE.unpack_from(buf, timestamp_offset + position * DOUBLE.size)[0],
+                            DOUBLE.unpack_from(buf, value_offset + position * DOUBLE.size)[0]))
+        new_head = INT64.unpack_from(buf, self._layout.head_offset(index))[0]
+        overwritten = new_head - capacity + 1 - start
+        if overwritten > 0:
+            self.lost_samples += overwritten
+            samples = samples[overwritten:]
+        return samples
+
+    def _index(self, name: str) -> int | None:
+        index = self._indices.get(name)
+        if index is None:
+            self._refresh_catalog()
+            index = self._indices.get(name)
+        return index
+
+    def _refresh_catalog(self) -> None:
+        header = HISTORY_HEADER.unpack_from(self._shm.buf, 0)
+        magic, version, max_tags, capacity, lock, catalog_length, catalog_capacity = header
+        if magic != HISTORY_MAGIC:
+            return
+        if version != HISTORY_VERSION:
+            raise ValueError(f"Unsupported history layout version {version} (expected {HISTORY_VERSION}).")
+        if lock == self._catalog_lock or lock & 1:
+            return  # Unchanged or being written, retry on the next call
+        catalog = bytes(self._shm.buf[HISTORY_HEADER_SIZE:HISTORY_HEADER_SIZE + catalog_length])
+        if HISTORY_HEADER.unpack_from(self._shm.buf, 0)[4] != lock:
+            return
+        if self._layout is None:
+            self._layout = _RingLayout(max_tags, capacity, catalog_capacity)
+        self._indices = {}
+        self.var_types = {}
+        for index, (name, var_type) in enumerate(json.loads(catalog)):
+            self._indices[name] = index
+            self.var_types[name] = var_type
+        self._catalog_lock = lock
@@ -0,0 +1,181 @@
+"""
+Binary layout of the shared memory snapshots published by the data aggregation partition.
+
+Segment layout:
+    control  CONTROL_SIZE bytes, see CONTROL. Holds the sequence number of the last published snapshot
+    buffers  BUFFER_COUNT snapshot buffers of `buffer_size` bytes each. Snapshot `seq` is written to buffer
+             `seq % BUFFER_COUNT`, so the producer never overwrites the snapshot that is currently published
+
+Buffer layout:
+    header   HEADER_SIZE bytes, see HEADER
+    catalog  JSON list of slots (name, varType, description, kind, offset, capacity), rewritten only when tags
+             are added or change their type
+    values   one fixed-size slot per tag: SLOT_HEADER followed by 8 value bytes (numeric kinds) or
+             `capacity` bytes (string kinds)
+    changes  slot indices (INDEX) of the tags that changed since snapshot `seq - 1`
+
+Every buffer always holds the complete state, the change list lets readers that read snapshot `seq - 1`
+decode only the changed slots (delta). Keyframes (FLAG_KEYFRAME) list every slot and are published periodically
+and whenever the catalog changes.
+
+With FORMAT_JSON a buffer holds the header followed by the JSON encoded value dictionary (fallback format).
+
+Every buffer is protected by a seqlock: the first field of its header is a counter that the producer makes odd
+before and even after writing the buffer. Readers never write to the segment. They check that the counter is even
+and unchanged after decoding and retry otherwise, so neither side ever waits for the other.
+
+Segments are growable. A producer publishes under a name, e.g. `opcua_shm`:
+    `<name>_ctl`           control segment of SEGMENT_CONTROL_SIZE bytes, see SEGMENT_CONTROL. Holds the generation
+                           of the current data segment
+    `<name>_<generation>`  data segment with the layout above
+When a snapshot does not fit, the producer creates a larger data segment with the next generation, publishes the
+snapshot there and then bumps the generation. Readers check the generation before every read and re-attach.
+
+A producer can also publish the tags it is going to acquire once at startup, before any value has been read:
+    `<name>_catalog`       TAG_CATALOG header followed by a JSON list of [name, varType, description]. The header is
+                           written after the list, so a reader that finds the magic finds the complete list
+"""
+import json
+import struct
+
+MAGIC = b"SIOT"
+LAYOUT_VERSION = 3
+
+FORMAT_BINARY = 0
+FORMAT_JSON = 1
+
+# magic, version, buffer count, seq of the last published snapshot, buffer size
+CONTROL = struct.Struct("<4sHHQI")
+CONTROL_SIZE = 64
+BUFFER_COUNT = 2
+
+# seqlock counter, format, flags, seq, catalog version, catalog offset, catalog length, values offset, values length,
+# payload length, publish timestamp, changes offset, number of changes (offsets are relative to the start of the buffer)
+HEADER = struct.Struct("<QHHQIIIIIIdII")
+HEADER_SIZE = 64
+LOCK = struct.Struct("<Q")
+INDEX = struct.Struct("<I")
+
+# magic, version, generation of the current data segment, size of the current data segment
+SEGMENT_CONTROL = struct.Struct("<4sH2xQQ")
+SEGMENT_CONTROL_SIZE = 64
+SEGMENT_MAGIC = b"SIOG"
+SEGMENT_VERSION = 1
+# magic, version, length of the JSON list
+TAG_CATALOG = struct.Struct("<4sH2xI")
+TAG_CATALOG_SIZE = 16
+TAG_CATALOG_MAGIC = b"SIOC"
+TAG_CATALOG_VERSION = 1
+# Upper limit for growing a data segment
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+PAGE_SIZE = 4096
+
+FLAG_KEYFRAME = 0x01
+# Number of snapshots after which a keyframe is published even if the catalog did not change
+KEYFRAME_INTERVAL = 60
+
+# Interval in seconds in which consumers check the control block for a new snapshot
+POLL_INTERVAL = 0.002
+
+# kind, status, length of string payload, timestamp
+SLOT_HEADER = struct.Struct("<BBH4xd")
+INT64 = struct.Struct("<q")
+DOUBLE = struct.Struct("<d")
+
+KIND_BOOL = 0
+KIND_INT = 1
+KIND_FLOAT = 2
+KIND_STRING = 3
+KIND_JSON = 4  # Values that are not scalars (e.g. arrays), stored as JSON text
+
+STATUS_STALE = 0x01
+STATUS_BAD = 0x02
+
+NUMERIC_SIZE = 8
+MIN_STRING_CAPACITY = 64
+
+# Bytes reserved per tag name if the final name is only known after connecting (e.g. OPC UA browse names)
+NAME_ALLOWANCE = 64
+# JSON punctuation, kind, offset and capacity of a catalog entry
+CATALOG_ENTRY_OVERHEAD = 48
+
+INT_TYPES = {"SByte", "Byte", "Int16", "UInt16", "Int32", "UInt32", "Int64"}
+FLOAT_TYPES = {"Float", "Double"}
+
+
+class SnapshotOverflowError(ValueError):
+    """
+    Raised when a snapshot does not fit into its shared memory segment.
+    `required_bytes` is the buffer size the snapshot needs.
+    """
+    def __init__(self, message: str, required_bytes: int = 0):
+        super().__init__(message)
+        self.required_bytes = required_bytes
+
+
+def kind_of(var_type: str, value) -> int:
+    """
+    Determine the slot kind of a tag from its OPC UA datatype and its current value.
+    """
+    if var_type == "Boolean" and isinstance(value, bool):
+        return KIND_BOOL
+    if var_type in INT_TYPES and isinstance(value, int):
+        return KIND_INT
+    if var_type in FLOAT_TYPES and isinstance(value, (int, float)):
+        return KIND_FLOAT
+    if isinstance(value, str):
+        return KIND_STRING
+    if isinstance(value, bool):
+        return KIND_BOOL
+    if isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        return KIND_INT
+    if isinstance(value, float):
+        return KIND_FLOAT
+    return KIND_JSON
+
+
+def slot_size(kind: int, capacity: int) -> int:
+    """
+    Size of a value slot in bytes (always a multiple of 8).
+    """
+    data_size = NUMERIC_SIZE if kind in (KIND_BOOL, KIND_INT, KIND_FLOAT) else capacity
+    return SLOT_HEADER.size + align8(data_size)
+
+
+def align8(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def control_segment_name(name: str) -> str:
+    return f"{name}_ctl"
+
+
+def data_segment_name(name: str, generation: int) -> str:
+    return f"{name}_{generation}"
+
+
+def tag_catalog_segment_name(name: str) -> str:
+    return f"{name}_catalog"
+
+
+def segment_size(buffer_size: int) -> int:
+    """
+    Size of a data segment whose buffers hold at least `buffer_size` bytes, rounded up to whole pages.
+    """
+    size = CONTROL_SIZE + BUFFER_COUNT * align8(buffer_size)
+    return (size + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+
+
+def snapshot_segment_size(tags: list[tuple[str, str, str]], headroom: float = 2.0) -> int:
+    """
+    Size of a data segment for the tag catalog of a producer. Every tag is sized for a string slot, as any tag is
+    published as a string while its server reports read errors.
+    :param tags: List of (name, varType, description) of all tags the producer publishes
+    :param headroom: Factor for tags that are added at runtime and for strings longer than MIN_STRING_CAPACITY
+    """
+    buffer_size = HEADER_SIZE
+    for name, var_type, description in tags:
+        catalog_entry = (max(len(json.dumps(name)), NAME_ALLOWANCE) + len(json.dumps(var_type))
+                         + len(json.dumps(description)) + CATALOG_ENTRY_OVERHEAD)
+        buffer_size += catalog_entry + slot_size(KIND_STRING, MIN_STRING_CAPACITY) + INDEX.size
+    return segment_size(int(buffer_size * headroom))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from mo_pipeline import STATISTICS, WindowedAggregator
+
+WINDOWS = [5.0, 30.0, 200.0]
+
+
+def reference(samples: list[tuple[float, float]], capacity: int, window: float, now: float,
+              threshold: float) -> dict[str, float]:
+    """
+    Statistics of one tag computed naively from the samples still in its ring.
+    """
+    kept = samples[-capacity:]
+    if not kept:
+        return {'min': np.nan, 'max': np.nan, 'mean': np.nan, 'std': np.nan, 'rate': np.nan, 'crossings': 0}
+    inside = [(t, v) for t, v in kept if t >= now - window]
+    if not inside:  # The tag held its last value for the whole window
+        last = kept[-1][1]
+        return {'min': last, 'max': last, 'mean': last, 'std': 0.0, 'rate': 0.0, 'crossings': 0}
+    times = np.array([t for t, _ in inside])
+    values = np.array([v for _, v in inside])
+    duration = times[-1] - times[0]
+    above = values > threshold
+    return {'min': values.min(), 'max': values.max(), 'mean': values.mean(), 'std': values.std(),
+            'rate': (values[-1] - values[0]) / duration if duration > 0 else 0.0,
+            'crossings': int(np.count_nonzero(above[1:] != above[:-1]))}
+
+
+@pytest.mark.parametrize('max_tags', [5, 300])  # One chunk and several chunks of tags
+def test_matches_naive_reference(max_tags):
+    rng = np.random.default_rng(7)
+    thresholds = {f"tag{i}": 0.5 for i in range(0, max_tags, 2)}
+    aggregator = WindowedAggregator(WINDOWS, max_tags=max_tags, memory_budget=max_tags * 16 * 48,
+                                    thresholds=thresholds)
+    assert aggregator.capacity < 40  # The rings wrap around
+    samples = {f"tag{i}": [] for i in range(max_tags - 1)}  # The last tag never gets a sample
+    now = 1000.0
+    for step in range(150):
+        now += rng.uniform(0.5, 2.0)
+        changed = [name for name in samples if rng.random() < 0.4]
+        snapshot = {}
+        for name in changed:
+            value = float(rng.random()) if name in thresholds else float(rng.normal(1e6, 1e-2))
+            snapshot[name] = {'value': value, 'timestamp': now}
+            samples[name].append((now, value))
+        aggregator.update('OPC UA', snapshot)
+
+    for end in (now, now + 10.0, now + 1000.0):
+        results = aggregator.compute(end)
+        for window in WINDOWS:
+            for name, tag_samples in samples.items():
+                expected = reference(tag_samples, aggregator.capacity, window, end, thresholds.get(name, np.nan))
+                index = aggregator.tags.index(name) if tag_samples else None
+                if index is None:
+                    assert name not in aggregator.tags
+                    continue
+                for statistic in STATISTICS:
+                    assert results[window][statistic][index] == pytest.approx(expected[statistic], rel=1e-9,
+                                                                               abs=1e-12, nan_ok=True), \
+                        (name, window, statistic)
+
+
+def test_std_of_small_variations_of_large_values():
+    aggregator = WindowedAggregator([100.0], max_tags=1, memory_budget=64 * 1024)
+    values = 1e6 + np.array([0.0, 0.001, 0.002, 0.001, 0.0])
+    for n, value in enumerate(values):
+        aggregator.update('ModbusTCP', {'Meter: Energy': {'value': float(value), 'timestamp': 1000.0 + n}})
+    std = aggregator.compute(1010.0)[100.0]['std'][0]
+    assert std == pytest.approx(values.std(), rel=1e-6)
+    assert std > 0
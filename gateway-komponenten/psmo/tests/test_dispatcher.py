@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from psmo_shm_handler import (Dispatcher, POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_KEEP_LATEST, POLICY_MERGE,
+                              SourceQueue)
+
+
+def drain(dispatcher: Dispatcher) -> list[tuple[str, dict]]:
+    items = []
+    while (item := dispatcher.get(timeout=0)) is not None:
+        items.append(item)
+    return items
+
+
+def test_items_are_delivered_in_arrival_order_across_sources():
+    dispatcher = Dispatcher()
+    opcua = dispatcher.source('OPC UA')
+    modbus = dispatcher.source('ModbusTCP')
+    opcua.put({'a': 1})
+    modbus.put({'b': 1})
+    opcua.put({'a': 2})
+    assert drain(dispatcher) == [('OPC UA', {'a': 1}), ('ModbusTCP', {'b': 1}), ('OPC UA', {'a': 2})]
+    assert dispatcher.get(timeout=0.01) is None
+
+
+def test_run_calls_the_hooks_of_the_source_until_stopped():
+    dispatcher = Dispatcher()
+    opcua = dispatcher.source('OPC UA')
+    dispatcher.source('ModbusTCP')
+    calls = []
+    dispatcher.register('OPC UA', lambda source, item: calls.append((source, item)))
+    dispatcher.register('OPC UA', lambda source, item: 1 / 0)  # A failing hook does not stop the others
+    dispatcher.register('ModbusTCP', lambda source, item: calls.append((source, item)))
+    thread = threading.Thread(target=dispatcher.run)
+    thread.start()
+    opcua.put({'a': 1})
+    opcua.put({'a': 2})
+    deadline = time.monotonic() + 5
+    while len(calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dispatcher.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert calls == [('OPC UA', {'a': 1}), ('OPC UA', {'a': 2})]
+
+
+def full_source(policy: str) -> tuple[Dispatcher, SourceQueue]:
+    """
+    Dispatcher with a source queue of two items that is already full.
+    """
+    dispatcher = Dispatcher()
+    source = dispatcher.source('OPC UA', maxsize=2, policy=policy)
+    source.put({'a': 1})
+    source.put({'b': 1})
+    return dispatcher, source
+
+
+def test_block_waits_for_room():
+    dispatcher, source = full_source(POLICY_BLOCK)
+    with pytest.raises(queue.Full):
+        source.put({'c': 1}, block=False)
+    with pytest.raises(queue.Full):
+        source.put({'c': 1}, timeout=0.01)
+
+    thread = threading.Thread(target=source.put, args=({'c': 1},))
+    thread.start()
+    thread.join(0.05)
+    assert thread.is_alive()  # The reader thread is stalled until the dispatcher takes an item
+    assert dispatcher.get() == ('OPC UA', {'a': 1})
+    thread.join(5)
+    assert not thread.is_alive()
+    assert drain(dispatcher) == [('OPC UA', {'b': 1}), ('OPC UA', {'c': 1})]
+    assert source.stats()['blocked'] == 3
+    assert not source.take_resync()
+
+
+def test_drop_oldest():
+    dispatcher, source = full_source(POLICY_DROP_OLDEST)
+    source.put({'c': 1})
+    source.put({'d': 1})
+    assert drain(dispatcher) == [('OPC UA', {'c': 1}), ('OPC UA', {'d': 1})]
+    assert source.stats()['dropped'] == 2
+    assert source.take_resync()  # The reader thread hands over the full state next
+    assert not source.take_resync()
+
+
+def test_keep_latest():
+    dispatcher, source = full_source(POLICY_KEEP_LATEST)
+    source.put({'c': 1})
+    assert drain(dispatcher) == [('OPC UA', {'c': 1})]
+    assert source.stats()['coalesced'] == 2
+    assert source.take_resync()
+
+
+def test_merge():
+    dispatcher, source = full_source(POLICY_MERGE)
+    source.put({'b': 2, 'c': 1})
+    source.put({'c': 2})
+    assert drain(dispatcher) == [('OPC UA', {'a': 1}), ('OPC UA', {'b': 2, 'c': 2})]
+    assert source.stats()['merged'] == 2
+    assert not source.take_resync()  # No change was lost
+
+
+@pytest.mark.parametrize('policy', [POLICY_DROP_OLDEST, POLICY_KEEP_LATEST, POLICY_MERGE])
+def test_policies_never_block_the_reader_thread(policy):
+    dispatcher, source = full_source(policy)
+    for i in range(100):
+        source.put({'c': i}, block=False)
+    assert source.qsize() <= 2
+    assert source.stats()['blocked'] == 0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Dispatcher().source('OPC UA', maxsize=2, policy='newest')
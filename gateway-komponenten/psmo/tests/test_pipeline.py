@@ -0,0 +1,98 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from mo_pipeline import LimitMonitor, Pipeline, Plugin, TagFrame, STATUS_BAD, STATUS_MISSING, STATUS_STALE
+
+
+class Echo(Plugin):
+    """
+    Returns the values and status flags of its frame, after `delay` seconds.
+    """
+    def __init__(self, name: str, source: str, tags: list[str], delay: float = 0.0):
+        super().__init__(name, source, tags)
+        self.delay = delay
+
+    def process(self, frame: TagFrame) -> dict:
+        time.sleep(self.delay)
+        if 'fail' in frame.tags and frame['fail'] == 1.0:
+            raise ValueError("Failed on purpose")
+        return {'values': frame.as_dict(), 'status': {name: frame.status_of(name) for name in frame.tags}}
+
+
+class Results:
+    """
+    Result hook that collects the results per plugin and lets a test wait for them.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.results: dict[str, list[dict]] = {}
+
+    def __call__(self, plugin: str, result: dict) -> None:
+        with self._condition:
+            self.results.setdefault(plugin, []).append(result)
+            self._condition.notify_all()
+
+    def wait(self, plugin: str, count: int, timeout: float = 30.0) -> list[dict]:
+        with self._condition:
+            assert self._condition.wait_for(lambda: len(self.results.get(plugin, [])) >= count, timeout)
+            return self.results[plugin]
+
+
+@pytest.fixture
+def make_pipeline():
+    pipelines = []
+
+    def make(plugins: list[Plugin]) -> tuple[Pipeline, Results]:
+        pipeline = Pipeline(plugins, max_workers=2, arena_name=f"test_pipeline_{uuid.uuid4().hex[:12]}")
+        results = Results()
+        pipeline.add_result_hook(results)
+        pipelines.append(pipeline)
+        return pipeline, results
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.close()
+
+
+def value(number: float, **flags) -> dict:
+    return {'value': number, 'varType': 'Double', 'description': 'Test tag', **flags}
+
+
+def test_plugins_get_the_state_of_their_source(make_pipeline):
+    pipeline, results = make_pipeline([Echo('echo', 'OPC UA', ['a', 'b', 'c', 'd']),
+                                       LimitMonitor('limits', 'ModbusTCP', {'p': (0.0, 10.0)}),
+                                       Echo('unrelated', 'OPC UA', ['x'])])
+    assert pipeline.subscriptions('OPC UA') == {'a', 'b', 'c', 'd', 'x'}
+    pipeline.submit('OPC UA', {'a': value(1.5), 'b': value(2.0, stale=True), 'c': value(3.0, status='bad'),
+                               'text': {'value': 'on', 'varType': 'String', 'description': 'Not numeric'}})
+    pipeline.submit('ModbusTCP', {'p': value(12.0)})
+    echo = results.wait('echo', 1)[0]
+    assert echo['values'] == {'a': 1.5, 'b': 2.0, 'c': 3.0}
+    assert echo['status'] == {'a': 0, 'b': STATUS_STALE, 'c': STATUS_BAD, 'd': STATUS_MISSING}
+    assert results.wait('limits', 1) == [{'p': {'value': 12.0, 'limit': 10.0, 'violation': 'high'}}]
+    pipeline.close()  # Waits for all runs
+    assert 'unrelated' not in results.results  # None of its tags changed
+
+
+def test_changes_while_busy_are_coalesced_and_processed(make_pipeline):
+    pipeline, results = make_pipeline([Echo('slow', 'OPC UA', ['a', 'b'], delay=0.5)])
+    pipeline.submit('OPC UA', {'a': value(1.0), 'b': value(1.0)})
+    for number in range(2, 6):
+        pipeline.submit('OPC UA', {'a': value(float(number))})  # Arrive while the first run is busy
+    pipeline.submit('OPC UA', {'b': value(9.0)})
+    # The source stays quiet now: the coalesced changes are still processed, on the newest values, in one run
+    processed = results.wait('slow', 2)
+    time.sleep(1.0)
+    assert [result['values'] for result in processed] == [{'a': 1.0, 'b': 1.0}, {'a': 5.0, 'b': 9.0}]
+    assert pipeline.coalesced['slow'] == 5
+
+
+def test_failing_plugin_is_counted(make_pipeline):
+    pipeline, results = make_pipeline([Echo('failing', 'OPC UA', ['fail'])])
+    pipeline.submit('OPC UA', {'fail': value(1.0)})
+    pipeline.submit('OPC UA', {'fail': value(0.0)})
+    results.wait('failing', 1)
+    assert pipeline.failures['failing'] == 1